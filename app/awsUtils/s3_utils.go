@@ -71,6 +71,19 @@ func DownloadFromS3(bucket string, item string, onAws bool, s3Client *session.Se
 
 }
 
+// ExistsInS3 checks for an item without downloading it. Any error is treated as the item not being there
+func ExistsInS3(bucket string, item string, s3Client *session.Session) bool {
+	_, err := s3.New(s3Client).HeadObject(&s3.HeadObjectInput{
+		Bucket: aws.String(bucket),
+		Key:    aws.String(item),
+	})
+	if err != nil {
+		log.Printf("Item %v not found in bucket %v, %v", item, bucket, err)
+		return false
+	}
+	return true
+}
+
 func UploadToS3(bucket string, item string, runningOnAws bool, s3Client *session.Session) {
 	var s3Item string
 	log.Println("Uploading to S3 item", item, "to bucket", bucket)
@@ -0,0 +1,71 @@
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+
+try:  # need modules for pytest to work
+    from app.mlcode.utils import setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from utils import setup_logging
+
+__all__ = ["align_to_daily_calendar", "find_gaps"]
+
+logger = setup_logging()
+
+
+def find_gaps(missing_dates: pd.DatetimeIndex) -> List[Tuple[str, str]]:
+    """Group sorted daily dates into (first, last) runs of consecutive days"""
+    if len(missing_dates) == 0:
+        return []
+    new_run = missing_dates.to_series().diff() != pd.Timedelta(days=1)
+    run_ids = new_run.cumsum().to_numpy()
+    return [
+        (run.min().strftime("%Y-%m-%d"), run.max().strftime("%Y-%m-%d"))
+        for _, run in missing_dates.to_series().groupby(run_ids)
+    ]
+
+
+def align_to_daily_calendar(
+    frames: List[pd.DataFrame], names: List[str]
+) -> Tuple[List[pd.DataFrame], Dict[str, Dict[str, Any]]]:
+    """
+    Put every frame on the daily calendar of the first frame (the coin we predict) in one pass.
+
+    Missing days are forward filled, e.g. weekends and holidays for TBT. Days before a frame's first row are back
+    filled from that row. Rows outside the calendar are dropped.
+
+    Args:
+        frames (List[pd.DataFrame]): date indexed frames, the first one sets the calendar
+        names (List[str]): a name for each frame, used in the report
+
+    Returns:
+        Tuple[List[pd.DataFrame], Dict[str, Dict[str, Any]]]: the aligned frames, in the same order, and the days
+            that were filled for each frame
+    """
+    if len(frames) != len(names):
+        raise ValueError(f"Need a name for every frame, have {len(frames)} frames and {len(names)} names")
+    for name, df in zip(names, frames):
+        if not isinstance(df.index, pd.DatetimeIndex) or not (df.index == df.index.normalize()).all():
+            raise ValueError(f"{name} needs a daily DatetimeIndex to be aligned")
+
+    calendar = pd.date_range(frames[0].index.min(), frames[0].index.max(), freq="D", name=frames[0].index.name)
+    # duplicate dates can't be aligned, keep the newest row like a later candle overwriting an earlier one
+    frames = [df[~df.index.duplicated(keep="last")] for df in frames]
+
+    # one wide frame, one reindex and one fill for every frame instead of a pass per frame and per column
+    wide_df = pd.concat(frames, axis=1, keys=range(len(frames))).reindex(calendar)
+    observed = pd.concat([wide_df[i].notna().any(axis=1) for i in range(len(frames))], axis=1, keys=range(len(frames)))
+    wide_df = wide_df.ffill().bfill()
+
+    aligned_frames = []
+    report = {}
+    for i, name in enumerate(names):
+        aligned_df = wide_df[i].copy()
+        aligned_df.columns = frames[i].columns
+        aligned_frames.append(aligned_df)
+
+        missing_dates = calendar[~observed[i].to_numpy()]
+        report[name] = {"filled_days": len(missing_dates), "gaps": find_gaps(missing_dates)}
+        if len(missing_dates) > 0:
+            logger.info("Filled %s missing days for %s", len(missing_dates), name)
+            logger.debug("Filled gaps for %s = %s", name, report[name]["gaps"])
+    return aligned_frames, report
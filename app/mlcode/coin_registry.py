@@ -0,0 +1,98 @@
+import os
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+
+try:  # need modules for pytest to work
+    from app.mlcode.utils import read_in_data, resolve_aws_path, setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from utils import read_in_data, resolve_aws_path, setup_logging
+
+__all__ = ["COIN_REGISTRY", "get_coin_spec", "LazyPriceData"]
+
+logger = setup_logging()
+
+# Which historical csvs and models each coin needs. Values are keys into constants.yml.
+# input_csv is the coin we predict, additional_csvs are the covariates used by the predictor (order matters).
+# nbeats_modelname and tcn_modelname name the coin's models, tcn_filename is where the tcn was saved
+COIN_REGISTRY: Dict[str, Dict[str, Any]] = {
+    coin: {
+        "input_csv": input_csv,
+        "additional_csvs": additional_csvs,
+        "nbeats_modelname": f"nbeats_modelname_{coin}",
+        "tcn_modelname": f"tcn_modelname_{coin}",
+        "tcn_filename": f"tcn_filename_{coin}",
+    }
+    for coin, input_csv, additional_csvs in [
+        ("btc", "bitcoin_csv_filename", ["etherum_csv_filename", "tbt_csv_filename"]),
+        ("eth", "etherum_csv_filename", ["bitcoin_csv_filename", "tbt_csv_filename"]),
+        ("sol", "sol_csv_filename", ["bitcoin_csv_filename", "tbt_csv_filename"]),
+        ("matic", "matic_csv_filename", ["bitcoin_csv_filename", "tbt_csv_filename"]),
+        ("link", "link_csv_filename", ["bitcoin_csv_filename", "tbt_csv_filename"]),
+    ]
+}
+
+
+def get_coin_spec(coin_to_predict: str) -> Dict[str, Any]:
+    """Look up the csvs a coin needs. Raises a ValueError for coins we don't trade"""
+    if coin_to_predict not in COIN_REGISTRY:
+        raise ValueError(
+            f"Incorrect coin to predict {coin_to_predict}. Should be one of {', '.join(COIN_REGISTRY.keys())}"
+        )
+    return COIN_REGISTRY[coin_to_predict]
+
+
+class LazyPriceData:
+    def __init__(self, constants: Dict[str, Any], running_on_aws: bool):
+        """Reads the historical price csvs on first use and keeps them in memory.
+
+        Only the files a coin needs are parsed, and a file shared by several coins (btc, tbt) is parsed once.
+
+        Args:
+            constants (Dict[str, Any]): The constants read in from yaml
+            running_on_aws (bool): are we on lambda?
+        """
+        self.constants = constants
+        self.running_on_aws = running_on_aws
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._file_stats: Dict[str, Tuple[int, int]] = {}
+
+    def _file_stat(self, csv_key: str) -> Tuple[int, int]:
+        stat = os.stat(resolve_aws_path(self.constants[csv_key], self.running_on_aws))
+        return stat.st_size, stat.st_mtime_ns
+
+    def get(self, csv_key: str) -> pd.DataFrame:
+        """Return the frame for a constants.yml csv key, reading it in if we haven't yet"""
+        if csv_key not in self._frames:
+            logger.info("Loading %s", csv_key)
+            # stat before reading, if the file changes while we read it the next refresh_stale catches it
+            self._file_stats[csv_key] = self._file_stat(csv_key)
+            self._frames[csv_key] = read_in_data(
+                self.constants[csv_key], self.running_on_aws, self.constants["date_col"]
+            )
+        return self._frames[csv_key]
+
+    def get_input_df(self, coin_to_predict: str) -> pd.DataFrame:
+        return self.get(get_coin_spec(coin_to_predict)["input_csv"])
+
+    def get_additional_dfs(self, coin_to_predict: str) -> List[pd.DataFrame]:
+        return [self.get(csv_key) for csv_key in get_coin_spec(coin_to_predict)["additional_csvs"]]
+
+    def refresh_stale(self) -> List[str]:
+        """Forget the frames whose csv changed on disk since we read it (the Go app appends new candles).
+        They are read again on next use. Returns the csv keys that were dropped"""
+        stale_keys = [
+            csv_key
+            for csv_key, file_stat in self._file_stats.items()
+            if not os.path.exists(resolve_aws_path(self.constants[csv_key], self.running_on_aws))
+            or self._file_stat(csv_key) != file_stat
+        ]
+        for csv_key in stale_keys:
+            logger.info("%s changed on disk, will read it in again", csv_key)
+            del self._frames[csv_key]
+            del self._file_stats[csv_key]
+        return stale_keys
+
+    @property
+    def loaded_keys(self) -> List[str]:
+        return list(self._frames.keys())
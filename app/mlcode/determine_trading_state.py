@@ -68,25 +68,25 @@ class DetermineTradingState:
         # trading state args
         for k, v in self.trading_state_constants.items():
             setattr(self, k, v)
-            logger.info(f"Setting the class var self.{k} = {v}")
+            logger.debug("Setting the class var self.%s = %s", k, v)
 
         # Record keeping for how this program is doing
         for k, v in self.won_and_lose_amount_dict.items():
             setattr(self, k, v)
-            logger.info(f"Setting the class var self.{k} = {v}")
+            logger.debug("Setting the class var self.%s = %s", k, v)
 
         # actions to take
         for k, v in self.actions_to_take_constants.items():
             setattr(self, k, v)
-            logger.info(f"Setting the class var self.{k} = {v}")
+            logger.debug("Setting the class var self.%s = %s", k, v)
 
     def calculate_positions(self) -> None:
 
         # grab the last row, and verify the date is equal to yesterday's date
         row = self.prediction_df.iloc[-1:]
-        logger.info(f"current row = {row}")
+        logger.debug("current row = %s", row)
         prev_row = self.prediction_df.iloc[-2:-1]
-        logger.info(f"prev_row = {prev_row}")
+        logger.debug("prev_row = %s", prev_row)
         # assert date is yesterday date
         today = datetime.utcnow().date()
         yesterday = pd.to_datetime(today - timedelta(days=1))
@@ -0,0 +1,152 @@
+import os
+import pickle
+import re
+from typing import Any, Dict, Iterator, List, MutableMapping, Tuple, Union
+
+try:  # need modules for pytest to work
+    from app.mlcode.utils import resolve_aws_path, setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from utils import resolve_aws_path, setup_logging
+
+__all__ = ["FeatureStore", "open_feature_store"]
+
+logger = setup_logging()
+
+# keys become file names
+_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_.\-]{1,200}$")
+# no "csv" or "yml" in the name, the go app uploads every /tmp file with those in it to S3
+_ENTRY_SUFFIX = ".features.pkl"
+
+
+class FeatureStore(MutableMapping[str, Any]):
+    def __init__(self, directory: str, max_size_mb: float = 256):
+        """Features kept on disk between runs, one pickle per key. Usable anywhere a feature_cache dict is.
+
+        Features and trained models are content addressed (a hash of the input data plus the params they were
+        built with), so those entries never go stale, they just stop being asked for. The seconds per epoch of each
+        model (training_schedule.epoch_seconds_key) aren't: they are overwritten every run under the model's name,
+        and this process keeps the copy it last read or wrote. Once the files are over max_size_mb the least
+        recently used ones are evicted. A write counts as a use, so the timings of the models still running are
+        among the last to go, and losing one only leaves the scheduler without an estimate for that model.
+        Entries read or written by this process are also kept in memory.
+        Only point it at a directory this app writes, entries are unpickled.
+
+        Args:
+            directory (str): where the entries are kept, created if missing
+            max_size_mb (float, optional): evict least recently used entries past this size
+        """
+        self.directory = directory
+        self.max_size_bytes = int(max_size_mb * 1024**2)
+        self._loaded: Dict[str, Any] = {}
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        if not _KEY_PATTERN.match(key):
+            raise ValueError(f"Feature store keys can only have letters, digits, '_', '.' and '-', got {key}")
+        return os.path.join(self.directory, key + _ENTRY_SUFFIX)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and (key in self._loaded or os.path.exists(self._path(key)))
+
+    def __getitem__(self, key: str) -> Any:
+        path = self._path(key)
+        if key not in self._loaded:
+            try:
+                with open(path, "rb") as f:
+                    self._loaded[key] = pickle.load(f)
+            except FileNotFoundError:
+                raise KeyError(key) from None
+            except Exception as e:  # a corrupt or half written entry, build it again
+                logger.warning("Dropping unreadable feature store entry %s: %s", path, e)
+                self._remove_file(path)
+                raise KeyError(key) from None
+        self._touch(path)
+        return self._loaded[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        tmp_filename = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_filename, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, path)  # readers never see a half written entry
+        except OSError as e:
+            # still usable for this process, just not saved
+            logger.warning("Unable to write feature store entry %s: %s", path, e)
+            self._remove_file(tmp_filename)
+        self._loaded[key] = value
+        self._evict(keep=path)
+
+    def __delitem__(self, key: str) -> None:
+        path = self._path(key)
+        if key not in self._loaded and not os.path.exists(path):
+            raise KeyError(key)
+        self._loaded.pop(key, None)
+        self._remove_file(path)
+
+    def __iter__(self) -> Iterator[str]:
+        keys = {name[: -len(_ENTRY_SUFFIX)] for name in os.listdir(self.directory) if name.endswith(_ENTRY_SUFFIX)}
+        return iter(sorted(keys | set(self._loaded)))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def release_memory(self) -> None:
+        """Forget the entries held in memory, the files stay"""
+        self._loaded.clear()
+
+    def _touch(self, path: str) -> None:
+        # the mtime is the last use, for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _remove_file(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self) -> List[Tuple[int, int, str, str]]:
+        """(last use, size, name, path) of every entry file"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(_ENTRY_SUFFIX):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # evicted by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name, path))
+        return entries
+
+    def size_bytes(self) -> int:
+        """Size of the entry files, at most max_size_mb plus the last entry written once writes have pruned it"""
+        return sum(size for _, size, _, _ in self._entries())
+
+    def _evict(self, keep: str) -> None:
+        """Remove the least recently used entries until the store fits in max_size_mb. Never the one just written"""
+        entries = self._entries()
+        total_size = sum(size for _, size, _, _ in entries)
+        for _, size, name, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            if path == keep:
+                continue
+            self._loaded.pop(name[: -len(_ENTRY_SUFFIX)], None)
+            self._remove_file(path)
+            total_size -= size
+            self.evictions += 1
+            logger.info("Evicted %s from the feature store", name)
+
+
+def open_feature_store(constants: Dict[str, Any], running_on_aws: bool) -> Union[FeatureStore, Dict[str, Any]]:
+    """The feature store set up in constants.yml, or a plain in memory cache if there isn't one"""
+    if not constants.get("feature_store_dir"):
+        return {}
+    return FeatureStore(
+        resolve_aws_path(constants["feature_store_dir"], running_on_aws), constants.get("feature_store_max_mb", 256)
+    )
@@ -0,0 +1,207 @@
+import sys
+from threading import Thread
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:  # need modules for pytest to work
+    from app.mlcode.inference_pool import get_inference_pool, predict_concurrently
+    from app.mlcode.instrumentation import RunMetrics
+    from app.mlcode.predict_price_movements import create_lookback_models
+    from app.mlcode.scaling import MinMaxColumns
+    from app.mlcode.training_pool import fit_model, get_training_pool, load_trained_weights, split_cores
+    from app.mlcode.utils import setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from inference_pool import get_inference_pool, predict_concurrently
+    from instrumentation import RunMetrics
+    from predict_price_movements import create_lookback_models
+    from scaling import MinMaxColumns
+    from training_pool import fit_model, get_training_pool, load_trained_weights, split_cores
+    from utils import setup_logging
+
+if TYPE_CHECKING:  # darts is only imported once we train
+    from darts import TimeSeries
+
+__all__ = ["GlobalModels"]
+
+logger = setup_logging()
+
+
+class GlobalModels:
+    def __init__(
+        self,
+        constants: Dict[str, Any],
+        ml_constants: Dict[str, Any],
+        n_additional_dfs: int,
+        deadline: Optional[float] = None,
+        verbose: bool = True,
+        random_state: int = 432,
+    ):
+        """One NBEATS and one TCN per lookback window, trained on the series of every coin at once and shared by
+        every coin's CoinPricePredictor.
+
+        Each coin's close is min-max scaled on its own for training, btc's prices would drown out matic's, and
+        its predictions are scaled back the same way. The covariates are already scaled. Every coin needs the
+        same number of covariates, they all have n_additional_dfs additional dfs. Models are trained from scratch,
+        warm starts and the model cache are per coin.
+
+        Args:
+            n_additional_dfs (int): additional dfs of every coin, part of the model names
+            deadline (float, optional): unix time the run has to be done by, see CoinPricePredictor
+        """
+        self.ml_constants = ml_constants
+        self.prediction_params = ml_constants["prediction_params"]
+        self.deadline = deadline
+        self.verbose = verbose
+        self.models = create_lookback_models(
+            constants["nbeats_modelname_global"],
+            constants["tcn_modelname_global"],
+            ml_constants,
+            n_additional_dfs,
+            random_state,
+        )
+        self.model_names = [
+            model.model_name for lookback_window_models in self.models for model in lookback_window_models
+        ]
+        self.skipped_models: List[str] = []  # not trained, out of time before the deadline
+        self._fits: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _scaled_target(train_close_series: "TimeSeries") -> Tuple[MinMaxColumns, "TimeSeries"]:
+        from darts import TimeSeries
+
+        scaler = MinMaxColumns(list(train_close_series.components))
+        scaled_values = scaler.fit_transform(train_close_series.values(copy=False))
+        return scaler, TimeSeries.from_times_and_values(
+            train_close_series.time_index, scaled_values, columns=list(train_close_series.components)
+        )
+
+    def _training_deadline(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - self.prediction_params.get("deadline_reserve_seconds", 120)
+
+    def _fit_args(self, model: Any) -> Tuple[int, Optional[float], int, int, int]:
+        # epochs, deadline, validation windows, patience and epochs on the held out windows, see training_pool.fit_model
+        hyperparameters_key = "hyperparameters_nbeats" if "nbeats" in model.model_name else "hyperparameters_tcn"
+        return (
+            self.ml_constants[hyperparameters_key]["epochs"],
+            self._training_deadline(),
+            self.prediction_params.get("validation_windows", 0),
+            self.prediction_params.get("early_stopping_patience", 0),
+            self.prediction_params.get("early_stopping_tail_epochs", 1),
+        )
+
+    def train(self, coin_series: List[Tuple["TimeSeries", "TimeSeries"]], run_metrics: RunMetrics) -> None:
+        """
+        Train every model on the (close series, scaled covariates) of each coin, see CoinPricePredictor.build_series.
+        In worker processes with training_backend: processes, otherwise in threads
+        """
+        if len({covariates.width for _, covariates in coin_series}) != 1:
+            raise ValueError("Global models need the same covariates for every coin, got different widths")
+        targets = [self._scaled_target(train_close_series)[1] for train_close_series, _ in coin_series]
+        covariates = [ts_stacked_series for _, ts_stacked_series in coin_series]
+        models = [model for lookback_window_models in self.models for model in lookback_window_models]
+        logger.info("Training %s global models on %s coins", len(models), len(coin_series))
+
+        trained_in_processes = False
+        if self.prediction_params.get("training_backend", "threads") == "processes":
+            try:
+                self._train_in_processes(models, targets, covariates, run_metrics)
+                trained_in_processes = True
+            except (OSError, NotImplementedError) as e:
+                logger.warning("Unable to train in worker processes, training in threads: %s", e)
+        if not trained_in_processes:
+            self._train_in_threads(models, targets, covariates, run_metrics)
+        self._record_fits(models, len(coin_series), run_metrics)
+
+    def _train_in_threads(
+        self, models: List[Any], targets: List["TimeSeries"], covariates: List["TimeSeries"], run_metrics: RunMetrics
+    ) -> None:
+        def _train(model: Any) -> None:
+            epochs, deadline, validation_windows, patience, tail_epochs = self._fit_args(model)
+            with run_metrics.model_stage(model.model_name, "fit"):
+                self._fits[model.model_name] = fit_model(
+                    model,
+                    targets,
+                    covariates,
+                    epochs,
+                    self.verbose,
+                    None,
+                    deadline,
+                    validation_windows,
+                    patience,
+                    tail_epochs,
+                )
+
+        threads = [Thread(target=_train, args=(model,)) for model in models]
+        for thread in threads:
+            thread.start()
+        sys.stdout.flush()
+        for thread in threads:  # block until all models are trained
+            thread.join()
+
+    def _train_in_processes(
+        self, models: List[Any], targets: List["TimeSeries"], covariates: List["TimeSeries"], run_metrics: RunMetrics
+    ) -> None:
+        n_workers, torch_threads = split_cores(len(models), self.prediction_params.get("training_workers", 0))
+        torch_threads = self.prediction_params.get("torch_threads_per_worker") or torch_threads
+        pool = get_training_pool(n_workers, torch_threads)
+        futures = []
+        for model in models:
+            epochs, deadline, validation_windows, patience, tail_epochs = self._fit_args(model)
+            futures.append(
+                pool.submit(
+                    model,
+                    targets,
+                    covariates,
+                    epochs,
+                    self.verbose,
+                    None,
+                    deadline,
+                    validation_windows,
+                    patience,
+                    tail_epochs,
+                )
+            )
+        for model, future in zip(models, futures):
+            trained = future.result()
+            self._fits[model.model_name] = trained["fit"]
+            if trained["fit"]["epochs"] > 0:
+                load_trained_weights(model, targets, covariates, trained)
+            run_metrics.record_model_stage(model.model_name, "fit", trained["metrics"])
+
+    def _record_fits(self, models: List[Any], n_coins: int, run_metrics: RunMetrics) -> None:
+        self.skipped_models = [model.model_name for model in models if self._fits[model.model_name]["epochs"] == 0]
+        run_metrics.extra["global_models"] = {
+            "coins": n_coins,
+            "epochs": {model.model_name: self._fits[model.model_name]["epochs"] for model in models},
+            "best_epochs": {model.model_name: self._fits[model.model_name]["best_epoch"] for model in models},
+            "skipped": self.skipped_models,
+        }
+
+    def predict(
+        self, train_close_series: "TimeSeries", ts_stacked_series: "TimeSeries", run_metrics: RunMetrics
+    ) -> Dict[str, float]:
+        """Every trained model's prediction for one coin, in its prices, keyed by model name, on the inference pool"""
+        scaler, target = self._scaled_target(train_close_series)
+
+        def _predict(model: Any) -> float:
+            with run_metrics.model_stage(model.model_name, "predict"):
+                scaled_prediction = model.predict(
+                    n=self.prediction_params["prediction_n_days"],
+                    series=target,
+                    past_covariates=[ts_stacked_series],
+                ).last_value()
+            prediction = float(scaler.inverse_transform_column(scaler.columns[0], np.array([scaled_prediction]))[0])
+            logger.info(" Model = %s Prediction = %s", model.model_name, prediction)
+            return prediction
+
+        models = [
+            model
+            for lookback_window_models in self.models
+            for model in lookback_window_models
+            if model.model_name not in self.skipped_models
+        ]
+        pool = get_inference_pool(self.prediction_params.get("inference_threads", 0))
+        return predict_concurrently(pool, models, _predict)
@@ -0,0 +1,357 @@
+import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+import numpy as np
+import pandas as pd
+
+try:  # need modules for pytest to work
+    from app.mlcode.coin_registry import LazyPriceData
+    from app.mlcode.feature_store import FeatureStore
+    from app.mlcode.predict_price_movements import CoinPricePredictor
+    from app.mlcode.training_pool import split_cores
+    from app.mlcode.utils import frame_fingerprint, read_in_yaml, setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from coin_registry import LazyPriceData
+    from feature_store import FeatureStore
+    from predict_price_movements import CoinPricePredictor
+    from training_pool import split_cores
+    from utils import frame_fingerprint, read_in_yaml, setup_logging
+
+__all__ = [
+    "SEARCH_SECTIONS",
+    "expand_search_space",
+    "rank_trials",
+    "run_search",
+    "score_folds",
+    "trial_config",
+    "walk_forward_cutoffs",
+]
+
+logger = setup_logging()
+
+# the ml_config.yml sections a search space can vary
+SEARCH_SECTIONS = (
+    "prediction_params",
+    "hyperparameters_tcn",
+    "hyperparameters_nbeats",
+    "hyperparameters_random_forest",
+)
+# bumped when a trial's fold records change, cached results of older versions are not reused
+SEARCH_VERSION = 1
+# trials, features and trained models of every fold of every trial, far more than a daily run keeps
+SEARCH_STORE_MAX_MB = 4096
+
+
+def expand_search_space(
+    ml_constants: Dict[str, Any], search_space: Dict[str, Dict[str, List[Any]]], max_trials: int = 0, seed: int = 432
+) -> List[Dict[str, Dict[str, Any]]]:
+    """
+    Every combination of the search space's values, as overrides of ml_config.yml sections, e.g.
+    {"hyperparameters_nbeats": {"layer_widths": [64, 128]}} gives two trials. Each key has to be in ml_config.yml
+    already, a typo would silently search nothing. With max_trials, a random sample of that many combinations
+    """
+    choices = []
+    for section, params in search_space.items():
+        if section not in SEARCH_SECTIONS:
+            raise ValueError(f"Can only search {SEARCH_SECTIONS}, got {section}")
+        for key, values in params.items():
+            if key not in ml_constants[section]:
+                raise ValueError(f"{section}.{key} isn't in ml_config.yml")
+            if not isinstance(values, list) or len(values) == 0:
+                raise ValueError(f"{section}.{key} needs a list of values to try, got {values}")
+            choices.append(((section, key), values))
+
+    trials = []
+    for combination in itertools.product(*[values for _, values in choices]):
+        overrides: Dict[str, Dict[str, Any]] = {}
+        for ((section, key), _), value in zip(choices, combination):
+            overrides.setdefault(section, {})[key] = value
+        trials.append(overrides)
+    if 0 < max_trials < len(trials):
+        trials = random.Random(seed).sample(trials, max_trials)
+    return trials
+
+
+def trial_config(ml_constants: Dict[str, Any], overrides: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    ml_config.yml with a trial's overrides. Trials train from scratch in threads, the trials are the processes.
+    Indicators are built in full, a fold's snapshot would be keyed by a csv the trials don't have
+    """
+    config = copy.deepcopy(ml_constants)
+    for section, params in overrides.items():
+        config[section].update(params)
+    config["prediction_params"].update(
+        {
+            "warm_start": False,
+            "training_backend": "threads",
+            "inference_backend": "darts",
+            "inference_threads": 1,
+            "streaming_indicators": False,
+        }
+    )
+    return config
+
+
+def walk_forward_cutoffs(
+    dates: pd.DatetimeIndex, prediction_n_days: int, folds: int, step_days: int
+) -> List[pd.Timestamp]:
+    """The last day of data of each fold, oldest first. The last fold's prediction is for the last date we have"""
+    last_cutoff = dates.max() - pd.Timedelta(days=prediction_n_days)
+    cutoffs = [last_cutoff - pd.Timedelta(days=step_days * i) for i in reversed(range(folds))]
+    if cutoffs[0] <= dates.min():
+        raise ValueError(f"Not enough data for {folds} folds {step_days} days apart")
+    return cutoffs
+
+
+def _trial_key(coin: str, config: Dict[str, Any], fingerprint: str, cutoffs: List[pd.Timestamp]) -> str:
+    # feature store key of a trial's fold records: the config, the coin's data and the folds
+    params = {"version": SEARCH_VERSION, "config": config, "cutoffs": [str(cutoff) for cutoff in cutoffs]}
+    params_hash = hashlib.sha1((json.dumps(params, sort_keys=True, default=str) + fingerprint).encode())
+    return f"search_{coin}_{params_hash.hexdigest()[:20]}"
+
+
+def _init_search_worker(torch_threads: int) -> None:
+    import torch
+
+    torch.set_num_threads(torch_threads)
+    # darts keeps a directory per model name, trials of the same models in other workers mustn't share it
+    os.chdir(tempfile.mkdtemp(prefix="hyperparameter_search_"))
+
+
+def _evaluate_trial(
+    coin: str,
+    constants: Dict[str, Any],
+    config: Dict[str, Any],
+    input_df: pd.DataFrame,
+    additional_dfs: List[pd.DataFrame],
+    cutoffs: List[pd.Timestamp],
+    feature_store_dir: str,
+) -> List[Dict[str, Any]]:
+    """
+    Train and predict the coin as of each cutoff, the way a daily run would have. One record per fold with the
+    base predictions and the close they were for. Features and trained models go through the feature store, a
+    fold another trial already trained the same models on is loaded
+    """
+    feature_store = FeatureStore(feature_store_dir, SEARCH_STORE_MAX_MB)
+    n_days = config["prediction_params"]["prediction_n_days"]
+    folds = []
+    for cutoff in cutoffs:
+        predictor = CoinPricePredictor(
+            coin,
+            constants,
+            config,
+            input_df.loc[:cutoff].copy(),
+            all_predictions_filename="unused.csv",
+            additional_dfs=[df.loc[:cutoff].copy() for df in additional_dfs],
+            verbose=False,
+            feature_cache=feature_store,
+        )
+        train_close_series, ts_stacked_series = predictor.build_series()
+        predictor._create_models()
+        predictor._train_models(train_close_series, ts_stacked_series)
+        target_date = cutoff + pd.Timedelta(days=n_days)
+        folds.append(
+            {
+                "cutoff": str(cutoff),
+                "target_date": str(target_date),
+                "actual": float(input_df[constants["close_col"]].asof(target_date)),
+                "predictions": predictor._make_base_predictions_dict(train_close_series, ts_stacked_series),
+            }
+        )
+        feature_store.release_memory()
+    return folds
+
+
+def score_folds(
+    folds: List[Dict[str, Any]], n_estimators: int, min_stacking_folds: int = 3, random_state: int = 432
+) -> Dict[str, Any]:
+    """
+    Mean absolute percentage error of a trial's walk forward folds: of the mean base prediction, of the best base
+    model, and of a random forest stacked on the earlier folds whose close was known by the fold's cutoff (as the
+    daily stacking model is on the all predictions csv). Folds without min_stacking_folds of those aren't stacked
+    """
+    from sklearn.ensemble import RandomForestRegressor
+
+    model_names = sorted(folds[0]["predictions"])
+    x = np.array([[fold["predictions"][name] for name in model_names] for fold in folds])
+    y = np.array([fold["actual"] for fold in folds])
+    cutoffs = pd.to_datetime([fold["cutoff"] for fold in folds])
+    target_dates = pd.to_datetime([fold["target_date"] for fold in folds])
+
+    def _mape(predicted: np.ndarray, actual: np.ndarray) -> float:
+        return float(100 * np.mean(np.abs(predicted - actual) / np.abs(actual)))
+
+    stacked, stacked_actual = [], []
+    for i, cutoff in enumerate(cutoffs):
+        known = np.flatnonzero(target_dates[:i] <= cutoff)
+        if len(known) < min_stacking_folds:
+            continue
+        estimator = RandomForestRegressor(n_estimators=n_estimators, n_jobs=1, random_state=random_state)
+        estimator.fit(x[known], y[known])
+        stacked.append(estimator.predict(x[i : i + 1])[0])
+        stacked_actual.append(y[i])
+    model_mapes = {name: _mape(x[:, j], y) for j, name in enumerate(model_names)}
+    return {
+        "mean_mape": _mape(x.mean(axis=1), y),
+        "best_model_mape": min(model_mapes.values()),
+        "stacking_mape": _mape(np.array(stacked), np.array(stacked_actual)) if stacked else np.nan,
+        "stacking_folds": len(stacked),
+    }
+
+
+def rank_trials(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per trial, ranked by score best first, with its parameters, its score on each coin and the coins it
+    failed on. results has a row per (trial, coin) with its scores, error is None unless it failed. A trial that
+    failed on any coin has no score and goes last
+    """
+    results = results.copy()
+    results["score"] = results["stacking_mape"].fillna(results["mean_mape"])
+    failed = results[results["error"].notna()]
+    ranked = results.groupby("trial")["score"].mean()
+    ranked.loc[failed["trial"].unique()] = np.nan
+    ranked = ranked.sort_values()
+    per_coin = results.pivot(index="trial", columns="coin", values="score").add_suffix("_score")
+    params_cols = [col for col in results.columns if "." in col]
+    table = results.drop_duplicates("trial").set_index("trial")[params_cols].join(per_coin)
+    table.insert(0, "score", ranked)
+    table["failed"] = failed.groupby("trial")["coin"].agg(",".join).reindex(table.index).fillna("")
+    return table.loc[ranked.index].reset_index()
+
+
+def _coin_data(coin: str, price_data: LazyPriceData) -> Tuple[pd.DataFrame, List[pd.DataFrame], str]:
+    input_df, additional_dfs = price_data.get_input_df(coin), price_data.get_additional_dfs(coin)
+    return input_df, additional_dfs, "".join(frame_fingerprint(df) for df in [input_df, *additional_dfs])
+
+
+def run_search(
+    coins: List[str],
+    constants: Dict[str, Any],
+    ml_constants: Dict[str, Any],
+    search_space: Dict[str, Dict[str, List[Any]]],
+    price_data: LazyPriceData,
+    feature_store_dir: str,
+    folds: int = 8,
+    step_days: int = 7,
+    max_trials: int = 0,
+    n_workers: int = 0,
+) -> pd.DataFrame:
+    """
+    Walk forward every trial of the search space on every coin in a pool of worker processes, one (trial, coin)
+    per task. Returns the trials ranked by score, the stacking error averaged over the coins (the mean base
+    prediction's where there weren't enough folds to stack), best first.
+
+    Each trial's fold records are kept in the feature store at feature_store_dir, keyed by its config, the coin's
+    data and the folds, so a rerun only evaluates new trials. Features and trained models are kept there too.
+    A trial that raises on a coin is logged and ranked last as failed, the others carry on. It isn't kept, a rerun
+    tries it again
+    """
+    trials = expand_search_space(ml_constants, search_space, max_trials)
+    feature_store = FeatureStore(feature_store_dir, SEARCH_STORE_MAX_MB)
+    coin_data = {coin: _coin_data(coin, price_data) for coin in coins}
+
+    tasks: Dict[str, Tuple[int, str, Dict[str, Any], List[pd.Timestamp]]] = {}
+    for trial_id, overrides in enumerate(trials):
+        config = trial_config(ml_constants, overrides)
+        for coin, (input_df, _, fingerprint) in coin_data.items():
+            n_days = config["prediction_params"]["prediction_n_days"]
+            cutoffs = walk_forward_cutoffs(input_df.index, n_days, folds, step_days)
+            tasks[_trial_key(coin, config, fingerprint, cutoffs)] = (trial_id, coin, config, cutoffs)
+    pending = [key for key in tasks if key not in feature_store]
+    errors: Dict[str, str] = {}  # task key -> why the trial failed on that coin
+    logger.info(
+        "%s trials on %s, %s of %s already evaluated", len(trials), coins, len(tasks) - len(pending), len(tasks)
+    )
+
+    if pending:
+        n_workers, torch_threads = split_cores(len(pending), n_workers)
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_search_worker,
+            initargs=(torch_threads,),
+        ) as pool:
+            futures = {}
+            for key in pending:
+                _, coin, config, cutoffs = tasks[key]
+                input_df, additional_dfs, _ = coin_data[coin]
+                futures[key] = pool.submit(
+                    _evaluate_trial, coin, constants, config, input_df, additional_dfs, cutoffs, feature_store_dir
+                )
+            for key, future in futures.items():
+                try:
+                    feature_store[key] = future.result()
+                except Exception as e:
+                    errors[key] = f"{type(e).__name__}: {e}"
+                    logger.warning(
+                        "Trial %s %s failed on %s: %s", tasks[key][0], trials[tasks[key][0]], tasks[key][1], e
+                    )
+                    continue
+                logger.info("Evaluated trial %s on %s", tasks[key][0], tasks[key][1])
+
+    rows = []
+    for key, (trial_id, coin, config, _) in tasks.items():
+        if key in errors:
+            scores = {"mean_mape": np.nan, "best_model_mape": np.nan, "stacking_mape": np.nan, "stacking_folds": 0}
+        else:
+            scores = score_folds(feature_store[key], config["hyperparameters_random_forest"]["n_estimators"])
+        params = {
+            f"{section}.{name}": value for section, values in trials[trial_id].items() for name, value in values.items()
+        }
+        rows.append({"trial": trial_id, "coin": coin, **params, **scores, "error": errors.get(key)})
+    return rank_trials(pd.DataFrame(rows))
+
+
+@click.command()
+@click.option("--search_space", required=True, help="yml of ml_config.yml sections and the values to try")
+@click.option("--coins", default="btc", help="Comma separated coins to evaluate each trial on, e.g. btc,eth,sol")
+@click.option("--folds", default=8, help="Walk forward folds, each one trains and predicts as of its cutoff")
+@click.option("--step_days", default=7, help="Days between the folds' cutoffs")
+@click.option("--max_trials", default=0, help="Evaluate a random sample of this many combinations, 0 is all")
+@click.option("--workers", default=0, help="Worker processes, 0 is one per core")
+@click.option(
+    "--feature_store_dir", default=".hyperparameter_search", help="Where trials, features and models are kept"
+)
+@click.option("--output", default=None, help="Also write the ranked results to this csv")
+def main(
+    search_space: str,
+    coins: str,
+    folds: int,
+    step_days: int,
+    max_trials: int,
+    workers: int,
+    feature_store_dir: str,
+    output: Optional[str],
+) -> None:
+    """Rank ml_config.yml hyperparameters by walk forward error. Run from the repo root with the csvs in tmp/"""
+    constants = read_in_yaml("tmp/constants.yml", False)
+    ml_constants = read_in_yaml(constants["ml_config_filename"], False)
+    results = run_search(
+        [coin.strip() for coin in coins.split(",") if coin.strip()],
+        constants,
+        ml_constants,
+        read_in_yaml(search_space, False),
+        LazyPriceData(constants, False),
+        os.path.abspath(feature_store_dir),  # the workers run in their own directories
+        folds,
+        step_days,
+        max_trials,
+        workers,
+    )
+    with pd.option_context("display.width", 250, "display.max_columns", None):
+        logger.info("Trials ranked by walk forward error, best first\n%s", results.to_string(index=False))
+    if output:
+        results.to_csv(output, index=False)
+
+
+if __name__ == "__main__":
+    main()
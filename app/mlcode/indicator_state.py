@@ -0,0 +1,194 @@
+import glob
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:  # need modules for pytest to work
+    from app.mlcode.indicators import stack_assets, update_indicators
+    from app.mlcode.utils import setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from indicators import stack_assets, update_indicators
+    from utils import setup_logging
+
+__all__ = ["INDICATOR_STATE_VERSION", "StreamingIndicators", "indicator_state_filename"]
+
+logger = setup_logging()
+
+INDICATOR_STATE_VERSION = 1
+# a csv's snapshots for other first rows that weren't written for this long are removed
+INDICATOR_STATE_MAX_AGE_SECONDS = 2 * 24 * 60 * 60
+
+
+def indicator_state_filename(csv_filename: str, start: pd.Timestamp) -> str:
+    """
+    The snapshot of the csv's frame that starts on start. Coins slice the same csv (btc, tbt) from different days.
+    No "csv" or "yml" in the name, the go app uploads every /tmp file with those in it to S3
+    """
+    return f"{os.path.splitext(csv_filename)[0]}.{start.strftime('%Y%m%d')}.indicator_state.npz"
+
+
+def _remove_stale_snapshots(state_filename: str) -> None:
+    # the same csv's snapshots for other first rows, a moving years filter leaves one behind every day
+    csv_root = state_filename.rsplit(".", 3)[0]
+    for stale_filename in glob.glob(f"{glob.escape(csv_root)}.*.indicator_state.npz"):
+        try:
+            if (
+                stale_filename != state_filename
+                and time.time() - os.path.getmtime(stale_filename) > INDICATOR_STATE_MAX_AGE_SECONDS
+            ):
+                os.remove(stale_filename)
+        except OSError:  # removed by another process
+            pass
+
+
+def _load_snapshot(state_filename: str) -> Dict[str, Any]:
+    # few, large arrays, every array in an npz has its own header to parse
+    with np.load(state_filename, allow_pickle=False) as snapshot:
+        version, window, no_of_std = snapshot["meta"].tolist()
+        values = snapshot["values"]
+        state_values = np.split(snapshot["state_values"], np.cumsum(snapshot["state_sizes"])[:-1])
+        return {
+            "version": int(version),
+            "params": [window, no_of_std],
+            "index": snapshot["index"],
+            "prices": values[:3],
+            "indicators": dict(zip(snapshot["indicator_names"].tolist(), values[3:])),
+            "state": dict(zip(snapshot["state_names"].tolist(), state_values)),
+        }
+
+
+class StreamingIndicators:
+    def __init__(self, window: int, no_of_std: float):
+        """Technical indicators that carry on from where the last run stopped, instead of starting over.
+
+        Each price series keeps a snapshot next to its csv, per first row of the frame: the dates, prices and
+        indicators it was built for and the running state of every EMA and rolling window after the last row. When
+        the same rows come back with new ones after them only the new rows are computed. Anything else (no snapshot,
+        other params, a changed, missing or dropped row) rebuilds from scratch. The EMAs depend on the first row,
+        so carrying on from a snapshot gives the same indicators as a rebuild.
+
+        Args:
+            window (int): bollinger window, also the RSI period
+            no_of_std (float): number of standard deviations for the bollinger bands
+        """
+        self.window = window
+        self.no_of_std = no_of_std
+        # per state file, how many rows were computed and whether it was a rebuild
+        self.report: Dict[str, Dict[str, Any]] = {}
+
+    def _usable_snapshot(self, state_filename: str, index: np.ndarray, prices: np.ndarray) -> Optional[Dict[str, Any]]:
+        """The snapshot with n_known, how many of the frame's rows it already has, or None if it can't be carried on"""
+        if not os.path.exists(state_filename):
+            return None
+        try:
+            snapshot = _load_snapshot(state_filename)
+        except Exception as e:  # a corrupt or half written snapshot, start over
+            logger.warning("Ignoring indicator state %s: %s", state_filename, e)
+            return None
+        if snapshot["version"] != INDICATOR_STATE_VERSION or snapshot["params"] != [self.window, self.no_of_std]:
+            return None
+
+        # the frame has to repeat every row of the snapshot, from its first one, before any new ones
+        n_known = len(snapshot["index"])
+        if (
+            n_known == 0
+            or n_known > len(index)
+            or not np.array_equal(snapshot["index"], index[:n_known])
+            or not np.array_equal(snapshot["prices"], prices[:, :n_known], equal_nan=True)
+        ):
+            return None
+        snapshot["n_known"] = n_known
+        return snapshot
+
+    def build(self, price_dfs: List[pd.DataFrame], state_filenames: List[str]) -> List[Dict[str, np.ndarray]]:
+        """
+        Indicators for each frame, carrying on from its snapshot where we can. The frames that need a rebuild are
+        built together, and so are the ones that gained the same number of rows.
+
+        Args:
+            price_dfs (List[pd.DataFrame]): date indexed close, high and low columns, in that order
+            state_filenames (List[str]): where the snapshot of each frame is kept
+
+        Returns:
+            List[Dict[str, np.ndarray]]: for each frame, an array per indicator with a value for every row
+        """
+        if len(price_dfs) != len(state_filenames):
+            raise ValueError(f"Need a state file for every frame, have {len(price_dfs)} and {len(state_filenames)}")
+        indexes = [df.index.asi8 for df in price_dfs]
+        prices = [df.to_numpy(dtype=float).T for df in price_dfs]
+        snapshots = [self._usable_snapshot(*args) for args in zip(state_filenames, indexes, prices)]
+
+        # rows still to compute -> the frames with that many new rows, None for the frames that start over
+        groups: Dict[Optional[int], List[int]] = {}
+        for i, snapshot in enumerate(snapshots):
+            groups.setdefault(None if snapshot is None else len(indexes[i]) - snapshot["n_known"], []).append(i)
+
+        results: List[Dict[str, np.ndarray]] = [{} for _ in price_dfs]
+        for n_new_rows, frame_ids in groups.items():
+            new_prices, previous_state = self._stack_new_rows(
+                [prices[i] for i in frame_ids], [snapshots[i] for i in frame_ids], n_new_rows
+            )
+            indicators, state = update_indicators(*new_prices, self.window, self.no_of_std, previous_state)
+
+            for pos, i in enumerate(frame_ids):
+                snapshot = snapshots[i]
+                n_rows = len(indexes[i]) - (0 if snapshot is None else snapshot["n_known"])
+                results[i] = {
+                    name: values[pos, values.shape[1] - n_rows :]
+                    if snapshot is None
+                    else np.concatenate([snapshot["indicators"][name], values[pos]])
+                    for name, values in indicators.items()
+                }
+                self.report[os.path.basename(state_filenames[i])] = {"new_rows": n_rows, "rebuilt": snapshot is None}
+                if snapshot is None or n_rows > 0:
+                    frame_state = {key: values[pos] for key, values in state.items()}
+                    self._write_snapshot(state_filenames[i], indexes[i], prices[i], results[i], frame_state)
+
+        logger.info("Streaming indicators = %s", self.report)
+        return results
+
+    def _stack_new_rows(
+        self, prices: List[np.ndarray], snapshots: List[Optional[Dict[str, Any]]], n_new_rows: Optional[int]
+    ) -> Tuple[List[np.ndarray], Optional[Dict[str, np.ndarray]]]:
+        """[asset, time] close, high and low arrays of the rows to compute and the state to start them from"""
+        if n_new_rows is None:
+            # every row, from scratch. Leading NaN padding changes neither the indicators nor the state
+            return [stack_assets([frame_prices[row] for frame_prices in prices]) for row in range(3)], None
+
+        new_prices = [
+            np.stack([frame_prices[row, frame_prices.shape[1] - n_new_rows :] for frame_prices in prices])
+            for row in range(3)
+        ]
+        states = [snapshot["state"] for snapshot in snapshots if snapshot is not None]
+        return new_prices, {key: np.stack([state[key] for state in states]) for key in states[0]}
+
+    def _write_snapshot(
+        self,
+        state_filename: str,
+        index: np.ndarray,
+        prices: np.ndarray,
+        indicators: Dict[str, np.ndarray],
+        state: Dict[str, np.ndarray],
+    ) -> None:
+        tmp_filename = f"{state_filename}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_filename, "wb") as f:
+                np.savez(
+                    f,
+                    meta=np.array([INDICATOR_STATE_VERSION, self.window, self.no_of_std], dtype=float),
+                    index=index,
+                    indicator_names=np.array(list(indicators)),
+                    values=np.vstack([prices] + list(indicators.values())),
+                    state_names=np.array(list(state)),
+                    state_sizes=np.array([len(values) for values in state.values()], dtype=np.int64),
+                    state_values=np.concatenate(list(state.values())),
+                )
+            os.replace(tmp_filename, state_filename)  # readers never see a half written snapshot
+            _remove_stale_snapshots(state_filename)
+        except OSError as e:
+            logger.warning("Unable to write indicator state %s: %s", state_filename, e)
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
@@ -0,0 +1,232 @@
+import math
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+__all__ = ["INDICATOR_NAMES", "IndicatorEngine", "compute_indicators", "ewm_mean", "stack_assets", "update_indicators"]
+
+# what update_indicators returns, in the order the columns are added. The predictor's column is constants[f"{name}_col"]
+INDICATOR_NAMES = ["rolling_mean", "bollinger_high", "bollinger_low", "stc", "stoch", "rsi", "macd", "macd_signal"]
+
+# ewm_mean scales each block of rows by weight ** -row, keep that well inside float64
+_MAX_EWM_BLOCK_SCALE = 1e100
+
+
+def stack_assets(columns: Sequence[Sequence[float]]) -> np.ndarray:
+    """
+    One contiguous [asset, time] float array from columns of different lengths. Shorter columns are padded with
+    NaN at the start so every asset ends on the last column. Leading NaNs don't change any indicator, the EMAs
+    start at the first value and the rolling windows are NaN until they are full either way
+    """
+    n_times = max((len(column) for column in columns), default=0)
+    stacked = np.full((len(columns), n_times), np.nan)
+    for i, column in enumerate(columns):
+        stacked[i, n_times - len(column) :] = np.asarray(column, dtype=float)
+    return stacked
+
+
+def _ewm_sums(
+    values: np.ndarray, alpha: float, numerator_carry: np.ndarray, denominator_carry: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Running sums of w ** (t - i) * x_i and of w ** (t - i) over the observed x_i, carrying on from the sums before
+    the first row. They are cumulative sums of x_i * w ** -i, done a block of rows at a time so w ** -i can't
+    overflow on long histories. Missing values still decay the older weights, like pandas' ignore_na=False
+    """
+    if not 0 < alpha <= 1:
+        raise ValueError(f"alpha has to be in (0, 1], got {alpha}")
+    observed = ~np.isnan(values)
+    weighted_values = np.where(observed, values, 0.0)
+    weights = observed.astype(float)
+
+    decay = 1 - alpha
+    n_times = values.shape[-1]
+    block_size = 1 if decay == 0 else max(1, min(n_times, int(math.log(_MAX_EWM_BLOCK_SCALE) / -math.log(decay))))
+
+    numerator = np.empty_like(weighted_values)
+    denominator = np.empty_like(weights)
+    for start in range(0, n_times, block_size):
+        stop = min(start + block_size, n_times)
+        decay_powers = decay ** np.arange(stop - start)
+        inverse_powers = 1 / decay_powers
+        numerator[..., start:stop] = decay_powers * (
+            (decay * numerator_carry)[..., None] + np.cumsum(weighted_values[..., start:stop] * inverse_powers, axis=-1)
+        )
+        denominator[..., start:stop] = decay_powers * (
+            (decay * denominator_carry)[..., None] + np.cumsum(weights[..., start:stop] * inverse_powers, axis=-1)
+        )
+        numerator_carry, denominator_carry = numerator[..., stop - 1], denominator[..., stop - 1]
+    return numerator, denominator
+
+
+def _ewm_ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def ewm_mean(values: np.ndarray, span: Optional[float] = None, alpha: Optional[float] = None) -> np.ndarray:
+    """
+    Exponentially weighted mean along the time axis, the same as pandas' ewm(adjust=True, ignore_na=False).mean().
+    With adjust=True the mean at t is sum(w ** (t - i) * x_i) / sum(w ** (t - i)) over the observed x_i
+    """
+    if (span is None) == (alpha is None):
+        raise ValueError("Pass one of span or alpha")
+    if alpha is None:
+        alpha = 2 / (span + 1)  # type: ignore
+    values = np.asarray(values, dtype=float)
+    no_carry = np.zeros(values.shape[:-1])
+    return _ewm_ratio(*_ewm_sums(values, alpha, no_carry, no_carry))
+
+
+class IndicatorEngine:
+    def __init__(
+        self,
+        close: np.ndarray,
+        high: np.ndarray,
+        low: np.ndarray,
+        state: Optional[Dict[str, np.ndarray]] = None,
+    ):
+        """Technical indicators for many assets at once, each price is an [asset, time] float array.
+
+        The results match finta's TA.* functions. EMAs and rolling windows are kept and shared between
+        indicators, e.g. MACD and STC use the same close EMAs when their periods overlap.
+
+        Each EMA and rolling window starts from state and leaves where it ended in self.state: the two EMA sums,
+        and the last window - 1 values of each rolling input. Giving that state to the engine for the rows that
+        come next gives the same values as computing over all the rows at once.
+
+        Args:
+            close (np.ndarray): close prices, [asset, time]
+            high (np.ndarray): high prices, [asset, time]
+            low (np.ndarray): low prices, [asset, time]
+            state (Optional[Dict[str, np.ndarray]], optional): self.state of the engine that had the rows right
+                before these, [asset, ...] arrays. None starts from scratch
+        """
+        self.close = np.ascontiguousarray(close, dtype=float)
+        self.high = np.ascontiguousarray(high, dtype=float)
+        self.low = np.ascontiguousarray(low, dtype=float)
+        if not self.close.shape == self.high.shape == self.low.shape or self.close.ndim != 2:
+            raise ValueError(
+                f"close, high and low need the same [asset, time] shape, got {self.close.shape}, "
+                f"{self.high.shape} and {self.low.shape}"
+            )
+        self.n_assets = self.close.shape[0]
+        self.previous_state = state or {}
+        self.state: Dict[str, np.ndarray] = {}
+        self._close_emas: Dict[int, np.ndarray] = {}
+        self._close_rolling_means: Dict[int, np.ndarray] = {}
+
+    def _ewm(self, name: str, values: np.ndarray, alpha: float) -> np.ndarray:
+        # state is the [numerator, denominator] of each asset after its last row
+        carry = self.previous_state.get(name, np.zeros((self.n_assets, 2)))
+        numerator, denominator = _ewm_sums(values, alpha, carry[:, 0], carry[:, 1])
+        self.state[name] = np.stack([numerator[:, -1], denominator[:, -1]], axis=1) if values.shape[1] else carry
+        return _ewm_ratio(numerator, denominator)
+
+    def _with_history(self, name: str, values: np.ndarray, n_history: int) -> np.ndarray:
+        """values with the n_history values before them in front, NaN if there weren't any"""
+        history = self.previous_state.get(name, np.full((self.n_assets, n_history), np.nan))
+        values_with_history = np.concatenate([history, values], axis=1)
+        self.state[name] = values_with_history[:, values_with_history.shape[1] - n_history :]
+        return values_with_history
+
+    def _rolling(self, name: str, values: np.ndarray, window: int, reduce: str, **kwargs: int) -> np.ndarray:
+        # NaN anywhere in a window gives NaN, like pandas' default min_periods=window
+        if window < 1:
+            raise ValueError(f"window has to be at least 1, got {window}")
+        values_with_history = self._with_history(name, values, window - 1)
+        if values.shape[1] == 0:
+            return np.empty(values.shape)
+        windows = sliding_window_view(values_with_history, window, axis=1)
+        return getattr(np, reduce)(windows, axis=-1, **kwargs)
+
+    def close_ema(self, span: int) -> np.ndarray:
+        if span not in self._close_emas:
+            self._close_emas[span] = self._ewm(f"close_ema_{span}", self.close, alpha=2 / (span + 1))
+        return self._close_emas[span]
+
+    def close_rolling_mean(self, window: int) -> np.ndarray:
+        if window not in self._close_rolling_means:
+            self._close_rolling_means[window] = self._rolling(f"close_{window}", self.close, window, "mean")
+        return self._close_rolling_means[window]
+
+    def bollinger_bands(self, window: int, no_of_std: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Rolling mean, high band and low band. The std is the sample std, like pandas' rolling().std()"""
+        rolling_mean = self.close_rolling_mean(window)
+        rolling_std = self._rolling(f"close_{window}", self.close, window, "std", ddof=1)
+        return rolling_mean, rolling_mean + rolling_std * no_of_std, rolling_mean - rolling_std * no_of_std
+
+    def rsi(self, period: int = 14) -> np.ndarray:
+        delta = np.diff(self._with_history("close_1", self.close, 1), axis=1)
+        gain = self._ewm(f"rsi_gain_{period}", np.where(delta < 0, 0.0, delta), alpha=1 / period)
+        loss = self._ewm(f"rsi_loss_{period}", np.abs(np.where(delta > 0, 0.0, delta)), alpha=1 / period)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return 100 - (100 / (1 + gain / loss))
+
+    def macd(self, period_fast: int = 12, period_slow: int = 26, signal: int = 9) -> Tuple[np.ndarray, np.ndarray]:
+        """MACD line and its signal line"""
+        macd = self.close_ema(period_fast) - self.close_ema(period_slow)
+        macd_signal = self._ewm(f"macd_signal_{period_fast}_{period_slow}_{signal}", macd, alpha=2 / (signal + 1))
+        return macd, macd_signal
+
+    def stoch(self, period: int = 14) -> np.ndarray:
+        """Stochastic oscillator %K"""
+        highest_high = self._rolling(f"high_{period}", self.high, period, "max")
+        lowest_low = self._rolling(f"low_{period}", self.low, period, "min")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self.close - lowest_low) / (highest_high - lowest_low) * 100
+
+    def stc(self, period_fast: int = 23, period_slow: int = 50, k_period: int = 10, d_period: int = 3) -> np.ndarray:
+        """Schaff Trend Cycle, a stochastic of the MACD smoothed twice"""
+        name = f"stc_{period_fast}_{period_slow}_{k_period}_{d_period}"
+        macd = self.close_ema(period_fast) - self.close_ema(period_slow)
+        lowest_macd = self._rolling(f"{name}_macd", macd, k_period, "min")
+        highest_macd = self._rolling(f"{name}_macd", macd, k_period, "max")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            stoch_k = (macd - lowest_macd) / (highest_macd - lowest_macd) * 100
+        stoch_d = self._rolling(f"{name}_stoch_k", stoch_k, d_period, "mean")
+        return self._rolling(f"{name}_stoch_d", stoch_d, d_period, "mean")
+
+
+def update_indicators(
+    close: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    window: int,
+    no_of_std: float,
+    state: Optional[Dict[str, np.ndarray]] = None,
+) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """
+    Every indicator the predictor trains on, for every asset. The bands use window and no_of_std and the RSI
+    uses window as its period. The rest use finta's default periods.
+
+    Args:
+        state (Optional[Dict[str, np.ndarray]], optional): the state returned for the rows right before these,
+            only the new rows need to be passed in. None starts from scratch
+
+    Returns:
+        Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]: [asset, time] arrays keyed by indicator name, in the
+            order the columns are added, and the state to carry on from after the last row
+    """
+    engine = IndicatorEngine(close, high, low, state)
+    rolling_mean, bollinger_high, bollinger_low = engine.bollinger_bands(window, no_of_std)
+    macd, macd_signal = engine.macd()
+    indicators = {
+        "rolling_mean": rolling_mean,
+        "bollinger_high": bollinger_high,
+        "bollinger_low": bollinger_low,
+        "stc": engine.stc(),
+        "stoch": engine.stoch(),
+        "rsi": engine.rsi(period=window),
+        "macd": macd,
+        "macd_signal": macd_signal,
+    }
+    return indicators, engine.state
+
+
+def compute_indicators(
+    close: np.ndarray, high: np.ndarray, low: np.ndarray, window: int, no_of_std: float
+) -> Dict[str, np.ndarray]:
+    """Every indicator the predictor trains on, for every asset, from scratch. See update_indicators"""
+    return update_indicators(close, high, low, window, no_of_std)[0]
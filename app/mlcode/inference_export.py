@@ -0,0 +1,159 @@
+import copy
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+try:  # need modules for pytest to work
+    from app.mlcode.utils import setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from utils import setup_logging
+
+__all__ = [
+    "EXPORT_VERSION",
+    "ExportedModel",
+    "export_model",
+    "exported_model_filename",
+    "load_exported_model",
+    "quantization_skip_reason",
+]
+
+logger = setup_logging()
+
+EXPORT_VERSION = 1
+
+
+def exported_model_filename(directory: str, model_name: str, quantized: bool = False) -> str:
+    # no "csv" or "yml" in the name, the go app uploads every /tmp file with those in it to S3
+    return os.path.join(directory, f"{model_name}{'.int8' if quantized else ''}.torchscript.pt")
+
+
+def quantization_skip_reason(model: Any) -> Optional[str]:
+    """Why the trained darts model can't be dynamically quantized to int8, None if it can"""
+    import torch
+
+    if not any(engine in torch.backends.quantized.supported_engines for engine in ["fbgemm", "qnnpack"]):
+        return "this torch build has no quantized cpu engine"
+    if not any(isinstance(module, torch.nn.Linear) for module in model.model.modules()):
+        # a TCN is all Conv1d, torch's dynamic quantization only covers Linear and recurrent layers
+        return "no linear layers, dynamic quantization doesn't cover convolutions"
+    return None
+
+
+def _quantized_module(model: Any) -> Any:
+    # int8 weights for every Linear, activations are quantized on the fly. Runs in float32, not float64
+    import torch
+
+    module = torch.quantization.quantize_dynamic(  # type: ignore
+        copy.deepcopy(model.model).float().eval(), {torch.nn.Linear}, dtype=torch.qint8
+    )
+    for submodule in module.modules():
+        # darts' NBEATS blocks run the plain list of the layers registered in fc_stack, point it at the int8 ones
+        if hasattr(submodule, "fc_stack"):
+            submodule.linear_layer_stack_list = list(submodule.fc_stack)
+    return module
+
+
+class ExportedModel:
+    def __init__(self, module: Any, meta: Dict[str, Any]):
+        """
+        A trained NBEATS or TCN as a TorchScript graph, predicts from numpy arrays without darts.
+
+        Args:
+            module (torch.jit.ScriptModule): the traced torch module of the darts model
+            meta (dict): model_name, params_hash, input_chunk_length, output_chunk_length, first_prediction_index,
+                input_width (the target and covariate columns), dtype and quantized, see export_model
+        """
+        self.module = module
+        self.meta = meta
+        self.model_name: str = meta["model_name"]
+        self.input_chunk_length: int = meta["input_chunk_length"]
+        self.output_chunk_length: int = meta["output_chunk_length"]
+
+    def predict(self, target: np.ndarray, covariates: np.ndarray, n: int) -> np.ndarray:
+        """
+        The next n values of the target, what darts' predict(n, series, past_covariates) gives.
+        target and covariates are (time, columns) arrays on the same dates, only the last input_chunk_length rows
+        are used
+        """
+        import torch
+
+        if n > self.output_chunk_length:
+            raise ValueError(f"{self.model_name} predicts {self.output_chunk_length} days at a time, not {n}")
+        if len(target) < self.input_chunk_length or len(target) != len(covariates):
+            raise ValueError(f"{self.model_name} needs {self.input_chunk_length} rows of target and covariates")
+        window = np.hstack([target, covariates])[-self.input_chunk_length :]
+        if window.shape[1] != self.meta["input_width"]:
+            raise ValueError(
+                f"{self.model_name} was trained on {self.meta['input_width']} columns, got {window.shape[1]}"
+            )
+        # the profiling executor spends the first two calls optimizing the graph, slower than darts for one prediction
+        with torch.no_grad(), torch.jit.optimized_execution(False):  # type: ignore
+            out = self.module(torch.from_numpy(np.ascontiguousarray(window[np.newaxis], dtype=self.meta["dtype"])))
+        return out[0, self.meta["first_prediction_index"] :, :][:n].numpy()
+
+
+def export_model(filename: str, model: Any, params_hash: str, quantize: bool = False) -> Optional[ExportedModel]:
+    """
+    Trace a trained darts NBEATS or TCN model to TorchScript and save it with what inference needs to know.
+    None if it can't be traced or saved, predict with darts then
+
+    Args:
+        params_hash (str): warm_start.model_params_hash of the model, a predict only deployment checks it
+        quantize (bool): dynamically quantize the linear layers to int8, see quantization_skip_reason
+    """
+    import torch
+
+    if quantize:
+        reason = quantization_skip_reason(model)
+        if reason is not None:
+            raise ValueError(f"Unable to quantize {model.model_name}: {reason}")
+    module = _quantized_module(model) if quantize else model.model
+    dtype = torch.float32 if quantize else next(model.model.parameters()).dtype
+    meta = {
+        "version": EXPORT_VERSION,
+        "model_name": model.model_name,
+        "params_hash": params_hash,
+        "input_chunk_length": model.input_chunk_length,
+        "output_chunk_length": model.output_chunk_length,
+        "first_prediction_index": model.first_prediction_index,
+        # the target and covariate columns, darts concatenates them into the model's input
+        "input_width": model.train_sample[0].shape[1] + model.train_sample[1].shape[1],
+        "dtype": "float64" if dtype == torch.float64 else "float32",
+        "quantized": quantize,
+    }
+    example = torch.zeros((1, meta["input_chunk_length"], meta["input_width"]), dtype=dtype)
+    module.eval()
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with torch.no_grad():  # type: ignore
+            traced = torch.jit.trace(module, example)  # type: ignore
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        torch.jit.save(traced, tmp_filename, _extra_files={"meta.json": json.dumps(meta)})  # type: ignore
+        os.replace(tmp_filename, filename)  # readers never see a half written graph
+    except (RuntimeError, OSError) as e:
+        logger.warning("Unable to export %s for inference: %s", model.model_name, e)
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        return None
+    return ExportedModel(traced, meta)
+
+
+def load_exported_model(filename: str, params_hash: Optional[str] = None) -> Optional[ExportedModel]:
+    """The exported model, or None if there isn't a usable one. With params_hash, only a model trained with it"""
+    import torch
+
+    if not os.path.exists(filename):
+        return None
+    extra_files = {"meta.json": ""}
+    try:
+        module = torch.jit.load(filename, _extra_files=extra_files)  # type: ignore
+    except RuntimeError as e:  # a corrupt or half written graph
+        logger.warning("Ignoring exported model %s: %s", filename, e)
+        return None
+    meta = json.loads(extra_files["meta.json"])
+    if meta.get("version") != EXPORT_VERSION or (params_hash is not None and meta.get("params_hash") != params_hash):
+        logger.info("Exported model %s was trained with other hyperparameters", filename)
+        return None
+    return ExportedModel(module, meta)
@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+try:  # need modules for pytest to work
+    from app.mlcode.training_pool import available_cores
+    from app.mlcode.utils import setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from training_pool import available_cores
+    from utils import setup_logging
+
+__all__ = ["get_inference_pool", "predict_concurrently"]
+
+logger = setup_logging()
+
+_pools: Dict[int, ThreadPoolExecutor] = {}
+
+
+def get_inference_pool(n_threads: int = 0) -> ThreadPoolExecutor:
+    """
+    The threads base predictions run on, shared by every prediction this process makes (--coins, --serve).
+    n_threads <= 0 means one per core. Torch releases the GIL in its ops, so the models' forward passes overlap
+    """
+    n_threads = n_threads if n_threads > 0 else available_cores()
+    if n_threads not in _pools:
+        logger.info("Starting %s inference threads", n_threads)
+        _pools[n_threads] = ThreadPoolExecutor(n_threads, thread_name_prefix="inference")
+    return _pools[n_threads]
+
+
+def predict_concurrently(
+    pool: ThreadPoolExecutor, models: List[Any], predict: Callable[[Any], float]
+) -> Dict[str, float]:
+    """predict(model) for every model at once on the pool, keyed by model_name in the order of models"""
+    futures = [pool.submit(predict, model) for model in models]
+    # result() raises the exception of a failed prediction, the same as predicting one after another
+    return {model.model_name: future.result() for model, future in zip(models, futures)}
@@ -0,0 +1,99 @@
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+from typing import Any, Dict, Iterator
+
+try:  # need modules for pytest to work
+    from app.mlcode.utils import resolve_aws_path, setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from utils import resolve_aws_path, setup_logging
+
+__all__ = ["RunMetrics", "peak_rss_mb"]
+
+logger = setup_logging()
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is kilobytes on linux and bytes on mac
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024**2 if sys.platform == "darwin" else peak_rss / 1024
+
+
+class RunMetrics:
+    def __init__(self, coin_to_predict: str):
+        """Wall time, cpu time and peak memory for each stage of one prediction run, and for each model fit/predict.
+
+        Stages are timed with stage(), models with model_stage(). write() appends the whole run as one json line.
+        Peak rss is for the whole process so far, a stage that raises it is the one that allocated the memory.
+
+        Args:
+            coin_to_predict (str): The coin this run predicts
+        """
+        self.coin_to_predict = coin_to_predict
+        self.started_at = datetime.utcnow()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.models: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self.extra: Dict[str, Any] = {}
+        self._lock = Lock()  # models are trained in threads
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.stages[name] = {
+                "wall_seconds": round(time.perf_counter() - start_wall, 4),
+                "cpu_seconds": round(time.process_time() - start_cpu, 4),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            }
+            logger.info("Stage %s = %s", name, self.stages[name])
+
+    @contextmanager
+    def model_stage(self, model_name: str, action: str) -> Iterator[None]:
+        """
+        Time one model action (fit, predict). Models train in parallel threads, so cpu time is for this thread
+        only. Torch's own worker threads aren't counted, compare wall time against the stage instead
+        """
+        start_wall, start_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            metrics = {
+                "wall_seconds": round(time.perf_counter() - start_wall, 4),
+                "thread_cpu_seconds": round(time.thread_time() - start_cpu, 4),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            }
+            self.record_model_stage(model_name, action, metrics)
+
+    def record_model_stage(self, model_name: str, action: str, metrics: Dict[str, float]) -> None:
+        """Metrics of a model action timed elsewhere, e.g. a fit in a training worker"""
+        with self._lock:
+            self.models.setdefault(model_name, {})[action] = metrics
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "coin": self.coin_to_predict,
+            "started_at": self.started_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "wall_seconds": round(time.perf_counter() - self._start_wall, 4),
+            "cpu_seconds": round(time.process_time() - self._start_cpu, 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "stages": self.stages,
+            "models": self.models,
+            **self.extra,
+        }
+
+    def write(self, filename: str, running_on_aws: bool) -> Dict[str, Any]:
+        """Append this run as one json line. Also logged, /tmp doesn't outlive a lambda run but the logs do"""
+        record = self.to_record()
+        line = json.dumps(record, sort_keys=True)
+        logger.info("Run metrics = %s", line)
+        with open(resolve_aws_path(filename, running_on_aws), "a") as f:
+            f.write(line + "\n")
+        return record
@@ -1,141 +1,274 @@
 try:  # need modules for pytest to work
+    from app.mlcode.coin_registry import LazyPriceData, get_coin_spec
     from app.mlcode.determine_trading_state import DetermineTradingState
+    from app.mlcode.feature_store import FeatureStore, open_feature_store
+    from app.mlcode.global_models import GlobalModels
+    from app.mlcode.instrumentation import RunMetrics
     from app.mlcode.predict_price_movements import CoinPricePredictor
-    from app.mlcode.utils import read_in_data, read_in_yaml, running_on_aws, setup_logging, update_yaml_config
+    from app.mlcode.state_store import CoinStateStore
+    from app.mlcode.utils import add_coin_to_filename, read_in_yaml, running_on_aws, setup_logging
 except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from coin_registry import LazyPriceData, get_coin_spec
     from predict_price_movements import CoinPricePredictor
-    from utils import read_in_yaml, read_in_data, update_yaml_config, running_on_aws, setup_logging
+    from state_store import CoinStateStore
+    from utils import add_coin_to_filename, read_in_yaml, running_on_aws, setup_logging
     from determine_trading_state import DetermineTradingState
+    from feature_store import FeatureStore, open_feature_store
+    from global_models import GlobalModels
+    from instrumentation import RunMetrics
 
 import sys
+from typing import Any, Dict, List, MutableMapping, Optional
 
 import click
 
 logger = setup_logging()
 
 
-def add_coin_to_filename(coin: str, filename: str) -> str:
+def run_coin_prediction(
+    coin_to_predict: str,
+    constants: Dict[str, Any],
+    ml_constants: Dict[str, Any],
+    price_data: LazyPriceData,
+    is_running_on_aws: bool,
+    feature_cache: Optional[MutableMapping[str, Any]] = None,
+    deadline: Optional[float] = None,
+    global_models: Optional[GlobalModels] = None,
+) -> float:
     """
-    Adds the coin to the filename
-    :param coin:
-    """
-    filename_split = filename.split("/")
-    final_filename = filename_split[0] + "/" + coin + "_" + filename_split[1]
-    logger.info(f"final_filename = {final_filename}")
-
-    return final_filename
+    Predict the price for one coin, determine the trading state and write the coin's yaml state files.
 
+    price_data and feature_cache can be shared between coins run in the same process so each csv is parsed,
+    and each set of technical indicators is built, only once. A FeatureStore feature_cache also keeps them for
+    later runs. deadline is the unix time the run has to be done by, training is cut short to meet it.
+    With global_models, trained on every coin by train_global_models, the coin doesn't train its own models.
+    """
+    coin_spec = get_coin_spec(coin_to_predict)
+    # one json line per run, next to the coin's yaml state files
+    run_metrics = RunMetrics(coin_to_predict)
+    run_metrics_filename = add_coin_to_filename(coin_to_predict, constants["run_metrics_filename"])
+    evictions_at_start = feature_cache.evictions if isinstance(feature_cache, FeatureStore) else 0
+    try:
+        price_prediction = _predict_and_update_state(
+            coin_to_predict,
+            coin_spec,
+            constants,
+            ml_constants,
+            price_data,
+            is_running_on_aws,
+            feature_cache,
+            run_metrics,
+            deadline,
+            global_models,
+        )
+    except Exception as e:
+        run_metrics.extra["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if isinstance(feature_cache, FeatureStore):  # next to the hits and misses of the run
+            feature_store_stats = run_metrics.extra.setdefault("feature_cache", {"hits": 0, "misses": 0})
+            feature_store_stats["evictions"] = feature_cache.evictions - evictions_at_start
+            feature_store_stats["size_mb"] = round(feature_cache.size_bytes() / 1024**2, 2)
+        run_metrics.write(run_metrics_filename, is_running_on_aws)
+    return price_prediction
 
-@click.command()
-@click.option("--coin_to_predict", help="Coin to predict either btc or eth")
-def main(coin_to_predict: str) -> None:
-    is_running_on_aws = running_on_aws()
-    logger.info("Running determine trading state")
 
-    constants = read_in_yaml("tmp/constants.yml", is_running_on_aws)
-    sys.stdout.flush()
+def _predict_and_update_state(
+    coin_to_predict: str,
+    coin_spec: Dict[str, Any],
+    constants: Dict[str, Any],
+    ml_constants: Dict[str, Any],
+    price_data: LazyPriceData,
+    is_running_on_aws: bool,
+    feature_cache: Optional[MutableMapping[str, Any]],
+    run_metrics: RunMetrics,
+    deadline: Optional[float],
+    global_models: Optional[GlobalModels],
+) -> float:
 
-    trading_state_filename = add_coin_to_filename(coin_to_predict, constants["trading_state_config_filename"])
-    trading_constants = read_in_yaml(trading_state_filename, is_running_on_aws)
+    # trading state, won/lost amounts and actions to take, all in one file
+    state_store = CoinStateStore(coin_to_predict, constants, is_running_on_aws)
+    state = state_store.read()
 
     all_predictions_filename = add_coin_to_filename(coin_to_predict, constants["all_predictions_csv_filename"])
 
     sys.stdout.flush()
 
-    won_lost_amount_filename = add_coin_to_filename(coin_to_predict, constants["won_and_lost_amount_filename"])
-    won_and_lost_amount_constants = read_in_yaml(won_lost_amount_filename, is_running_on_aws)
-
-    actions_to_take_filename = add_coin_to_filename(coin_to_predict, constants["actions_to_take_filename"])
-    actions_to_take_constants = read_in_yaml(actions_to_take_filename, is_running_on_aws)
-
-    # data should already be downloaded from the golang app
-    bitcoin_df = read_in_data(constants["bitcoin_csv_filename"], is_running_on_aws, constants["date_col"])
-    etherum_df = read_in_data(constants["etherum_csv_filename"], is_running_on_aws, constants["date_col"])
-    sol_df = read_in_data(constants["sol_csv_filename"], is_running_on_aws, constants["date_col"])
-    matic_df = read_in_data(constants["matic_csv_filename"], is_running_on_aws, constants["date_col"])
-    link_df = read_in_data(constants["link_csv_filename"], is_running_on_aws, constants["date_col"])
-    tbt_df = read_in_data(constants["tbt_csv_filename"], is_running_on_aws, constants["date_col"])
-    # spy_df = read_in_data(constants["spu_csv_filename"], is_running_on_aws, missing_dates=True)
-    ml_constants = read_in_yaml(constants["ml_config_filename"], is_running_on_aws)
-    predictor = None
+    # data should already be downloaded from the golang app. Only read in the csvs this coin needs
+    logger.info("%s uses %s with %s", coin_to_predict, coin_spec["input_csv"], coin_spec["additional_csvs"])
 
     sys.stdout.flush()
-    if coin_to_predict == "btc":
-        predictor = CoinPricePredictor(
-            coin_to_predict=coin_to_predict,
-            constants=constants,
-            ml_constants=ml_constants,
-            input_df=bitcoin_df,
-            all_predictions_filename=all_predictions_filename,
-            additional_dfs=[etherum_df, tbt_df],  # spy_df
-        )
-    elif coin_to_predict == "eth":
-        predictor = CoinPricePredictor(
-            coin_to_predict=coin_to_predict,
-            constants=constants,
-            ml_constants=ml_constants,
-            input_df=etherum_df,
-            all_predictions_filename=all_predictions_filename,
-            additional_dfs=[bitcoin_df, tbt_df],  # spy_df
-        )
-    elif coin_to_predict == "sol":
-        predictor = CoinPricePredictor(
-            coin_to_predict=coin_to_predict,
-            constants=constants,
-            ml_constants=ml_constants,
-            input_df=sol_df,
-            all_predictions_filename=all_predictions_filename,
-            additional_dfs=[bitcoin_df, tbt_df],
-        )
-    elif coin_to_predict == "matic":
-        predictor = CoinPricePredictor(
-            coin_to_predict=coin_to_predict,
-            constants=constants,
-            ml_constants=ml_constants,
-            input_df=matic_df,
-            all_predictions_filename=all_predictions_filename,
-            additional_dfs=[bitcoin_df, tbt_df],
-        )
-    elif coin_to_predict == "link":
-        predictor = CoinPricePredictor(
-            coin_to_predict=coin_to_predict,
-            constants=constants,
-            ml_constants=ml_constants,
-            input_df=link_df,
-            all_predictions_filename=all_predictions_filename,
-            additional_dfs=[bitcoin_df, tbt_df],
-        )
-    else:
-        raise ValueError(f"Incorrect coin to predict {coin_to_predict}. Should be btc, eth, sol, matic or link")
+    with run_metrics.stage("read_in_data"):
+        input_df = price_data.get_input_df(coin_to_predict)
+        additional_dfs = price_data.get_additional_dfs(coin_to_predict)
+    predictor = CoinPricePredictor(
+        coin_to_predict=coin_to_predict,
+        constants=constants,
+        ml_constants=ml_constants,
+        input_df=input_df,
+        all_predictions_filename=all_predictions_filename,
+        additional_dfs=additional_dfs,
+        feature_cache=feature_cache,
+        run_metrics=run_metrics,
+        deadline=deadline,
+        global_models=global_models,
+    )
     sys.stdout.flush()
     logger.info("Predict Price Movements")
     sys.stdout.flush()
     price_prediction = predictor.predict()
     logger.info("Determine trading state")
 
-    # predictor.df has the bollinger bands
-    trading_state_class = DetermineTradingState(
-        coin_to_predict,
-        price_prediction,
-        constants,
-        trading_constants,
-        predictor.df,
-        won_and_lost_amount_constants,
-        actions_to_take_constants,
-        is_running_on_aws,
-    )
+    with run_metrics.stage("determine_trading_state"):
+        # predictor.df has the bollinger bands
+        trading_state_class = DetermineTradingState(
+            coin_to_predict,
+            price_prediction,
+            constants,
+            state["trading_state"],
+            predictor.df,
+            state["won_and_lost"],
+            state["actions_to_take"],
+            is_running_on_aws,
+        )
+        sys.stdout.flush()
+        trading_state_class.calculate_positions()
+        logger.info("---- Finished determining trading strategy --- ")
+        trading_state_class.update_state()
+        # this works
+
+    with run_metrics.stage("write_state"):
+        state_store.write(
+            {
+                "trading_state": trading_state_class.trading_state_constants,
+                "won_and_lost": trading_state_class.won_and_lose_amount_dict,
+                "actions_to_take": trading_state_class.actions_to_take_constants,
+            }
+        )
+        logger.info("---- Updated trading state, win/lost and actions to take --- ")
+    run_metrics.extra["price_prediction"] = float(price_prediction)
+    run_metrics.extra["action_to_take"] = trading_state_class.actions_to_take_constants.get("action_to_take")
+    return price_prediction
+
+
+def train_global_models(
+    coins_to_predict: List[str],
+    constants: Dict[str, Any],
+    ml_constants: Dict[str, Any],
+    price_data: LazyPriceData,
+    is_running_on_aws: bool,
+    feature_cache: Optional[MutableMapping[str, Any]] = None,
+    deadline: Optional[float] = None,
+) -> GlobalModels:
+    """
+    Build the series of every coin and train one NBEATS and one TCN per lookback window on all of them.
+    A coin whose series can't be built is left out, its run_coin_prediction fails on its own.
+    Run metrics go in the global run metrics file
+    """
+    run_metrics = RunMetrics("global")
+    n_additional_dfs = {len(get_coin_spec(coin)["additional_csvs"]) for coin in coins_to_predict}
+    if len(n_additional_dfs) != 1:
+        raise ValueError(f"Global models need the same number of additional dfs for {coins_to_predict}")
+    global_models = GlobalModels(constants, ml_constants, n_additional_dfs.pop(), deadline)
+    try:
+        coin_series = []
+        for coin in coins_to_predict:
+            try:
+                with run_metrics.stage(f"build_series_{coin}"):
+                    predictor = CoinPricePredictor(
+                        coin_to_predict=coin,
+                        constants=constants,
+                        ml_constants=ml_constants,
+                        input_df=price_data.get_input_df(coin),
+                        all_predictions_filename=add_coin_to_filename(coin, constants["all_predictions_csv_filename"]),
+                        additional_dfs=price_data.get_additional_dfs(coin),
+                        feature_cache=feature_cache,
+                        run_metrics=run_metrics,
+                    )
+                    coin_series.append(predictor.build_series())
+            except Exception:
+                logger.exception("Unable to build the series of %s for the global models", coin)
+        with run_metrics.stage("train_global_models"):
+            global_models.train(coin_series, run_metrics)
+    finally:
+        run_metrics.write(add_coin_to_filename("global", constants["run_metrics_filename"]), is_running_on_aws)
+    return global_models
+
+
+def parse_coins(coin_to_predict: Optional[str], coins: Optional[str]) -> List[str]:
+    """Combine --coin_to_predict and --coins into the list of coins to run, validating each one"""
+    if coin_to_predict and coins:
+        raise click.UsageError("Use either --coin_to_predict or --coins, not both")
+    if coins:
+        coins_to_predict = [coin.strip().lower() for coin in coins.split(",") if coin.strip()]
+    elif coin_to_predict:
+        coins_to_predict = [coin_to_predict]
+    else:
+        raise click.UsageError("Need --coin_to_predict or --coins")
+
+    for coin in coins_to_predict:
+        get_coin_spec(coin)  # fail fast on a coin we don't trade
+    return list(dict.fromkeys(coins_to_predict))  # drop duplicates, keep the order
+
+
+def _serve(socket_path: str, has_run_options: bool) -> None:
+    if has_run_options:
+        raise click.UsageError("--serve takes the coin and deadline from each request, not from the command line")
+    try:
+        from app.mlcode.prediction_worker import serve
+    except ModuleNotFoundError:
+        from prediction_worker import serve
+    serve(socket_path)
+
+
+@click.command()
+@click.option("--coin_to_predict", help="Coin to predict btc, eth, sol, matic or link")
+@click.option("--coins", help="Comma separated coins to predict in one process, e.g. btc,eth,sol,matic,link")
+@click.option("--serve", "socket_path", help="Run as a long lived worker listening on this unix socket")
+@click.option("--deadline", type=float, help="Unix time to finish by, e.g. the lambda timeout. Training is cut short")
+def main(
+    coin_to_predict: Optional[str], coins: Optional[str], socket_path: Optional[str], deadline: Optional[float]
+) -> None:
+    if socket_path:
+        _serve(socket_path, bool(coin_to_predict or coins or deadline))
+        return
+
+    is_running_on_aws = running_on_aws()
+    coins_to_predict = parse_coins(coin_to_predict, coins)
+    logger.info("Running determine trading state for %s", coins_to_predict)
+
+    constants = read_in_yaml("tmp/constants.yml", is_running_on_aws)
+    ml_constants = read_in_yaml(constants["ml_config_filename"], is_running_on_aws)
     sys.stdout.flush()
-    trading_state_class.calculate_positions()
-    logger.info("---- Finished determining trading strategy --- ")
-    trading_state_class.update_state()
-    # this works
-
-    update_yaml_config(trading_state_filename, trading_state_class.trading_state_constants, is_running_on_aws)
-    logger.info("---- Updated trading state config --- ")
-    update_yaml_config(won_lost_amount_filename, trading_state_class.won_and_lose_amount_dict, is_running_on_aws)
-    logger.info("---- Updated win/lost state config --- ")
-    update_yaml_config(actions_to_take_filename, trading_state_class.actions_to_take_constants, is_running_on_aws)
-    logger.info("---- Updated actions to take state config --- ")
+
+    # shared between coins. Each csv is read once and covariate indicators (btc, tbt) are built once
+    price_data = LazyPriceData(constants, is_running_on_aws)
+    feature_cache = open_feature_store(constants, is_running_on_aws)
+
+    # one set of models for every coin instead of a set per coin
+    global_models = None
+    if ml_constants["prediction_params"].get("global_models", False) and len(coins_to_predict) > 1:
+        global_models = train_global_models(
+            coins_to_predict, constants, ml_constants, price_data, is_running_on_aws, feature_cache, deadline
+        )
+
+    failed_coins = []
+    for coin in coins_to_predict:
+        logger.info("---- Running coin %s ----", coin)
+        try:
+            run_coin_prediction(
+                coin, constants, ml_constants, price_data, is_running_on_aws, feature_cache, deadline, global_models
+            )
+        except Exception:
+            if len(coins_to_predict) == 1:
+                raise
+            # one coin failing shouldn't stop the others from updating their state
+            logger.exception("Failed to run coin %s", coin)
+            failed_coins.append(coin)
+        sys.stdout.flush()
+
+    if failed_coins:
+        raise ValueError(f"Failed to predict coins {failed_coins}")
 
 
 if __name__ == "__main__":
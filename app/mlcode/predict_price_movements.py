@@ -1,31 +1,132 @@
 #!/usr/bin/env python
+import hashlib
+import logging
 import os
 import sys
+import time
 from threading import Thread
-from typing import Any, Dict, List, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, MutableMapping, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-from darts import TimeSeries
-from darts.dataprocessing.transformers import Scaler
-from darts.models import NBEATSModel, TCNModel
-from darts.utils.missing_values import fill_missing_values
-from darts.utils.timeseries_generation import datetime_attribute_timeseries
-from finta import TA
-from sklearn.ensemble import RandomForestRegressor
 
 try:  # need modules for pytest to work
     from app.mlcode.base_predictions import BasePredictor
-    from app.mlcode.utils import running_on_aws, setup_logging
+    from app.mlcode.calendar_alignment import align_to_daily_calendar
+    from app.mlcode.coin_registry import get_coin_spec
+    from app.mlcode.indicator_state import StreamingIndicators, indicator_state_filename
+    from app.mlcode.indicators import INDICATOR_NAMES, compute_indicators, stack_assets
+    from app.mlcode.inference_export import (
+        ExportedModel,
+        export_model,
+        exported_model_filename,
+        quantization_skip_reason,
+    )
+    from app.mlcode.instrumentation import RunMetrics
+    from app.mlcode.scaling import MinMaxColumns, unique_component_names
+    from app.mlcode.training_pool import (
+        fit_model,
+        get_training_pool,
+        load_trained_weights,
+        split_cores,
+        trained_weights,
+    )
+    from app.mlcode.training_schedule import (
+        epoch_seconds_key,
+        historical_errors,
+        plan_within_budget,
+        training_windows,
+    )
+    from app.mlcode.utils import frame_fingerprint, resolve_aws_path, running_on_aws, setup_logging
+    from app.mlcode.warm_start import load_checkpoint, model_params_hash, save_checkpoint, warm_start_filename
 except ModuleNotFoundError:  # Go is unable to run python modules -m
     from base_predictions import BasePredictor
-    from utils import running_on_aws, setup_logging
+    from calendar_alignment import align_to_daily_calendar
+    from coin_registry import get_coin_spec
+    from indicator_state import StreamingIndicators, indicator_state_filename
+    from indicators import INDICATOR_NAMES, compute_indicators, stack_assets
+    from inference_export import ExportedModel, export_model, exported_model_filename, quantization_skip_reason
+    from instrumentation import RunMetrics
+    from scaling import MinMaxColumns, unique_component_names
+    from training_pool import fit_model, get_training_pool, load_trained_weights, split_cores, trained_weights
+    from training_schedule import epoch_seconds_key, historical_errors, plan_within_budget, training_windows
+    from utils import frame_fingerprint, resolve_aws_path, running_on_aws, setup_logging
+    from warm_start import load_checkpoint, model_params_hash, save_checkpoint, warm_start_filename
 
 
-__all__ = ["CoinPricePredictor"]
+# darts (and torch) and sklearn take seconds to import. They are imported inside the stage that uses them
+# so the configs and csvs can be read first, and so importing this module stays cheap.
+if TYPE_CHECKING:
+    from darts import TimeSeries
+
+    from app.mlcode.global_models import GlobalModels
+
+__all__ = ["CoinPricePredictor", "create_lookback_models", "model_work_dir"]
 
 logger = setup_logging()
 
+# a model to fit: the series, covariates and epochs to fit it on and the weights to start from, None from scratch
+TrainingJob = Tuple[Any, "TimeSeries", "TimeSeries", int, Optional[Dict[str, Any]]]
+
+
+def model_work_dir(ml_constants: Dict[str, Any]) -> str:
+    # darts' work dir, on lambda the shared storage
+    if "ON_LOCAL" in os.environ:
+        return "./"
+    return ml_constants["prediction_params"]["work_dir"]
+
+
+def create_lookback_models(
+    nbeats_model_name: str,
+    tcn_model_name: str,
+    ml_constants: Dict[str, Any],
+    n_additional_dfs: int,
+    random_state: int,
+) -> List[List[Any]]:
+    """An untrained [NBEATS, TCN] pair for every lookback window, named after the lookback and bollinger params"""
+    from darts.models import NBEATSModel, TCNModel
+
+    prediction_params = ml_constants["prediction_params"]
+    window, no_of_std = prediction_params["bollinger_window"], prediction_params["no_of_std"]
+    models = []
+    for lookback_window in prediction_params["lookback_window"]:
+        MODEL_NAME_CONSTANT = (
+            f"_lookback_{lookback_window}_window_{window}_std_{no_of_std}_num_add_dfs_{n_additional_dfs}"
+        )
+        logger.info("Creating model name = %s", MODEL_NAME_CONSTANT)
+        work_dir = model_work_dir(ml_constants)
+
+        nbeats_model = NBEATSModel(
+            input_chunk_length=lookback_window,
+            output_chunk_length=prediction_params["prediction_n_days"],
+            random_state=random_state,
+            model_name=nbeats_model_name + MODEL_NAME_CONSTANT,
+            num_blocks=ml_constants["hyperparameters_nbeats"]["num_blocks"],
+            layer_widths=ml_constants["hyperparameters_nbeats"]["layer_widths"],
+            force_reset=True,
+            log_tensorboard=False,
+            work_dir=work_dir,
+            save_checkpoints=False,
+        )
+        tcn_model = TCNModel(
+            dropout=ml_constants["hyperparameters_tcn"]["dropout"],
+            random_state=random_state,
+            dilation_base=ml_constants["hyperparameters_tcn"]["dilation_base"],
+            weight_norm=ml_constants["hyperparameters_tcn"]["weight_norm"],
+            kernel_size=ml_constants["hyperparameters_tcn"]["kernel_size"],
+            num_filters=ml_constants["hyperparameters_tcn"]["num_filters"],
+            num_layers=ml_constants["hyperparameters_tcn"]["num_layers"],
+            input_chunk_length=lookback_window,
+            output_chunk_length=prediction_params["prediction_n_days"],
+            model_name=tcn_model_name + MODEL_NAME_CONSTANT,
+            force_reset=True,
+            log_tensorboard=False,
+            work_dir=work_dir,
+            save_checkpoints=False,
+        )
+        models.append([nbeats_model, tcn_model])
+    return models
+
 
 class CoinPricePredictor(BasePredictor):
     def __init__(
@@ -40,7 +141,24 @@ class CoinPricePredictor(BasePredictor):
         verbose: bool = True,
         n_years_filter: int = 3,
         stacking_model_name: str = "RF",
+        feature_cache: Optional[MutableMapping[str, Any]] = None,
+        run_metrics: Optional[RunMetrics] = None,
+        deadline: Optional[float] = None,
+        global_models: Optional["GlobalModels"] = None,
     ):
+        """
+        feature_cache: optional mapping shared between predictors, a dict for one process or a FeatureStore across
+            runs. Technical indicators, scaled covariates and trained model weights are stored here keyed by the data
+            they were built from, so covariates shared by several coins are built once and a rerun on the same data
+            doesn't retrain
+        run_metrics: records the time and memory of each stage of predict() and of each model fit/predict
+        deadline: unix time the run has to be done by, e.g. the lambda timeout. Training leaves
+            deadline_reserve_seconds for the rest of the run, stopping fits early and skipping the least useful models
+            when it runs short. A skipped model's last prediction stands in for today's in the stacking model's input,
+            its saved prediction is NaN, see _schedule_jobs
+        global_models: models already trained on the series of every coin (--coins with global_models: true).
+            They predict this coin instead of its own models, see GlobalModels
+        """
         super().__init__()
         self.n_years_filer = n_years_filter
 
@@ -49,11 +167,16 @@ class CoinPricePredictor(BasePredictor):
         self.ml_constants: Dict[str, Any] = ml_constants
         self.window = self.ml_constants["prediction_params"]["bollinger_window"]
         self.no_of_std = self.ml_constants["prediction_params"]["no_of_std"]
+        self.streaming_indicators = self.ml_constants["prediction_params"].get("streaming_indicators", False)
         self.df = input_df
         self.all_predictions_filename = all_predictions_filename
         self.additional_dfs = additional_dfs
         self.period = period
         self.verbose = verbose
+        self.feature_cache = feature_cache
+        self.run_metrics = run_metrics if run_metrics is not None else RunMetrics(coin_to_predict)
+        self.deadline = deadline
+        self.global_models = global_models
 
         # TODO: remember to add new columns here
         self.ml_train_cols = [
@@ -70,124 +193,42 @@ class CoinPricePredictor(BasePredictor):
         ]
         self.pred_col = self.constants["close_col"]
         self.date_col = self.constants["date_col"]
+        self.prediction_store = self._prediction_store()
+        self._predictions_df: Optional[pd.DataFrame] = None
 
         if type(self.ml_constants["prediction_params"]["lookback_window"]) != list:
             raise ValueError("Need to enter a list for loockback_window")
 
         self.models: List[Any] = []  # store models here
+        # fine tune yesterday's weights instead of training from scratch, see _warm_start_job
+        self.warm_start = self.ml_constants["prediction_params"].get("warm_start", False)
+        self._warm_start_params: Dict[str, Tuple[str, int]] = {}  # model name -> params hash, fine tunes in a row
+        self.skipped_models: List[str] = []  # not trained, out of time before the deadline
+        self.stale_predictions: Dict[str, float] = {}  # skipped model -> its last prediction, see _stale_predictions
+        self._fits: Dict[str, Dict[str, Any]] = {}  # model name -> epochs fit, seconds per epoch, stopped early
+        # with inference_backend: torchscript, the trained models predict through these, see _export_models
+        self.exported_models: Dict[str, ExportedModel] = {}
 
-        self.tcn_model = TCNModel
-        self.nbeats_model = NBEATSModel
         self.stacking_model_name = stacking_model_name
         self.random_state = 432
 
-    def _create_models(self, load_model: bool = False) -> None:
-        # TODO: we should really convert self.additional_dfs into a dict so we can lookup the names of the addtional DFs we are using to predict against. Using the length is ok as long as we don't remove DFs. 🤷‍♂️
+    def _work_dir(self) -> str:
+        return model_work_dir(self.ml_constants)
 
-        nbeats_model_name: str = ""
-
-        if self.coin_to_predict.lower() == "btc":
-            tcn_model_name = self.constants["tcn_modelname_btc"]
-            tcn_filename = self.constants["tcn_filename_btc"]
-            nbeats_model_name = self.constants["nbeats_modelname_btc"]
-            nbeats_filename = self.constants["nbeats_filename_btc"]
-        elif self.coin_to_predict.lower() == "eth":
-            tcn_model_name = self.constants["tcn_modelname_eth"]
-            tcn_filename = self.constants["tcn_filename_eth"]
-            nbeats_model_name = self.constants["nbeats_modelname_eth"]
-            nbeats_filename = self.constants["nbeats_filename_eth"]
-        elif self.coin_to_predict.lower() == "sol":
-            tcn_model_name = self.constants["tcn_modelname_sol"]
-            tcn_filename = self.constants["tcn_filename_sol"]
-            nbeats_model_name = self.constants["nbeats_modelname_sol"]
-            nbeats_filename = self.constants["nbeats_filename_sol"]
-        elif self.coin_to_predict.lower() == "matic":
-            tcn_model_name = self.constants["tcn_modelname_matic"]
-            tcn_filename = self.constants["tcn_filename_matic"]
-            nbeats_model_name = self.constants["nbeats_modelname_matic"]
-            nbeats_filename = self.constants["nbeats_filename_matic"]
-        elif self.coin_to_predict.lower() == "link":
-            tcn_model_name = self.constants["tcn_modelname_link"]
-            tcn_filename = self.constants["tcn_filename_link"]
-            nbeats_model_name = self.constants["nbeats_modelname_link"]
-            nbeats_filename = self.constants["nbeats_filename_link"]
+    def _create_models(self) -> None:
+        # TODO: we should really convert self.additional_dfs into a dict so we can lookup the names of the addtional DFs we are using to predict against. Using the length is ok as long as we don't remove DFs. 🤷‍♂️
 
-        else:
-            raise ValueError(f"You haven't added the correct class vars for the coin {self.coin_to_predict}")
+        coin_spec = get_coin_spec(self.coin_to_predict.lower())
+        tcn_model_name = self.constants[coin_spec["tcn_modelname"]]
+        tcn_filename = self.constants[coin_spec["tcn_filename"]]
+        nbeats_model_name = self.constants[coin_spec["nbeats_modelname"]]
         logger.info("------")
         logger.info(f"Creating models for coin {self.coin_to_predict}")
-
-        for lookback_window in self.ml_constants["prediction_params"]["lookback_window"]:
-            MODEL_NAME_CONSTANT = f"_lookback_{lookback_window}_window_{self.window}_std_{self.no_of_std}_num_add_dfs_{len(self.additional_dfs)}"
-            logger.info(f"len(self.additional_dfs) = {len(self.additional_dfs)}")
-            logger.info(f"Creating model name = {MODEL_NAME_CONSTANT}")
-            if "ON_LOCAL" in os.environ:
-                work_dir = "./"
-            else:
-                work_dir = self.ml_constants["prediction_params"]["work_dir"]
-
-            nbeats_model = NBEATSModel(
-                input_chunk_length=lookback_window,
-                output_chunk_length=self.ml_constants["prediction_params"]["prediction_n_days"],
-                random_state=self.random_state,
-                model_name=nbeats_model_name + MODEL_NAME_CONSTANT,
-                num_blocks=self.ml_constants["hyperparameters_nbeats"]["num_blocks"],
-                layer_widths=self.ml_constants["hyperparameters_nbeats"]["layer_widths"],
-                force_reset=True,
-                log_tensorboard=False,
-                work_dir=work_dir,
-                save_checkpoints=False,
-            )
-            if load_model:
-
-                self.nbeats_model.load_from_checkpoint(
-                    model_name=nbeats_model_name,
-                    file_name=nbeats_filename,
-                    work_dir=self.constants["ml_models_dir"],
-                    best=False,
-                )
-
-                logger.info(f"Loading model {tcn_model_name}, {tcn_filename}")
-
-            logger.info(f"Creating model {tcn_model_name},{tcn_filename}")
-
-            tcn_model = TCNModel(
-                dropout=self.ml_constants["hyperparameters_tcn"]["dropout"],
-                random_state=self.random_state,
-                dilation_base=self.ml_constants["hyperparameters_tcn"]["dilation_base"],
-                weight_norm=self.ml_constants["hyperparameters_tcn"]["weight_norm"],
-                kernel_size=self.ml_constants["hyperparameters_tcn"]["kernel_size"],
-                num_filters=self.ml_constants["hyperparameters_tcn"]["num_filters"],
-                num_layers=self.ml_constants["hyperparameters_tcn"]["num_layers"],
-                input_chunk_length=lookback_window,
-                output_chunk_length=self.ml_constants["prediction_params"]["prediction_n_days"],
-                model_name=tcn_model_name + MODEL_NAME_CONSTANT,
-                force_reset=True,
-                log_tensorboard=False,
-                work_dir=work_dir,
-                save_checkpoints=False,
-            )
-            # This works
-            if load_model:
-                self.tcn_model.load_from_checkpoint(
-                    model_name=tcn_model_name,
-                    work_dir=self.constants["ml_models_dir"],
-                    file_name=tcn_filename,
-                    best=False,
-                )
-            logger.info("---- Finished creating models ----")
-            self.models.append([nbeats_model, tcn_model])
-
-    def _add_indicators(self, input_df: pd.DataFrame) -> pd.DataFrame:
-
-        input_df[self.constants["stc_col"]] = TA.STC(input_df)
-        input_df[self.constants["stoch_col"]] = TA.STOCH(input_df)
-        input_df[self.constants["rsi_col"]] = TA.RSI(input_df, period=self.window)
-        macd_df = TA.MACD(input_df)
-        input_df[self.constants["macd_col"]] = macd_df["MACD"]
-        input_df[self.constants["macd_signal_col"]] = macd_df["SIGNAL"]
-
-        return input_df.fillna(0)
+        logger.info("Creating model %s,%s", tcn_model_name, tcn_filename)
+        self.models = create_lookback_models(
+            nbeats_model_name, tcn_model_name, self.ml_constants, len(self.additional_dfs), self.random_state
+        )
+        logger.info("---- Finished creating models ----")
 
     def _slice_df(self) -> None:
         # some dataframes don't have enough data a full lookback window
@@ -215,127 +256,211 @@ class CoinPricePredictor(BasePredictor):
                 sliced_additional_dfs.append(sliced_df)
         self.additional_dfs = sliced_additional_dfs
 
-    def _build_technical_indicators(self) -> None:
-
-        rolling_mean = self.df[self.pred_col].rolling(self.window).mean()
-        rolling_std = self.df[self.pred_col].rolling(self.window).std()
-
-        self.df[self.constants["rolling_mean_col"]] = rolling_mean
-        self.df[self.constants["bollinger_high_col"]] = rolling_mean + (rolling_std * self.no_of_std)
-        self.df[self.constants["bollinger_low_col"]] = rolling_mean - (rolling_std * self.no_of_std)
-        logger.info("---- Adding Bollinger Bands ----")
-        logger.info(self.df.tail())
+    def _indicator_state_filenames(self) -> List[str]:
+        """Where the streaming indicators of the coin and additional dfs are kept, next to their csvs, by first row"""
+        coin_spec = get_coin_spec(self.coin_to_predict)
+        csv_keys = [coin_spec["input_csv"]] + coin_spec["additional_csvs"]
+        if len(csv_keys) != 1 + len(self.additional_dfs):
+            raise ValueError(
+                f"Streaming indicators need the {len(coin_spec['additional_csvs'])} additional dfs of "
+                f"{self.coin_to_predict}, got {len(self.additional_dfs)}"
+            )
+        csv_filenames = [resolve_aws_path(self.constants[csv_key], running_on_aws()) for csv_key in csv_keys]
+        if running_on_aws():  # /tmp doesn't outlive the lambda, the shared storage does
+            state_dir = os.path.join(self._work_dir(), "indicator_state")
+            os.makedirs(state_dir, exist_ok=True)
+            csv_filenames = [os.path.join(state_dir, os.path.basename(filename)) for filename in csv_filenames]
+        return [
+            indicator_state_filename(csv_filename, df.index.min())
+            for csv_filename, df in zip(csv_filenames, [self.df] + self.additional_dfs)
+        ]
 
-        # add rsi
-        self.df = self._add_indicators(self.df)
+    def _add_bollinger_bands_and_indicators(
+        self, input_dfs: List[pd.DataFrame], state_filenames: Optional[List[str]] = None
+    ) -> List[pd.DataFrame]:
+        """
+        Add the bollinger bands and indicators to every df, computed for all of them at once.
+        With state_filenames they carry on from the last run and only new rows are computed
+        """
+        price_cols = [self.pred_col, self.constants["high_col"], self.constants["low_col"]]
+        if state_filenames is not None:
+            streaming_indicators = StreamingIndicators(self.window, self.no_of_std)
+            frame_indicators = streaming_indicators.build([df[price_cols] for df in input_dfs], state_filenames)
+            self.run_metrics.extra.setdefault("streaming_indicators", {}).update(streaming_indicators.report)
+        else:
+            indicators = compute_indicators(
+                *[stack_assets([df[col] for df in input_dfs]) for col in price_cols],
+                window=self.window,
+                no_of_std=self.no_of_std,
+            )
+            frame_indicators = [
+                {name: values[i, values.shape[1] - len(df) :] for name, values in indicators.items()}
+                for i, df in enumerate(input_dfs)
+            ]
+
+        indicator_dfs = []
+        for input_df, indicators_for_df in zip(input_dfs, frame_indicators):
+            # streamed dfs aren't sliced yet, they are the LazyPriceData frames shared with the other coins
+            indicator_df = input_df.copy()
+            for indicator_name, values in indicators_for_df.items():
+                indicator_df[self.constants[f"{indicator_name}_col"]] = values
+            indicator_dfs.append(indicator_df.fillna(0))
+        return indicator_dfs
+
+    def _feature_key(self, kind: str, input_df: pd.DataFrame, columns: List[str]) -> str:
+        """Content address of features built from input_df: its hash, the bollinger params and the columns built"""
+        columns_hash = hashlib.sha1(",".join(columns).encode()).hexdigest()[:12]
+        return f"{kind}_{frame_fingerprint(input_df)}_window_{self.window}_std_{self.no_of_std}_cols_{columns_hash}"
+
+    def _count_feature_cache(self, hits: int, misses: int) -> None:
+        counts = self.run_metrics.extra.setdefault("feature_cache", {"hits": 0, "misses": 0})
+        counts["hits"] += hits
+        counts["misses"] += misses
+
+    def _technical_indicators_with_cache(
+        self, input_dfs: List[pd.DataFrame], state_filenames: Optional[List[str]] = None
+    ) -> List[pd.DataFrame]:
+        """
+        Build the indicators for every df. If we were given a feature_cache, reuse the indicators of an identical
+        df (same dates and prices) built for another coin, in this process or, with a FeatureStore, an earlier run.
+        Only the dfs we haven't seen are built, together in one pass.
+        """
+        if self.feature_cache is None:
+            return self._add_bollinger_bands_and_indicators(input_dfs, state_filenames)
+
+        kind = "indicators_streaming" if state_filenames is not None else "indicators"
+        indicator_cols = [self.constants[f"{name}_col"] for name in INDICATOR_NAMES]
+        cache_keys = [self._feature_key(kind, input_df, indicator_cols) for input_df in input_dfs]
+        missing = [i for i, cache_key in enumerate(cache_keys) if cache_key not in self.feature_cache]
+        for cache_key in set(cache_keys) & set(self.feature_cache):
+            logger.info("Reusing technical indicators %s", cache_key)
+        self._count_feature_cache(hits=len(cache_keys) - len(missing), misses=len(missing))
+
+        if len(missing) > 0:
+            built_dfs = self._add_bollinger_bands_and_indicators(
+                [input_dfs[i] for i in missing],
+                None if state_filenames is None else [state_filenames[i] for i in missing],
+            )
+            for i, indicators_df in zip(missing, built_dfs):
+                self.feature_cache[cache_keys[i]] = indicators_df.copy()
+        return [self.feature_cache[cache_key].copy() for cache_key in cache_keys]
 
-        new_additional_dfs = []
-        if len(self.additional_dfs) > 0:
-            for df in self.additional_dfs:
-                rolling_mean = df[self.pred_col].rolling(self.window).mean()
-                rolling_std = df[self.pred_col].rolling(self.window).std()
+    def _build_technical_indicators(self) -> None:
 
-                df[self.constants["rolling_mean_col"]] = rolling_mean
-                df[self.constants["bollinger_high_col"]] = rolling_mean + (rolling_std * self.no_of_std)
-                df[self.constants["bollinger_low_col"]] = rolling_mean - (rolling_std * self.no_of_std)
-                # add rsi
-                df = self._add_indicators(df)
+        state_filenames = self._indicator_state_filenames() if self.streaming_indicators else None
+        indicator_dfs = self._technical_indicators_with_cache([self.df] + self.additional_dfs, state_filenames)
+        self.df, self.additional_dfs = indicator_dfs[0], indicator_dfs[1:]
+        logger.info("---- Adding Bollinger Bands ----")
+        logger.debug("%s", self.df.tail())
+        for df in self.additional_dfs:
+            logger.debug("%s", df.tail())
 
-                new_additional_dfs.append(df)
-                logger.info(df.tail())
-        self.additional_dfs = new_additional_dfs
+    def _align_calendars(self) -> None:
+        """
+        Put the additional dfs on the daily calendar of the coin we predict, after the indicators are built so
+        TBT's indicators are over trading days. Fills the weekends and holidays the TimeSeries can't have
+        """
+        aligned_dfs, calendar_gaps = align_to_daily_calendar(
+            [self.df] + self.additional_dfs,
+            [self.coin_to_predict] + [f"additional_df_{i}" for i in range(len(self.additional_dfs))],
+        )
+        self.df, self.additional_dfs = aligned_dfs[0], aligned_dfs[1:]
+        self.run_metrics.extra["calendar_gaps"] = calendar_gaps
 
     def _scale_time_series_df_and_time_cols(
         self, input_df: pd.DataFrame, time_cols: List[str] = ["year", "month", "day"]
-    ) -> Tuple[Dict[str, Scaler], TimeSeries, TimeSeries]:
-        ts_transformers: Dict[str, Scaler] = {}
-        ts_stacked_series = None
-        ts_transformers, ts_stacked_series = self._scale_time_series_df(input_df)
-
-        # build year and month and day series:
-        for col in time_cols:
-            transformer = Scaler()
-            transformed_series = transformer.fit_transform(
-                fill_missing_values(datetime_attribute_timeseries(ts_stacked_series, attribute=col))
-            )
-            ts_transformers[col] = transformer
+    ) -> Tuple[MinMaxColumns, np.ndarray, "TimeSeries"]:
+        """
+        Scale the training cols of the df to predict and its year, month and day, all in one array
 
-            ts_stacked_series = ts_stacked_series.stack(transformed_series)
+        Returns:
+            Tuple[MinMaxColumns, np.ndarray, TimeSeries]: the scaler, the scaled [time, column] values and the
+                unscaled series to predict
+        """
+        from darts import TimeSeries
 
-        return (ts_transformers, ts_stacked_series, TimeSeries.from_series(input_df[self.pred_col], freq=self.period))
+        time_values = np.column_stack([getattr(input_df.index, col) for col in time_cols])
+        values = np.hstack([input_df[self.ml_train_cols].to_numpy(dtype=float), time_values])
+        scaler = MinMaxColumns(self.ml_train_cols + time_cols)
+        return (scaler, scaler.fit_transform(values), TimeSeries.from_series(input_df[self.pred_col], freq=self.period))
 
     def _scale_time_series_df(
         self, input_df: pd.DataFrame, use_pred_col: bool = False
-    ) -> Tuple[Dict[Any, Scaler], Any]:
+    ) -> Tuple[MinMaxColumns, np.ndarray]:
         """
-        Scale an input time series col from 0 to 1
+        Scale the training cols from 0 to 1, every col at once
 
-        input_df: the DF that contains the col
+        input_df: the DF that contains the col, already on a daily calendar with no gaps (see _align_calendars)
         use_pred_col: if we are transforming additional DFs, we can use the pred col 'close' for them
         """
-        ts_transformers = {}
-        ts_stacked_series = None
         cols_to_transform = self.ml_train_cols.copy()
         # if we have additional DFs, we can include their close price
         if use_pred_col:
             cols_to_transform.append(self.pred_col)
-        for col in cols_to_transform:
-            transformer = Scaler()
+        scaler = MinMaxColumns(cols_to_transform)
+        return scaler, scaler.fit_transform(input_df[cols_to_transform].to_numpy(dtype=float))
 
-            transformed_series = transformer.fit_transform(
-                fill_missing_values(TimeSeries.from_series(input_df[col], freq=self.period))
-            )
-            ts_transformers[col] = transformer
+    def _scaled_covariates_with_cache(self, input_df: pd.DataFrame) -> Tuple[MinMaxColumns, np.ndarray]:
+        """
+        Scale an additional df (with its close price). With a feature_cache the scaler and scaled values of an
+        identical df are reused, e.g. btc on eth's calendar for eth, sol, matic and link
+        """
+        if self.feature_cache is None:
+            return self._scale_time_series_df(input_df, use_pred_col=True)
 
-            if ts_stacked_series:
-                ts_stacked_series = ts_stacked_series.stack(transformed_series)
+        cols_to_transform = self.ml_train_cols + [self.pred_col]
+        cache_key = self._feature_key("minmax", input_df[cols_to_transform], cols_to_transform)
+        if cache_key in self.feature_cache:
+            logger.info("Reusing scaled covariates %s", cache_key)
+            self._count_feature_cache(hits=1, misses=0)
+            return self.feature_cache[cache_key]
 
-            else:
-                ts_stacked_series = transformed_series
-        return ts_transformers, ts_stacked_series
+        self._count_feature_cache(hits=0, misses=1)
+        scaled_covariates = self._scale_time_series_df(input_df, use_pred_col=True)
+        self.feature_cache[cache_key] = scaled_covariates
+        return scaled_covariates
 
     def _add_additional_training_dfs(
-        self, ts_stacked_series: TimeSeries, verbose: bool = False
-    ) -> Tuple[Dict[Dict[str, Any], Scaler], TimeSeries]:
+        self, scaled_blocks: List[Tuple[MinMaxColumns, np.ndarray]]
+    ) -> List[Tuple[MinMaxColumns, np.ndarray]]:
         """
-        Scale any additional DFs provided (such as ETHER)
+        Scale any additional DFs provided (such as ETHER). The first one goes in front of the original df's
+        columns and the rest after them, the order the models have always been trained on
 
-        ts_stacked_series: the current scaled lists from the df_original provided
+        scaled_blocks: the scaler and scaled values of the df_original provided
         """
-        all_ts_transfomers = []
+        additional_blocks = []
         for idx, df in enumerate(self.additional_dfs):
-            (additional_ts_transformers, additional_ts_stacked_series) = self._scale_time_series_df(
-                df, use_pred_col=True
-            )
-            if idx == 0:  # type :ignore
-                if verbose:
-                    logger.info(
-                        f"last date for training additional df data {additional_ts_stacked_series.time_index[-1]}"
-                    )
-                all_ts_stacked_series = additional_ts_stacked_series.stack(ts_stacked_series)
-                if verbose:
-                    logger.info(f"all_ts_stacked_series FIRST {all_ts_stacked_series.components}")
-                all_ts_transfomers.append(additional_ts_transformers)
-            else:
-                all_ts_stacked_series = all_ts_stacked_series.stack(additional_ts_stacked_series)
-                if verbose:
-                    logger.info(f"all_ts_stacked_series SECOND {all_ts_stacked_series.components} ")
-                all_ts_transfomers.append(additional_ts_transformers)
-                # return "Error. More than one time series for _add_additional_training_dfs not implemented"
-        return additional_ts_transformers, all_ts_stacked_series
-
-    def _convert_data_to_timeseries(self) -> Tuple[TimeSeries, TimeSeries]:
-        # combine TS from both DFs
-        (ts_transformers, ts_stacked_series, train_close_series) = self._scale_time_series_df_and_time_cols(self.df)
+            if not df.index.equals(self.df.index):
+                raise ValueError(f"additional_df_{idx} is not on the calendar of {self.coin_to_predict}")
+            additional_blocks.append(self._scaled_covariates_with_cache(df))
+        return additional_blocks[:1] + scaled_blocks + additional_blocks[1:]
+
+    def _convert_data_to_timeseries(self) -> Tuple["TimeSeries", "TimeSeries"]:
+        from darts import TimeSeries
+
+        # combine the scaled values of all DFs into one array, then one TimeSeries
+        scaler, scaled_values, train_close_series = self._scale_time_series_df_and_time_cols(self.df)
+        scaled_blocks = [(scaler, scaled_values)]
         if self.verbose:
-            logger.info(f"original DF training series = {ts_stacked_series.components}")
-            logger.info(f"last date for training data = {ts_stacked_series.time_index[-1]}")
+            logger.info("original DF training series = %s", scaler.columns)
+            logger.info("last date for training data = %s", self.df.index[-1])
 
         if len(self.additional_dfs) > 0:
-            # overwrite the ts_stacked_series var if we have additional DFS
-            additional_ts_transformers, ts_stacked_series = self._add_additional_training_dfs(ts_stacked_series)
-            ts_transformers = {**additional_ts_transformers, **ts_transformers}  # type: ignore
-        self.ts_transformers = ts_transformers
+            scaled_blocks = self._add_additional_training_dfs(scaled_blocks)
+
+        # the names stacking the blocks one by one used to give, e.g. close_1 for the second close
+        components = unique_component_names([block_scaler.columns for block_scaler, _ in scaled_blocks])
+        ts_stacked_series = TimeSeries.from_times_and_values(
+            self.df.index,
+            np.hstack([block_values for _, block_values in scaled_blocks]),
+            freq=self.period,
+            columns=components,
+        )
+        # inverse_transform_column(component, values) unscales any of the covariates
+        self.ts_transformers = MinMaxColumns.concatenate(
+            [block_scaler for block_scaler, _ in scaled_blocks], components
+        )
         self.ts_stacked_series = ts_stacked_series
         self.train_close_series = train_close_series
 
@@ -345,58 +470,395 @@ class CoinPricePredictor(BasePredictor):
         return train_close_series, ts_stacked_series
 
     def _train_model_with_thread(
-        self, model: Any, train_close_series: TimeSeries, ts_stacked_series: TimeSeries, epochs: int
+        self,
+        model: Any,
+        train_close_series: "TimeSeries",
+        ts_stacked_series: "TimeSeries",
+        epochs: int,
+        initial_weights: Optional[Dict[str, Any]] = None,
     ) -> None:
         # Target function for training within threads
-        model.fit(series=train_close_series, past_covariates=[ts_stacked_series], verbose=self.verbose, epochs=epochs)
-
-    def _train_models(self, train_close_series: TimeSeries, ts_stacked_series: TimeSeries) -> None:
-        dict_of_threads = {}
+        with self.run_metrics.model_stage(model.model_name, "fit"):
+            self._fits[model.model_name] = fit_model(
+                model,
+                train_close_series,
+                [ts_stacked_series],
+                epochs,
+                self.verbose,
+                initial_weights,
+                self._training_deadline(),
+                *self._early_stopping(initial_weights),
+            )
 
+    def _training_jobs(
+        self, train_close_series: "TimeSeries", ts_stacked_series: "TimeSeries", skip: List[str]
+    ) -> List[TrainingJob]:
+        """
+        Every model to train with the series, covariates and epochs to fit it on, and the weights to start from.
+        Models named in skip are already trained
+        """
+        jobs = []
         for lookback_window_models in self.models:  # lookback windows
             for model in lookback_window_models:
-                if "nbeats" in model.model_name:
-                    dict_of_threads[str(lookback_window_models) + "_nbeats"] = Thread(
-                        target=self._train_model_with_thread,
-                        args=(
-                            model,
-                            train_close_series,
-                            ts_stacked_series,
-                            self.ml_constants["hyperparameters_nbeats"]["epochs"],
-                        ),
-                    )
-
-                    logger.info("Training nbeats")
-                    sys.stdout.flush()
-
-                    dict_of_threads[str(lookback_window_models) + "_nbeats"].start()
-
-                elif "tcn" in model.model_name:
-                    logger.info("Training TCN")
-                    sys.stdout.flush()
-                    dict_of_threads[str(lookback_window_models) + "_tcn"] = Thread(
-                        target=self._train_model_with_thread,
-                        args=(
-                            model,
-                            train_close_series,
-                            ts_stacked_series,
-                            self.ml_constants["hyperparameters_nbeats"]["epochs"],
-                        ),
-                    )
+                if "nbeats" not in model.model_name and "tcn" not in model.model_name:
+                    raise ValueError(f"We have an incorrect model name of {model.model_name} we need tcn or nbeats")
+                if model.model_name in skip:
+                    continue
+                epochs = self._hyperparameters(model)["epochs"]
+                if self.warm_start:
+                    jobs.append(self._warm_start_job(model, train_close_series, ts_stacked_series, epochs))
+                else:
+                    jobs.append((model, train_close_series, ts_stacked_series, epochs, None))
+        return jobs
 
-                    logger.info("Training nbeats")
-                    sys.stdout.flush()
+    def _warm_start_dir(self) -> str:
+        return self.ml_constants["prediction_params"].get("warm_start_dir") or os.path.join(
+            self._work_dir(), "warm_start"
+        )
 
-                    dict_of_threads[str(lookback_window_models) + "_tcn"].start()
+    def _hyperparameters(self, model: Any) -> Dict[str, Any]:
+        return self.ml_constants["hyperparameters_nbeats" if "nbeats" in model.model_name else "hyperparameters_tcn"]
 
-                else:
-                    raise ValueError(f"We have an incorrect model name of {model.model_name} we need tcn or nbeats")
+    def _early_stopping(self, initial_weights: Optional[Dict[str, Any]]) -> Tuple[int, int, int]:
+        """
+        Validation windows held out of the training series, the patience in epochs and the epochs to fine tune on the
+        held out windows after, see training_pool.fit_model. Off for a warm start, it fine tunes a few epochs on a
+        few windows
+        """
+        prediction_params = self.ml_constants["prediction_params"]
+        if initial_weights is not None:
+            return 0, 0, 0
+        return (
+            prediction_params.get("validation_windows", 0),
+            prediction_params.get("early_stopping_patience", 0),
+            prediction_params.get("early_stopping_tail_epochs", 1),
+        )
+
+    def _model_params_hash(self, model: Any, ts_stacked_series: "TimeSeries") -> str:
+        return model_params_hash(
+            {
+                "model": type(model).__name__,
+                "input_chunk_length": model.input_chunk_length,
+                "output_chunk_length": model.output_chunk_length,
+                "random_state": self.random_state,
+                "hyperparameters": self._hyperparameters(model),
+                "covariates": list(ts_stacked_series.components),
+            }
+        )
+
+    def _warm_start_job(
+        self, model: Any, train_close_series: "TimeSeries", ts_stacked_series: "TimeSeries", epochs: int
+    ) -> TrainingJob:
+        """
+        Load yesterday's weights into the model and fine tune them on the newest windows only. Trains from scratch
+        if there is no checkpoint, the hyperparameters or covariates changed, more days passed than the windows
+        cover or the model was fine tuned warm_start_max_fine_tunes times in a row
+        """
+        prediction_params = self.ml_constants["prediction_params"]
+        n_windows = prediction_params.get("warm_start_windows", 30)
+        params_hash = self._model_params_hash(model, ts_stacked_series)
+        checkpoint = load_checkpoint(warm_start_filename(self._warm_start_dir(), model.model_name), params_hash)
+
+        reason = "warm"
+        if checkpoint is None:
+            reason = "no usable checkpoint"
+        elif (train_close_series.end_time() - pd.Timestamp(checkpoint["last_date"])).days > n_windows:
+            reason = "checkpoint older than the fine tuning windows"
+        elif checkpoint["fine_tunes"] >= prediction_params.get("warm_start_max_fine_tunes", 7):
+            reason = "fine tuned too many times in a row"
+        fine_tunes = 0 if checkpoint is None or reason != "warm" else checkpoint["fine_tunes"] + 1
+        self._warm_start_params[model.model_name] = (params_hash, fine_tunes)
+        self.run_metrics.extra.setdefault("warm_start", {})[model.model_name] = reason
+        if reason != "warm":
+            logger.info("Training %s from scratch, %s", model.model_name, reason)
+            return model, train_close_series, ts_stacked_series, epochs, None
+
+        # enough rows for n_windows training samples
+        n_rows = model.input_chunk_length + model.output_chunk_length + n_windows - 1
+        logger.info("Fine tuning %s on its last %s days", model.model_name, n_rows)
+        return (
+            model,
+            train_close_series[-n_rows:],
+            ts_stacked_series[-n_rows:],
+            prediction_params.get("warm_start_epochs", 2),
+            checkpoint,
+        )
+
+    def _save_warm_start_checkpoints(self, jobs: List[TrainingJob], last_date: pd.Timestamp) -> None:
+        for job in jobs:
+            model = job[0]
+            params_hash, fine_tunes = self._warm_start_params[model.model_name]
+            filename = warm_start_filename(self._warm_start_dir(), model.model_name)
+            save_checkpoint(filename, model, params_hash, last_date, fine_tunes)
+
+    def _model_cache_key(self, model: Any, train_close_series: "TimeSeries", ts_stacked_series: "TimeSeries") -> str:
+        """
+        Content address of a trained model: the series and covariates it is trained on, its hyperparameters and
+        the training settings (warm start and early stopping). The same inputs give the same key, e.g. on a lambda retry or a rerun
+        """
+        prediction_params = self.ml_constants["prediction_params"]
+        hasher = hashlib.sha1(self._model_params_hash(model, ts_stacked_series).encode())
+        for series in (train_close_series, ts_stacked_series):
+            hasher.update(series.time_index.asi8.tobytes())
+            hasher.update(np.ascontiguousarray(series.values(copy=False)).tobytes())
+        training_settings = {
+            key: value
+            for key, value in prediction_params.items()
+            if key.startswith(("warm_start", "validation_windows", "early_stopping"))
+        }
+        hasher.update(repr(sorted(training_settings.items())).encode())
+        return f"model_{model.model_name}_{hasher.hexdigest()[:20]}"
+
+    def _load_cached_models(self, train_close_series: "TimeSeries", ts_stacked_series: "TimeSeries") -> List[str]:
+        """Load the weights of every model trained on exactly these inputs before, returns their names"""
+        if self.feature_cache is None:
+            return []
+        cached = []
+        model_cache = self.run_metrics.extra.setdefault("model_cache", {})
+        for lookback_window_models in self.models:
+            for model in lookback_window_models:
+                cache_key = self._model_cache_key(model, train_close_series, ts_stacked_series)
+                if cache_key not in self.feature_cache:
+                    model_cache[model.model_name] = "miss"
+                    continue
+                logger.info("Reusing trained model %s", cache_key)
+                load_trained_weights(model, train_close_series, [ts_stacked_series], self.feature_cache[cache_key])
+                model_cache[model.model_name] = "hit"
+                cached.append(model.model_name)
+        return cached
+
+    def _cache_trained_models(
+        self, jobs: List[TrainingJob], train_close_series: "TimeSeries", ts_stacked_series: "TimeSeries"
+    ) -> None:
+        if self.feature_cache is None:
+            return
+        for job in jobs:
+            model = job[0]
+            cache_key = self._model_cache_key(model, train_close_series, ts_stacked_series)
+            self.feature_cache[cache_key] = trained_weights(model)
+
+    def _train_models(self, train_close_series: "TimeSeries", ts_stacked_series: "TimeSeries") -> None:
+        """
+        Train every model, in threads or, with training_backend: processes, in a pool of worker processes.
+        Falls back to threads where worker processes can't start (lambda has no /dev/shm for their queues).
+        Models already trained on the same inputs are loaded from the feature_cache instead. With a deadline the
+        models are trained best first and the ones there is no time for are skipped, see _schedule_jobs
+        """
+        cached = self._load_cached_models(train_close_series, ts_stacked_series)
+        jobs = self._training_jobs(train_close_series, ts_stacked_series, skip=cached)
+        if self.deadline is not None:
+            jobs = self._schedule_jobs(jobs)
+        if len(jobs) > 0:
+            self._fit_jobs(jobs)
+            # a model cut short by the deadline is still used today, but isn't kept for another run
+            jobs = self._fully_trained(jobs)
+            self._cache_trained_models(jobs, train_close_series, ts_stacked_series)
+        if self.warm_start:
+            self._save_warm_start_checkpoints(jobs, train_close_series.end_time())
+        if self.ml_constants["prediction_params"].get("inference_backend", "darts") == "torchscript":
+            self._export_models(ts_stacked_series)
+
+    def _export_models(self, ts_stacked_series: "TimeSeries") -> None:
+        """
+        Trace every trained model to TorchScript, kept in exported_models_dir for a predict only deployment.
+        A model that can't be exported predicts with darts. With quantize_inference, the models that can be are
+        quantized to int8, the others are exported as they are and the reason is in the run metrics
+        """
+        prediction_params = self.ml_constants["prediction_params"]
+        export_dir = prediction_params.get("exported_models_dir") or os.path.join(self._work_dir(), "exported")
+        for lookback_window_models in self.models:
+            for model in lookback_window_models:
+                if model.model_name in self.skipped_models:
+                    continue
+                quantize = False
+                if prediction_params.get("quantize_inference", False):
+                    reason = quantization_skip_reason(model)
+                    quantize = reason is None
+                    self.run_metrics.extra.setdefault("quantization", {})[model.model_name] = reason or "int8"
+                with self.run_metrics.model_stage(model.model_name, "export"):
+                    exported = export_model(
+                        exported_model_filename(export_dir, model.model_name, quantize),
+                        model,
+                        self._model_params_hash(model, ts_stacked_series),
+                        quantize,
+                    )
+                if exported is not None:
+                    self.exported_models[model.model_name] = exported
+
+    def _training_deadline(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - self.ml_constants["prediction_params"].get("deadline_reserve_seconds", 120)
+
+    def _read_past_predictions(self) -> Optional[pd.DataFrame]:
+        if not self.prediction_store.exists():
+            return None
+        return self._past_predictions()
+
+    def _expected_fit_seconds(self, job: TrainingJob) -> Optional[float]:
+        # from the epoch times of the last fit of this model, scaled to this job's epochs and rows
+        model, series, _, epochs, _ = job
+        if self.feature_cache is None or epoch_seconds_key(model.model_name) not in self.feature_cache:
+            return None
+        n_windows = training_windows(len(series), model.input_chunk_length, model.output_chunk_length)
+        return self.feature_cache[epoch_seconds_key(model.model_name)] * n_windows * epochs
+
+    def _training_slots(self, n_jobs: int) -> int:
+        # models that train at the same time
+        prediction_params = self.ml_constants["prediction_params"]
+        if prediction_params.get("training_backend", "threads") == "processes":
+            return split_cores(n_jobs, prediction_params.get("training_workers", 0))[0]
+        return n_jobs
+
+    def _schedule_jobs(self, jobs: List[TrainingJob]) -> List[TrainingJob]:
+        """
+        Order the jobs by how much each model is expected to help, the lowest error on its past predictions first.
+        Models with no scored predictions go last, the stacking model has no history of them to learn from.
+        Then drop the jobs that won't finish before the deadline at their last epoch times
+        """
+        past_predictions = self._read_past_predictions()
+        errors: Dict[str, float] = {}
+        if past_predictions is not None:
+            errors = historical_errors(
+                past_predictions,
+                self.df[self.pred_col],
+                [job[0].model_name for job in jobs],
+                self.constants["date_prediction_for_col"],
+            )
+        jobs = sorted(
+            jobs,
+            key=lambda job: (
+                job[0].model_name not in errors,
+                errors.get(job[0].model_name, 0.0),
+                job[0].input_chunk_length,
+            ),
+        )
+        deadline = self._training_deadline()
+        if deadline is None:  # nothing to skip, only ordered
+            return jobs
+        budget_seconds = deadline - time.time()
+        plan = plan_within_budget(
+            [self._expected_fit_seconds(job) for job in jobs], self._training_slots(len(jobs)), budget_seconds
+        )
+        self.skipped_models = [job[0].model_name for job, run in zip(jobs, plan) if not run]
+        self.run_metrics.extra["scheduler"] = {
+            "budget_seconds": round(budget_seconds, 1),
+            "order": [job[0].model_name for job in jobs],
+            "errors": {model_name: round(error, 4) for model_name, error in errors.items()},
+            "skipped": self.skipped_models,
+        }
+        if len(self.skipped_models) > 0:
+            logger.warning("Not enough time before the deadline, skipping %s", self.skipped_models)
+        return [job for job, run in zip(jobs, plan) if run]
+
+    def _fully_trained(self, jobs: List[TrainingJob]) -> List[TrainingJob]:
+        """
+        The jobs that didn't run out of time. Keeps each model's epoch time for the next run's schedule, models that
+        ran out of time before their first epoch are skipped. Records the epoch each model stopped at
+        """
+        fully_trained = []
+        scheduler = self.run_metrics.extra.setdefault("scheduler", {})
+        for job in jobs:
+            model, series = job[0], job[1]
+            fit = self._fits[model.model_name]
+            scheduler.setdefault("epochs", {})[model.model_name] = fit["epochs"]
+            if fit["epochs"] == 0:
+                self.skipped_models.append(model.model_name)
+                continue
+            n_windows = training_windows(len(series), model.input_chunk_length, model.output_chunk_length)
+            scheduler.setdefault("epoch_seconds", {})[model.model_name] = round(fit["epoch_seconds"], 4)
+            if self.feature_cache is not None:
+                self.feature_cache[epoch_seconds_key(model.model_name)] = fit["epoch_seconds"] / n_windows
+            if fit["best_epoch"] is not None:
+                self.run_metrics.extra.setdefault("early_stopping", {})[model.model_name] = {
+                    "epochs": fit["epochs"],
+                    "max_epochs": job[3],
+                    "best_epoch": fit["best_epoch"],
+                    "validation_loss": round(fit["validation_loss"], 6),
+                    "tail_epochs": fit["tail_epochs"],
+                }
+            if fit["out_of_time"]:
+                scheduler.setdefault("out_of_time", []).append(model.model_name)
+            else:
+                fully_trained.append(job)
+        scheduler["skipped"] = self.skipped_models
+        return fully_trained
+
+    def _fit_jobs(self, jobs: List[TrainingJob]) -> None:
+        trained_in_processes = False
+        if self.ml_constants["prediction_params"].get("training_backend", "threads") == "processes":
+            try:
+                self._train_models_in_processes(jobs)
+                trained_in_processes = True
+            except (OSError, NotImplementedError) as e:
+                logger.warning("Unable to train in worker processes, training in threads: %s", e)
+        if not trained_in_processes:
+            self._train_models_in_threads(jobs)
+
+    def _train_models_in_threads(self, jobs: List[TrainingJob]) -> None:
+        dict_of_threads = {}
+        for job in jobs:
+            model = job[0]
+            logger.info("Training %s", model.model_name)
+            sys.stdout.flush()
+            dict_of_threads[model.model_name] = Thread(target=self._train_model_with_thread, args=job)
+            dict_of_threads[model.model_name].start()
         # block until all models are trained
         for k, v in dict_of_threads.items():
             logger.info(f"Have thread = {k}")
             v.join()
 
+    def _train_models_in_processes(self, jobs: List[TrainingJob]) -> None:
+        """Fit each model in a worker process, only the trained weights come back"""
+        prediction_params = self.ml_constants["prediction_params"]
+        n_workers, torch_threads = split_cores(len(jobs), prediction_params.get("training_workers", 0))
+        torch_threads = prediction_params.get("torch_threads_per_worker") or torch_threads
+        pool = get_training_pool(n_workers, torch_threads)
+        self.run_metrics.extra["training_pool"] = {"workers": n_workers, "torch_threads": torch_threads}
+
+        futures = []
+        for model, series, covariates, epochs, initial_weights in jobs:
+            logger.info("Training %s in a worker process", model.model_name)
+            futures.append(
+                pool.submit(
+                    model,
+                    series,
+                    [covariates],
+                    epochs,
+                    self.verbose,
+                    initial_weights,
+                    self._training_deadline(),
+                    *self._early_stopping(initial_weights),
+                )
+            )
+        for (model, series, covariates, _, _), future in zip(jobs, futures):
+            trained = future.result()
+            self._fits[model.model_name] = trained["fit"]
+            if trained["fit"]["epochs"] > 0:
+                load_trained_weights(model, series, [covariates], trained)
+            self.run_metrics.record_model_stage(model.model_name, "fit", trained["metrics"])
+
+    def _stale_predictions(self) -> Dict[str, float]:
+        """
+        The last prediction of each model skipped for the deadline. Only the stacking model's input for today, better
+        than a 0. Today's saved prediction of a skipped model is NaN, so the copy isn't trained on as a prediction
+        """
+        past_predictions = self._read_past_predictions() if len(self.skipped_models) > 0 else None
+        if past_predictions is None:
+            return {}
+        stale_predictions = {}
+        for model_name in self.skipped_models:
+            if model_name in past_predictions.columns:
+                predictions = past_predictions[model_name].to_numpy(dtype=float)
+                predictions = predictions[(predictions != 0) & ~np.isnan(predictions)]
+                if len(predictions) > 0:
+                    stale_predictions[model_name] = float(predictions[-1])
+        self.run_metrics.extra.setdefault("scheduler", {})["stale_predictions"] = sorted(stale_predictions)
+        return stale_predictions
+
     def _make_stacking_prediction_and_save(self) -> float:
+        from sklearn.ensemble import RandomForestRegressor
+
         # train a RF model on the input predictions from each model.
         # we need to date align the previous predictions on the date_prediction_for
         # from the  _all_predictions file
@@ -459,30 +921,39 @@ class CoinPricePredictor(BasePredictor):
             ]  # don't include the current row
             stacked_y_data_train = training_df[self.pred_col]  # don't include the current row
             testing_df = testing_df.reindex(stacked_x_data_train.columns, axis=1)
+            # a skipped model has no prediction today, its last one stands in. 0 if it has none, as a padded col
+            testing_df = testing_df.fillna(
+                {model_name: self.stale_predictions.get(model_name, 0.0) for model_name in self.skipped_models}
+            )
+            # nor are the days a model was skipped trained on
+            predicted_rows = stacked_x_data_train.notna().all(axis=1)
+            stacked_x_data_train = stacked_x_data_train[predicted_rows]
+            stacked_y_data_train = stacked_y_data_train[predicted_rows]
             # assert column order is the same
             assert list(stacked_x_data_train.columns) == list(testing_df.columns)
 
-            if self.verbose:
-                logger.info(f"{training_df.head} training_df head")
-                logger.info(f"training_df tail ={training_df.tail()}")
-                logger.info(f"training_df cols {training_df.columns}")
-                logger.info(f"{stacked_x_data_train.shape} 'stacked_x_data_train shape'")
-                logger.info(f"{stacked_x_data_train.index.min()} 'stacked_x_data_train index min'")
-                logger.info(f"{stacked_x_data_train.index.max()} 'stacked_x_data_train index max'")
-                logger.info(f"{stacked_y_data_train.shape} 'stacked_y_data_train.shape'")
-                logger.info(f"{testing_df.shape} 'testing_df.shape'")
-                logger.info(f"{merged_df}, merged_df")
-                logger.info(f"{merged_df.index}, merged_df index")
-                logger.info(f"{todays_date}, todays_date")
-                logger.info(f"self.final_all_predictions_df = {self.final_all_predictions_df}")
-                logger.info(f"self.final_all_predictions_df cols = {self.final_all_predictions_df.columns}")
-                logger.info(
+            # dataframe rendering is slow, only in verbose log mode
+            if self.verbose and logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"{training_df.head} training_df head")
+                logger.debug(f"training_df tail ={training_df.tail()}")
+                logger.debug(f"training_df cols {training_df.columns}")
+                logger.debug(f"{stacked_x_data_train.shape} 'stacked_x_data_train shape'")
+                logger.debug(f"{stacked_x_data_train.index.min()} 'stacked_x_data_train index min'")
+                logger.debug(f"{stacked_x_data_train.index.max()} 'stacked_x_data_train index max'")
+                logger.debug(f"{stacked_y_data_train.shape} 'stacked_y_data_train.shape'")
+                logger.debug(f"{testing_df.shape} 'testing_df.shape'")
+                logger.debug(f"{merged_df}, merged_df")
+                logger.debug(f"{merged_df.index}, merged_df index")
+                logger.debug(f"{todays_date}, todays_date")
+                logger.debug(f"self.final_all_predictions_df = {self.final_all_predictions_df}")
+                logger.debug(f"self.final_all_predictions_df cols = {self.final_all_predictions_df.columns}")
+                logger.debug(
                     f"self.final_all_predictions_df date prediction for = {self.final_all_predictions_df.date_prediction_for}"
                 )
-                logger.info(f"self.df.index = {self.df.index}")
-                logger.info("cols difference")
-                logger.info(set(stacked_x_data_train.columns) - set(testing_df.columns))
-                logger.info(set(testing_df.columns) - set(stacked_x_data_train.columns))
+                logger.debug(f"self.df.index = {self.df.index}")
+                logger.debug("cols difference")
+                logger.debug(set(stacked_x_data_train.columns) - set(testing_df.columns))
+                logger.debug(set(testing_df.columns) - set(stacked_x_data_train.columns))
             estimator = RandomForestRegressor(
                 n_estimators=self.ml_constants["hyperparameters_random_forest"]["n_estimators"],
                 n_jobs=-1,
@@ -500,46 +971,86 @@ class CoinPricePredictor(BasePredictor):
 
         # save prediction as part of all predictions. Update the last stacking prediction to this new prediction
         # cast as float
-        self.final_all_predictions_df[self.constants["stacking_prediction_col"]] = self.final_all_predictions_df[
-            self.constants["stacking_prediction_col"]
-        ].astype(float)
-        logger.info(f"dtypes of self.final_all_predictions_df {self.final_all_predictions_df.dtypes}")
-        current_stacking_predictions = list(self.final_all_predictions_df[self.constants["stacking_prediction_col"]])
-        current_stacking_predictions[-1] = prediction
-        self.final_all_predictions_df[self.constants["stacking_prediction_col"]] = current_stacking_predictions
-
-        if running_on_aws():
-            all_predictions_filename = "/" + self.all_predictions_filename
-        else:
-            all_predictions_filename = self.all_predictions_filename
-        self.final_all_predictions_df.to_csv(all_predictions_filename, index=False)
+        stacking_col = self.constants["stacking_prediction_col"]
+        self.final_all_predictions_df[stacking_col] = self.final_all_predictions_df[stacking_col].astype(float)
+        self.final_all_predictions_df.iloc[-1, self.final_all_predictions_df.columns.get_loc(stacking_col)] = prediction
+        logger.debug("dtypes of self.final_all_predictions_df %s", self.final_all_predictions_df.dtypes)
+
+        # only today's row is written, the csv is rewritten when the store compacts
+        self.new_predictions_row[stacking_col] = prediction
+        self.prediction_store.append(self.new_predictions_row)
         return prediction
 
-    def predict(self) -> float:
-        logger.info("Slicing dataframes")
-        self._slice_df()
-        logger.info("Building Bollinger Bands")
+    def _slice_and_build_indicators(self) -> None:
+        """
+        Slice the dfs to the years filter and build their technical indicators. Streaming indicators are built over
+        the dfs as read from their csvs, then sliced: a snapshot is kept per first row, the csv's first row stays put
+        while the sliced df's moves forward every day
+        """
+        stages = [("slice_df", self._slice_df), ("build_technical_indicators", self._build_technical_indicators)]
+        if self.streaming_indicators:
+            stages.reverse()
+        for stage_name, build in stages:
+            logger.info("Running %s", stage_name)
+            sys.stdout.flush()
+            with self.run_metrics.stage(stage_name):
+                build()
+
+    def build_series(self) -> Tuple["TimeSeries", "TimeSeries"]:
+        """The close series to predict and its scaled covariates, everything predict does before the models"""
+        self._slice_and_build_indicators()
+        logger.info("Aligning calendars")
+        with self.run_metrics.stage("align_calendars"):
+            self._align_calendars()
+        logger.info("Converting data to timeseries")
         sys.stdout.flush()
-        self._build_technical_indicators()
+        with self.run_metrics.stage("convert_data_to_timeseries"):
+            return self._convert_data_to_timeseries()
+
+    def _train_and_predict(self, train_close_series: "TimeSeries", ts_stacked_series: "TimeSeries") -> Dict[str, float]:
         logger.info("Creating Models")
         sys.stdout.flush()
         # turns out, it's better to create new models than retrain old ones
-        self._create_models()
-        logger.info("Converting data to timeseries")
-        sys.stdout.flush()
-        train_close_series, ts_stacked_series = self._convert_data_to_timeseries()
+        with self.run_metrics.stage("create_models"):
+            self._create_models()
         logger.info("Training models")
         sys.stdout.flush()
-        self._train_models(train_close_series, ts_stacked_series)
+        with self.run_metrics.stage("train_models"):
+            self._train_models(train_close_series, ts_stacked_series)
         logger.info("making predictions")
         sys.stdout.flush()
         # base predictions from child class
-        predictions_dict = self._make_base_predictions_dict(train_close_series, ts_stacked_series)
+        with self.run_metrics.stage("make_base_predictions_dict"):
+            return self._make_base_predictions_dict(train_close_series, ts_stacked_series)
+
+    def _predict_with_global_models(
+        self, global_models: "GlobalModels", train_close_series: "TimeSeries", ts_stacked_series: "TimeSeries"
+    ) -> Dict[str, float]:
+        # the models were trained on every coin's series already, see GlobalModels.train
+        logger.info("making predictions with the global models %s", global_models.model_names)
+        with self.run_metrics.stage("make_base_predictions_dict"):
+            self.all_predictions_dict = global_models.predict(train_close_series, ts_stacked_series, self.run_metrics)
+        self.skipped_models = list(global_models.skipped_models)
+        self.run_metrics.extra["global_models"] = global_models.model_names
+        return self.all_predictions_dict
+
+    def predict(self) -> float:
+        train_close_series, ts_stacked_series = self.build_series()
+        if self.global_models is None:
+            predictions_dict = self._train_and_predict(train_close_series, ts_stacked_series)
+        else:
+            predictions_dict = self._predict_with_global_models(
+                self.global_models, train_close_series, ts_stacked_series
+            )
+        self.stale_predictions = self._stale_predictions()
+        predictions_dict.update({model_name: np.nan for model_name in self.skipped_models})
         logger.info(f"predictions_dict = {predictions_dict}")
-        self._generate_base_predictions_df(predictions_dict)
+        with self.run_metrics.stage("generate_base_predictions_df"):
+            self._generate_base_predictions_df(predictions_dict)
 
         logger.info(f" stacking the predictions with {self.stacking_model_name}")
-        prediction = self._make_stacking_prediction_and_save()
+        with self.run_metrics.stage("make_stacking_prediction_and_save"):
+            prediction = self._make_stacking_prediction_and_save()
         logger.info(f"Prediction = {prediction}")
         sys.stdout.flush()
         # for now, still return the mean
@@ -0,0 +1,211 @@
+import io
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+try:  # need modules for pytest to work
+    from app.mlcode.utils import read_in_data, resolve_aws_path, setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from utils import read_in_data, resolve_aws_path, setup_logging
+
+__all__ = ["PREDICTION_LOG_VERSION", "PredictionStore", "append_records", "prediction_log_filename"]
+
+logger = setup_logging()
+
+PREDICTION_LOG_VERSION = 1
+
+
+def prediction_log_filename(all_predictions_filename: str) -> str:
+    """tmp/btc_all_predictions.csv -> tmp/btc_all_predictions_log.jsonl, DownloadConfigFiles in main.go does the same"""
+    root, _ = os.path.splitext(all_predictions_filename)
+    return root + "_log.jsonl"
+
+
+def append_records(frame: pd.DataFrame, records: List[Dict[str, Any]], date_col: str) -> pd.DataFrame:
+    """
+    The records as rows under the date indexed frame. A column some rows don't have is 0 in them, a new model's
+    earlier rows and a retired model's new ones, as the all predictions csv has always been padded
+    """
+    record_cols = list(dict.fromkeys(col for record in records for col in record))
+    rows = pd.DataFrame([{col: record.get(col, 0) for col in record_cols} for record in records])
+    rows.index = pd.DatetimeIndex(pd.to_datetime(rows.pop(date_col)), name=date_col)
+    columns = list(frame.columns) + [col for col in rows.columns if col not in frame.columns]
+    return pd.concat([frame.reindex(columns=columns, fill_value=0), rows.reindex(columns=columns, fill_value=0)])
+
+
+def _read_csv_tail(filename: str, n_rows: int, block_size: int = 1 << 16) -> pd.DataFrame:
+    """
+    The last n_rows rows of a csv, dates are the index. The file is read back from its end a block at a time,
+    the rows before the tail aren't read
+    """
+    with open(filename, "rb") as f:
+        header = f.readline()
+        f.seek(0, os.SEEK_END)
+        position, tail = f.tell(), b""
+        # n_rows whole lines once n_rows newlines are in front of the last one
+        while position > len(header) and tail.rstrip(b"\n").count(b"\n") < n_rows:
+            step = min(block_size, position - len(header))
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+    lines = tail.rstrip(b"\n").split(b"\n")[-n_rows:] if len(tail.strip()) > 0 else []
+    df = pd.read_csv(io.BytesIO(header + b"\n".join(lines)), index_col=0, parse_dates=True)
+    return df.sort_index()
+
+
+def _count_csv_rows(filename: str) -> int:
+    """The rows of a csv after its header, counted a block at a time"""
+    n_lines, last_byte = 0, b"\n"
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            n_lines += block.count(b"\n")
+            last_byte = block[-1:]
+    n_lines += last_byte != b"\n"  # no newline after the last row
+    return max(n_lines - 1, 0)
+
+
+class PredictionStore:
+    def __init__(self, all_predictions_filename: str, date_col: str, running_on_aws: bool, compact_rows: int = 30):
+        """A coin's predictions, one row a day, kept as the compacted csv and a log of the rows appended since.
+
+        Each run appends its row to the log, a json header line then a json object per row, each with its own
+        columns. Every compact_rows rows the log is folded into the csv, the only time the csv is rewritten, and
+        the log starts again from its header. The header has the number of csv rows the log follows and the csv's
+        size, so a tail read doesn't have to count them. A log whose rows were already folded in (the csv was
+        written, the log wasn't, or S3 still has the old one) is ignored.
+
+        Args:
+            all_predictions_filename (str): The coin's all predictions csv
+            date_col (str): The date column, the index once read in
+            running_on_aws (bool): are we on lambda?
+            compact_rows (int): Fold the log into the csv once it has this many rows. 1 rewrites the csv every run
+        """
+        self.csv_filename = resolve_aws_path(all_predictions_filename, running_on_aws)
+        self.log_filename = resolve_aws_path(prediction_log_filename(all_predictions_filename), running_on_aws)
+        self.date_col = date_col
+        self.compact_rows = max(compact_rows, 1)
+        self._compacted_rows: Optional[int] = None
+        self._log_rows: Optional[int] = None  # None is no log to append to, the next append starts one
+
+    def exists(self) -> bool:
+        return os.path.exists(self.csv_filename) or os.path.exists(self.log_filename)
+
+    def read(self, tail_rows: int = 0) -> pd.DataFrame:
+        """
+        Every prediction, the csv's rows then the log's. Dates are the index, as read_in_data.
+        With tail_rows only the newest that many, the rows before them in the csv aren't parsed
+        """
+        self._compacted_rows = 0
+        header, lines = self._read_log_lines()
+        if os.path.exists(self.csv_filename) and tail_rows > 0:
+            compacted = _read_csv_tail(self.csv_filename, tail_rows)
+            self._compacted_rows = self._csv_rows(header)
+        elif os.path.exists(self.csv_filename):
+            compacted = read_in_data(self.csv_filename, False, self.date_col)  # already resolved
+            self._compacted_rows = len(compacted)
+        else:
+            compacted = pd.DataFrame(index=pd.DatetimeIndex([], name=self.date_col))
+        records = self._log_records(header, lines)
+        if len(records) == 0:
+            return compacted
+        predictions_df = append_records(compacted, records, self.date_col)
+        return predictions_df.iloc[-tail_rows:] if tail_rows > 0 else predictions_df
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Add one row, the store must have been read first. Compacts once the log has compact_rows rows"""
+        if self._compacted_rows is None:
+            raise ValueError(f"Read {self.csv_filename} in before appending to it")
+        line = json.dumps({key: value if isinstance(value, str) else float(value) for key, value in record.items()})
+        if self._log_rows is None:
+            self._write_atomically(self.log_filename, f"{self._log_header()}\n{line}\n")
+            self._log_rows = 1
+        else:
+            with open(self.log_filename, "a") as f:
+                f.write(f"{line}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._log_rows += 1
+
+        if self._log_rows >= self.compact_rows:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Rewrite the csv with the log's rows, then start the log again from a header with the csv's new row count.
+        Reads every row, not just a tail
+        """
+        predictions_df = self.read()
+        logger.info("Compacting %s rows of %s into %s", self._log_rows or 0, self.log_filename, self.csv_filename)
+        self._write_atomically(self.csv_filename, predictions_df.reset_index().to_csv(index=False))
+        self._compacted_rows, self._log_rows = len(predictions_df), 0
+        self._write_atomically(self.log_filename, f"{self._log_header()}\n")
+
+    def _log_header(self) -> str:
+        compacted_bytes = os.path.getsize(self.csv_filename) if os.path.exists(self.csv_filename) else 0
+        return json.dumps(
+            {
+                "version": PREDICTION_LOG_VERSION,
+                "compacted_rows": self._compacted_rows,
+                "compacted_bytes": compacted_bytes,
+            }
+        )
+
+    def _csv_rows(self, header: Dict[str, Any]) -> int:
+        # the header's count if it was written for this csv, a log from before compacted_bytes counts them once
+        if header.get("compacted_bytes") == os.path.getsize(self.csv_filename):
+            return header["compacted_rows"]
+        logger.info("Counting the rows of %s, the log header doesn't have them", self.csv_filename)
+        return _count_csv_rows(self.csv_filename)
+
+    def _read_log_lines(self) -> Tuple[Dict[str, Any], List[str]]:
+        if not os.path.exists(self.log_filename):
+            return {}, []
+        with open(self.log_filename, "r") as f:
+            lines = f.read().splitlines()
+        return (json.loads(lines[0]) if len(lines) > 0 else {}), lines
+
+    def _log_records(self, header: Dict[str, Any], lines: List[str]) -> List[Dict[str, Any]]:
+        self._log_rows = None
+        if len(lines) == 0:
+            return []
+        if header.get("version") != PREDICTION_LOG_VERSION or header.get("compacted_rows") != self._compacted_rows:
+            logger.warning(
+                "%s doesn't follow the %s rows of %s, header %s. Ignoring it, the next row starts a new log",
+                self.log_filename,
+                self._compacted_rows,
+                self.csv_filename,
+                header,
+            )
+            return []
+
+        records = []
+        for i, line in enumerate(lines[1:]):
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                if i < len(lines) - 2:
+                    raise ValueError(f"Row {i} of {self.log_filename} is corrupt: {line}")
+                # a run that died writing its row, the row before it is the last one
+                logger.warning("Dropping the partly written last row of %s: %s", self.log_filename, line)
+                self._write_atomically(self.log_filename, "\n".join(lines[:-1]) + "\n")
+        self._log_rows = len(records)
+        return records
+
+    @staticmethod
+    def _write_atomically(filename: str, contents: str) -> None:
+        # no "csv" in the temp name, the go app uploads every /tmp file with that in it
+        fd, tmp_filename = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(filename)), prefix=".predictions_", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(contents)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
@@ -0,0 +1,171 @@
+import json
+import os
+import socketserver
+import sys
+import time
+from typing import Any, Dict, MutableMapping, Optional
+
+try:  # need modules for pytest to work
+    from app.mlcode.coin_registry import LazyPriceData, get_coin_spec
+    from app.mlcode.feature_store import FeatureStore, open_feature_store
+    from app.mlcode.training_schedule import EPOCH_SECONDS_PREFIX
+    from app.mlcode.utils import read_in_yaml, resolve_aws_path, running_on_aws, setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from coin_registry import LazyPriceData, get_coin_spec
+    from feature_store import FeatureStore, open_feature_store
+    from training_schedule import EPOCH_SECONDS_PREFIX
+    from utils import read_in_yaml, resolve_aws_path, running_on_aws, setup_logging
+
+__all__ = ["PredictionWorker", "serve"]
+
+logger = setup_logging()
+
+
+class PredictionWorker:
+    def __init__(self, constants_filename: str = "tmp/constants.yml"):
+        """Keeps the imports, configs, price csvs and technical indicators in memory between predictions.
+
+        Before every prediction the configs and csvs are checked against the files on disk, so whatever the
+        Go app downloads or appends between requests is picked up.
+
+        Args:
+            constants_filename (str, optional): constants yaml, relative to the working directory
+        """
+        self.constants_filename = constants_filename
+        self.is_running_on_aws = running_on_aws()
+        self._config_mtimes: Dict[str, int] = {}
+        self.constants: Dict[str, Any] = {}
+        self.ml_constants: Dict[str, Any] = {}
+        self.price_data = LazyPriceData({}, self.is_running_on_aws)
+        self.feature_cache: MutableMapping[str, Any] = {}
+        self.refresh()
+
+    def _mtime(self, filename: str) -> int:
+        return os.stat(resolve_aws_path(filename, self.is_running_on_aws)).st_mtime_ns
+
+    def refresh(self) -> None:
+        """Re read the configs if they changed and drop any csv (and the indicators built from it) that changed"""
+        constants_mtime = self._mtime(self.constants_filename)
+        if constants_mtime != self._config_mtimes.get(self.constants_filename):
+            logger.info("Reading in %s", self.constants_filename)
+            self.constants = read_in_yaml(self.constants_filename, self.is_running_on_aws)
+            self._config_mtimes = {self.constants_filename: constants_mtime}
+            # csv filenames could have changed, start over
+            self.price_data = LazyPriceData(self.constants, self.is_running_on_aws)
+            self.feature_cache = open_feature_store(self.constants, self.is_running_on_aws)
+
+        ml_config_filename = self.constants["ml_config_filename"]
+        ml_config_mtime = self._mtime(ml_config_filename)
+        if ml_config_mtime != self._config_mtimes.get(ml_config_filename):
+            logger.info("Reading in %s", ml_config_filename)
+            self.ml_constants = read_in_yaml(ml_config_filename, self.is_running_on_aws)
+            self._config_mtimes[ml_config_filename] = ml_config_mtime
+
+        if self.price_data.refresh_stale():
+            # features are keyed on the frame contents, old entries would never be hit again. A FeatureStore
+            # evicts its files by size, only let go of what it holds in memory. The seconds per epoch are keyed
+            # by model and still needed by the scheduler
+            if isinstance(self.feature_cache, FeatureStore):
+                self.feature_cache.release_memory()
+            else:
+                for key in [key for key in self.feature_cache if not key.startswith(EPOCH_SECONDS_PREFIX)]:
+                    del self.feature_cache[key]
+
+    def warm_up(self) -> None:
+        """Pay for the heavy imports once, at startup, instead of on the first prediction"""
+        start = time.perf_counter()
+        import darts.models  # noqa: F401
+        import sklearn.ensemble  # noqa: F401
+
+        logger.info("Warmed up imports in %.2f seconds", time.perf_counter() - start)
+
+    def predict(self, coin_to_predict: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+        # imported here, main imports this module for --serve
+        try:
+            from app.mlcode.main import run_coin_prediction
+        except ModuleNotFoundError:
+            from main import run_coin_prediction
+
+        get_coin_spec(coin_to_predict)
+        start = time.perf_counter()
+        self.refresh()
+        if self.ml_constants["prediction_params"].get("global_models", False):
+            # trained on every coin at once, a request only has the one coin
+            raise ValueError("The worker doesn't run global_models, predict those coins together with --coins")
+        price_prediction = run_coin_prediction(
+            coin_to_predict,
+            self.constants,
+            self.ml_constants,
+            self.price_data,
+            self.is_running_on_aws,
+            self.feature_cache,
+            deadline,
+        )
+        return {
+            "coin": coin_to_predict,
+            "price_prediction": float(price_prediction),
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+    def handle(self, request: Any) -> Dict[str, Any]:
+        """
+        Run one request and return the reply. Never raises, errors are sent back to the caller.
+        Requests are {"command": "predict", "coin_to_predict": "btc"}, {"command": "ping"} or {"command": "shutdown"}.
+        A predict request can have a "deadline", the unix time the caller stops waiting
+        """
+        if not isinstance(request, dict):
+            return {"status": "error", "error": f"A request is a json object, not {type(request).__name__}"}
+        command = request.get("command")
+        try:
+            if command == "predict":
+                return {"status": "ok", **self.predict(request["coin_to_predict"], request.get("deadline"))}
+            elif command in ("ping", "shutdown"):
+                return {"status": "ok", "command": command}
+            else:
+                raise ValueError(f"Unknown command {command}. Should be one of predict, ping or shutdown")
+        except Exception as e:
+            logger.exception("Failed request %s", request)
+            return {"status": "error", "error": f"{type(e).__name__}: {e}"}
+
+
+class _WorkerRequestHandler(socketserver.StreamRequestHandler):
+    # one json request per line, one json reply per line
+    def handle(self) -> None:
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                reply = {"status": "error", "error": f"Invalid json: {e}"}
+            else:
+                reply = self.server.worker.handle(request)  # type: ignore
+                if isinstance(request, dict) and request.get("command") == "shutdown":
+                    self.server.shutdown_requested = True  # type: ignore
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+            self.wfile.flush()
+            sys.stdout.flush()
+
+
+def serve(socket_path: str, constants_filename: str = "tmp/constants.yml") -> None:
+    """
+    Listen on a unix socket until asked to shut down. Requests are handled one at a time,
+    two predictions writing the same state files must not run together
+    """
+    worker = PredictionWorker(constants_filename)
+    worker.warm_up()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # left over from a worker that was killed
+    server = socketserver.UnixStreamServer(socket_path, _WorkerRequestHandler)
+    server.worker = worker  # type: ignore
+    server.shutdown_requested = False  # type: ignore
+    logger.info("Prediction worker listening on %s", socket_path)
+    sys.stdout.flush()
+    try:
+        while not server.shutdown_requested:  # type: ignore
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        logger.info("Prediction worker shut down")
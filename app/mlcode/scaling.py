@@ -0,0 +1,86 @@
+from typing import List, Sequence
+
+import numpy as np
+
+__all__ = ["MinMaxColumns", "unique_component_names"]
+
+
+class MinMaxColumns:
+    def __init__(self, columns: Sequence[str]):
+        """Min-max scaling of every column of a [time, column] array to [0, 1] at once.
+
+        The same as fitting darts' default Scaler (sklearn's MinMaxScaler) on each column on its own: NaNs are
+        ignored when fitting and a constant column scales to 0. Scalers of different arrays can be joined with
+        concatenate, so the covariates of several dfs keep one inverse transform.
+
+        Args:
+            columns (Sequence[str]): name of each column, for the per-column inverse transform
+        """
+        self.columns = list(columns)
+        self.data_min = np.zeros(len(self.columns))
+        self.scale = np.ones(len(self.columns))
+
+    def fit(self, values: np.ndarray) -> "MinMaxColumns":
+        values = self._check_width(values)
+        if len(values) == 0:
+            raise ValueError("Need at least one row to fit a scaler")
+        data_min, data_max = np.nanmin(values, axis=0), np.nanmax(values, axis=0)
+        data_range = data_max - data_min
+        # near constant columns get a scale of 1, like sklearn
+        data_range[data_range < 10 * np.finfo(data_range.dtype).eps] = 1.0
+        self.data_min, self.scale = data_min, 1.0 / data_range
+        return self
+
+    @property
+    def offset(self) -> np.ndarray:
+        return 0.0 - self.data_min * self.scale
+
+    def transform(self, values: np.ndarray) -> np.ndarray:
+        # x * scale + offset like sklearn, so the values are the same to the last bit
+        return self._check_width(values) * self.scale + self.offset
+
+    def fit_transform(self, values: np.ndarray) -> np.ndarray:
+        return self.fit(values).transform(values)
+
+    def inverse_transform(self, values: np.ndarray) -> np.ndarray:
+        return (self._check_width(values) - self.offset) / self.scale
+
+    def inverse_transform_column(self, column: str, values: np.ndarray) -> np.ndarray:
+        """Unscale the values of one column, e.g. a forecast of that column"""
+        if column not in self.columns:
+            raise ValueError(f"{column} is not one of the scaled columns {self.columns}")
+        i = self.columns.index(column)
+        return (np.asarray(values, dtype=float) - self.offset[i]) / self.scale[i]
+
+    def _check_width(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=float)
+        if values.ndim != 2 or values.shape[1] != len(self.columns):
+            raise ValueError(f"Expected a [time, {len(self.columns)}] array, got shape {values.shape}")
+        return values
+
+    @classmethod
+    def concatenate(cls, scalers: Sequence["MinMaxColumns"], columns: Sequence[str]) -> "MinMaxColumns":
+        """One scaler for the columns of the scalers side by side, renamed to columns"""
+        joined = cls(columns)
+        if sum(len(scaler.columns) for scaler in scalers) != len(joined.columns):
+            raise ValueError(f"Have {len(joined.columns)} names for the columns of {len(scalers)} scalers")
+        joined.data_min = np.concatenate([scaler.data_min for scaler in scalers])
+        joined.scale = np.concatenate([scaler.scale for scaler in scalers])
+        return joined
+
+
+def unique_component_names(blocks: Sequence[Sequence[str]]) -> List[str]:
+    """
+    The component names darts ends up with after stacking blocks of components one after the other. Every stack
+    renames repeated names with a _<n> suffix, so a block stacked later can get e.g. close_1_1
+    """
+    names: List[str] = []
+    for block in blocks:
+        names = names + [str(name) for name in block]
+        while len(set(names)) != len(names):
+            seen: dict = {}
+            for i, name in enumerate(names):
+                seen[name] = seen.get(name, 0) + 1
+                if seen[name] > 1:
+                    names[i] = f"{name}_{seen[name] - 1}"
+    return names
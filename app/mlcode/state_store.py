@@ -0,0 +1,92 @@
+import os
+import tempfile
+from typing import Any, Dict
+
+import yaml
+
+try:  # need modules for pytest to work
+    from app.mlcode.utils import add_coin_to_filename, read_in_yaml, resolve_aws_path, setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from utils import add_coin_to_filename, read_in_yaml, resolve_aws_path, setup_logging
+
+__all__ = ["STATE_SECTIONS", "CoinStateStore"]
+
+logger = setup_logging()
+
+# section of the state file -> constants.yml key of the yaml file it replaces
+STATE_SECTIONS = {
+    "trading_state": "trading_state_config_filename",
+    "won_and_lost": "won_and_lost_amount_filename",
+    "actions_to_take": "actions_to_take_filename",
+}
+
+# libyaml is much faster than the pure python loader/dumper, fall back if pyyaml was built without it
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+class CoinStateStore:
+    def __init__(self, coin_to_predict: str, constants: Dict[str, Any], running_on_aws: bool):
+        """The trading state, won/lost amounts and actions to take for one coin, kept in a single yaml file.
+
+        The file is written once per run and atomically, a crash leaves either the old or the new state.
+        Until it exists the state is read from the three legacy yaml files it replaces.
+
+        Args:
+            coin_to_predict (str): The coin whose state this is
+            constants (Dict[str, Any]): The constants read in from yaml
+            running_on_aws (bool): are we on lambda?
+        """
+        self.coin_to_predict = coin_to_predict
+        self.constants = constants
+        self.running_on_aws = running_on_aws
+        self.state_filename = resolve_aws_path(
+            add_coin_to_filename(coin_to_predict, constants["state_filename"]), running_on_aws
+        )
+
+    def read(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.state_filename):
+            logger.info("No %s yet, reading the legacy state files", self.state_filename)
+            return self._read_legacy_files()
+
+        logger.info("Reading in %s", self.state_filename)
+        with open(self.state_filename, "r") as f:
+            state = yaml.load(f, Loader=_YamlLoader)
+        self._validate(state)
+        return state
+
+    def write(self, state: Dict[str, Dict[str, Any]]) -> None:
+        """Write every section at once. Temp file, fsync then rename, so readers never see half a state"""
+        self._validate(state)
+        state_dir = os.path.dirname(self.state_filename) or "."
+        # no "yml" in the temp name, the go app uploads every /tmp file with that in it
+        fd, tmp_filename = tempfile.mkstemp(dir=state_dir, prefix=f".{self.coin_to_predict}_state_", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                yaml.dump(state, f, Dumper=_YamlDumper, default_flow_style=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, self.state_filename)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
+        # make the rename itself durable
+        dir_fd = os.open(state_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        logger.info("Updated %s", self.state_filename)
+
+    def _read_legacy_files(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            section: read_in_yaml(
+                add_coin_to_filename(self.coin_to_predict, self.constants[constants_key]), self.running_on_aws
+            )
+            for section, constants_key in STATE_SECTIONS.items()
+        }
+
+    def _validate(self, state: Dict[str, Dict[str, Any]]) -> None:
+        missing_sections = set(STATE_SECTIONS) - set(state or {})
+        if missing_sections:
+            raise ValueError(f"State for {self.coin_to_predict} is missing {sorted(missing_sections)}")
@@ -0,0 +1,347 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+try:  # need modules for pytest to work
+    from app.mlcode.instrumentation import peak_rss_mb
+    from app.mlcode.utils import setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from instrumentation import peak_rss_mb
+    from utils import setup_logging
+
+__all__ = [
+    "TrainingPool",
+    "available_cores",
+    "fit_model",
+    "get_training_pool",
+    "load_trained_weights",
+    "restore_module",
+    "split_cores",
+    "split_validation",
+    "trained_weights",
+]
+
+logger = setup_logging()
+
+
+def available_cores() -> int:
+    # the cores this process may run on, not every core of the host
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def split_cores(n_models: int, n_workers: int = 0, n_cores: Optional[int] = None) -> Tuple[int, int]:
+    """
+    How many worker processes to train n_models with and how many torch threads each worker gets.
+    n_workers <= 0 means one worker per model, up to the number of cores. The cores are split evenly between the
+    workers so their intra-op thread pools don't fight over the same cores
+    """
+    n_cores = n_cores or available_cores()
+    if n_workers <= 0:
+        n_workers = min(n_models, n_cores)
+    n_workers = max(1, min(n_workers, n_models))
+    return n_workers, max(1, n_cores // n_workers)
+
+
+def _init_worker(torch_threads: int) -> None:
+    import torch
+
+    torch.set_num_threads(torch_threads)
+    logger.info("Training worker %s using %s torch threads", os.getpid(), torch_threads)
+
+
+def restore_module(model: Any, weights: Dict[str, Any]) -> None:
+    """
+    Build the torch module (and its optimizer) of a darts model and load weights into it. weights has the
+    train_sample, output_dim, state_dict and total_epochs of a fit model, from a worker or a warm start checkpoint
+    """
+    model.train_sample, model.output_dim = weights["train_sample"], weights["output_dim"]
+    model._init_model()
+    model.model.load_state_dict(weights["state_dict"])
+    model.total_epochs = weights["total_epochs"]
+
+
+def split_validation(series: Any, input_chunk_length: int, output_chunk_length: int, validation_windows: int) -> Any:
+    """
+    The training part of a series and its tail to validate on, validation_windows training samples long.
+    The training part ends where the first validation target starts, so no target is in both
+    """
+    n_target_rows = output_chunk_length + validation_windows - 1
+    return series[:-n_target_rows], series[-(input_chunk_length + n_target_rows) :]
+
+
+def _validation_loader(model: Any, val_series: List[Any], past_covariates: Any) -> Any:
+    from torch.utils.data import DataLoader
+
+    # the same samples darts builds for val_series in fit
+    dataset = model._build_train_dataset(val_series, past_covariates, None)
+    return DataLoader(dataset, batch_size=model.batch_size, shuffle=False, collate_fn=model._batch_collate_fn)
+
+
+def _fit_epoch_by_epoch(
+    model: Any,
+    series: Any,
+    past_covariates: Any,
+    epochs: int,
+    verbose: bool,
+    deadline: Optional[float],
+    val_loader: Any,
+    patience: int,
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    epochs_fit, best_epoch, best_loss, best_weights = 0, 0, float("inf"), None
+    out_of_time = False
+    while epochs_fit < epochs:
+        if (
+            deadline is not None
+            and epochs_fit > 0
+            and time.time() + (time.perf_counter() - start) / epochs_fit > deadline
+        ):
+            logger.info("Stopping %s after %s of %s epochs, out of time", model.model_name, epochs_fit, epochs)
+            out_of_time = True
+            break
+        model.fit(series=series, past_covariates=past_covariates, verbose=verbose, epochs=1)
+        epochs_fit += 1
+        if val_loader is None:
+            continue
+        validation_loss = model._evaluate_validation_loss(val_loader)
+        if validation_loss < best_loss:
+            best_epoch, best_loss = epochs_fit, validation_loss
+            best_weights = {name: tensor.detach().clone() for name, tensor in model.model.state_dict().items()}
+        elif epochs_fit - best_epoch >= patience:
+            logger.info("Stopping %s at epoch %s, best validation loss at %s", model.model_name, epochs_fit, best_epoch)
+            break
+    if best_weights is not None and best_epoch < epochs_fit:
+        model.model.load_state_dict(best_weights)
+    return {
+        "epochs": epochs_fit,
+        "epoch_seconds": (time.perf_counter() - start) / epochs_fit,
+        "out_of_time": out_of_time,
+        "best_epoch": best_epoch if val_loader is not None else None,
+        "validation_loss": best_loss if val_loader is not None else None,
+        "tail_epochs": 0,
+    }
+
+
+def _fine_tune_on_tail(
+    model: Any,
+    val_series: Any,
+    past_covariates: Any,
+    verbose: bool,
+    deadline: Optional[float],
+    fit: Dict[str, Any],
+    tail_epochs: int,
+) -> Dict[str, Any]:
+    # the best epoch's weights never saw the newest windows, a few epochs on them alone. An epoch on the tail is
+    # shorter than one on the whole series, so the mean epoch time so far is a safe bound for the deadline
+    epochs_fit = 0
+    while epochs_fit < tail_epochs:
+        if deadline is not None and time.time() + fit["epoch_seconds"] > deadline:
+            logger.info("No time to fine tune %s on the held out windows, keeping its best epoch", model.model_name)
+            break
+        model.fit(series=val_series, past_covariates=past_covariates, verbose=verbose, epochs=1)
+        epochs_fit += 1
+    return {**fit, "tail_epochs": epochs_fit}
+
+
+def fit_model(
+    model: Any,
+    series: Any,
+    past_covariates: Any,
+    epochs: int,
+    verbose: bool = False,
+    initial_weights: Optional[Dict[str, Any]] = None,
+    deadline: Optional[float] = None,
+    validation_windows: int = 0,
+    patience: int = 0,
+    tail_epochs: int = 0,
+) -> Dict[str, Any]:
+    """
+    Fit a model, from scratch or carrying on from initial_weights (see restore_module).
+
+    With a deadline (unix time) the model is fit one epoch at a time and stops once the next epoch, at the mean
+    epoch time so far, would finish past it. Nothing is fit if the deadline has already passed, model.model stays None.
+    With validation_windows and patience the last validation_windows samples of the series are held out (see
+    split_validation), training stops once the validation loss hasn't improved for patience epochs and the weights
+    of the best epoch are kept. They are then fine tuned for tail_epochs on the held out windows only, one epoch at
+    a time against the deadline like the rest. A series too short to hold them out trains on all of it.
+
+    Returns the epochs fit, the mean seconds of one, whether it ran out of time, the best epoch and its
+    validation loss (None without validation) and the epochs fine tuned on the held out windows
+    """
+    if deadline is not None and time.time() >= deadline:
+        return {
+            "epochs": 0,
+            "epoch_seconds": None,
+            "out_of_time": True,
+            "best_epoch": None,
+            "validation_loss": None,
+            "tail_epochs": 0,
+        }
+    if initial_weights is not None:
+        restore_module(model, initial_weights)
+
+    val_loader, val_series = None, None
+    if validation_windows > 0 and patience > 0:
+        # a list of series (a global model) holds out the tail of each one
+        splits = [
+            split_validation(one_series, model.input_chunk_length, model.output_chunk_length, validation_windows)
+            for one_series in (series if isinstance(series, list) else [series])
+        ]
+        if all(len(train_series) >= model.input_chunk_length + model.output_chunk_length for train_series, _ in splits):
+            val_loader = _validation_loader(model, [tail for _, tail in splits], past_covariates)
+            if isinstance(series, list):
+                series, val_series = [train_series for train_series, _ in splits], [tail for _, tail in splits]
+            else:
+                series, val_series = splits[0]
+        else:
+            logger.info("Series too short to validate %s on %s windows", model.model_name, validation_windows)
+    if deadline is None and val_loader is None:
+        start = time.perf_counter()
+        model.fit(series=series, past_covariates=past_covariates, verbose=verbose, epochs=epochs)
+        epoch_seconds = (time.perf_counter() - start) / max(1, epochs)
+        return {
+            "epochs": epochs,
+            "epoch_seconds": epoch_seconds,
+            "out_of_time": False,
+            "best_epoch": None,
+            "validation_loss": None,
+            "tail_epochs": 0,
+        }
+    fit = _fit_epoch_by_epoch(model, series, past_covariates, epochs, verbose, deadline, val_loader, patience)
+    if val_series is not None and fit["best_epoch"] > 0 and not fit["out_of_time"]:
+        fit = _fine_tune_on_tail(model, val_series, past_covariates, verbose, deadline, fit, tail_epochs)
+    return fit
+
+
+def _fit_in_worker(
+    model: Any,
+    series: Any,
+    past_covariates: Any,
+    epochs: int,
+    verbose: bool,
+    initial_weights: Optional[Dict[str, Any]],
+    deadline: Optional[float],
+    validation_windows: int,
+    patience: int,
+    tail_epochs: int,
+) -> Dict[str, Any]:
+    """
+    Fit the untrained model and send back what the parent's copy of it needs: the weights and the few attributes
+    fit sets. The whole darts model, with its training series, is never pickled back. No weights if it ran out of time
+    before its first epoch
+    """
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    fit = fit_model(
+        model,
+        series,
+        past_covariates,
+        epochs,
+        verbose,
+        initial_weights,
+        deadline,
+        validation_windows,
+        patience,
+        tail_epochs,
+    )
+    return {
+        **(trained_weights(model) if model.model is not None else {}),
+        "fit": fit,
+        "metrics": {
+            "wall_seconds": round(time.perf_counter() - start_wall, 4),
+            # the whole worker, torch's threads included
+            "process_cpu_seconds": round(time.process_time() - start_cpu, 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        },
+    }
+
+
+def trained_weights(model: Any) -> Dict[str, Any]:
+    """What load_trained_weights needs to rebuild a fit model, without its training series"""
+    return {
+        "state_dict": {name: tensor.cpu() for name, tensor in model.model.state_dict().items()},
+        "train_sample": model.train_sample,
+        "output_dim": model.output_dim,
+        "total_epochs": model.total_epochs,
+        "random_instance": model._random_instance,
+    }
+
+
+def load_trained_weights(model: Any, series: Any, past_covariates: Any, trained: Dict[str, Any]) -> None:
+    """Make the parent's untrained model the one a worker fit, as if model.fit had been called here"""
+    from darts.models.forecasting.forecasting_model import GlobalForecastingModel
+
+    # keeps the series and covariates for predict, without the torch fit
+    GlobalForecastingModel.fit(model, series=series, past_covariates=past_covariates)
+    restore_module(model, trained)
+    model._random_instance = trained["random_instance"]
+
+
+class TrainingPool:
+    def __init__(self, n_workers: int, torch_threads: int):
+        """Worker processes that train darts models, each with its own torch thread pool.
+
+        Workers are spawned, not forked, torch's thread pools don't survive a fork. Each one imports torch and
+        darts when it starts, so a pool is kept for the life of the process (see get_training_pool).
+
+        Args:
+            n_workers (int): worker processes
+            torch_threads (int): torch.set_num_threads for each worker
+        """
+        self.n_workers = n_workers
+        self.torch_threads = torch_threads
+        self._executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(torch_threads,),
+        )
+
+    def submit(
+        self,
+        model: Any,
+        series: Any,
+        past_covariates: Any,
+        epochs: int,
+        verbose: bool = False,
+        initial_weights: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None,
+        validation_windows: int = 0,
+        patience: int = 0,
+        tail_epochs: int = 0,
+    ) -> Future:
+        """
+        Fit an untrained model in a worker, see fit_model. The future's result goes to load_trained_weights,
+        unless its "fit" says no epochs were fit. The model is pickled to the worker, so it can't have a torch
+        module yet, pass its weights instead
+        """
+        return self._executor.submit(
+            _fit_in_worker,
+            model,
+            series,
+            past_covariates,
+            epochs,
+            verbose,
+            initial_weights,
+            deadline,
+            validation_windows,
+            patience,
+            tail_epochs,
+        )
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+_pools: Dict[Tuple[int, int], TrainingPool] = {}
+
+
+def get_training_pool(n_workers: int, torch_threads: int) -> TrainingPool:
+    """The pool for this split of cores, shared by every prediction this process makes (--coins, --serve)"""
+    if (n_workers, torch_threads) not in _pools:
+        logger.info("Starting %s training workers with %s torch threads each", n_workers, torch_threads)
+        _pools[(n_workers, torch_threads)] = TrainingPool(n_workers, torch_threads)
+    return _pools[(n_workers, torch_threads)]
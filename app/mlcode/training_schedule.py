@@ -0,0 +1,69 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:  # need modules for pytest to work
+    from app.mlcode.utils import setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from utils import setup_logging
+
+__all__ = ["EPOCH_SECONDS_PREFIX", "epoch_seconds_key", "historical_errors", "plan_within_budget", "training_windows"]
+
+logger = setup_logging()
+
+EPOCH_SECONDS_PREFIX = "epoch_seconds_"
+
+
+def epoch_seconds_key(model_name: str) -> str:
+    # feature_cache key of the seconds one epoch of this model takes per training window. Not content addressed,
+    # each run overwrites it
+    return f"{EPOCH_SECONDS_PREFIX}{model_name}"
+
+
+def training_windows(n_rows: int, input_chunk_length: int, output_chunk_length: int) -> int:
+    """Training samples darts cuts from a series of n_rows, an epoch's time grows with these"""
+    return max(1, n_rows - input_chunk_length - output_chunk_length + 1)
+
+
+def historical_errors(
+    predictions_df: pd.DataFrame, close: pd.Series, model_names: List[str], date_prediction_for_col: str
+) -> Dict[str, float]:
+    """
+    Mean absolute error of each model's past predictions against the close on the day they were for.
+    Models with no prediction that can be scored yet are left out. 0 is a padded prediction, from before the
+    model existed, not a real one
+    """
+    if date_prediction_for_col not in predictions_df.columns:
+        return {}
+    actual = close.reindex(pd.to_datetime(predictions_df[date_prediction_for_col])).to_numpy()
+    errors = {}
+    for model_name in model_names:
+        if model_name not in predictions_df.columns:
+            continue
+        predicted = predictions_df[model_name].to_numpy(dtype=float)
+        scored = (predicted != 0) & ~np.isnan(predicted) & ~np.isnan(actual)
+        if scored.any():
+            errors[model_name] = float(np.mean(np.abs(predicted[scored] - actual[scored])))
+    return errors
+
+
+def plan_within_budget(costs: List[Optional[float]], slots: int, budget_seconds: float) -> List[bool]:
+    """
+    Which jobs, in priority order, to run so they finish within budget_seconds when slots of them run at a time.
+    Each job goes on the first free slot, a job that would finish past the budget is skipped and the cheaper jobs
+    after it can still run. costs are the expected seconds of each job, None if unknown, those always run (the fit
+    stops itself at the deadline). The first job always runs, a prediction needs at least one fresh model
+    """
+    free_at = [0.0] * max(1, slots)
+    plan = []
+    for i, cost in enumerate(costs):
+        slot = int(np.argmin(free_at))
+        if cost is None:
+            plan.append(True)
+        elif i == 0 or free_at[slot] + cost <= budget_seconds:
+            free_at[slot] += cost
+            plan.append(True)
+        else:
+            plan.append(False)
+    return plan
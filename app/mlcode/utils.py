@@ -1,45 +1,175 @@
 #!/usr/bin/env python
+import atexit
+import copy
+import hashlib
+import io
+import json
 import logging
+import logging.handlers
 import os
+import queue
 from datetime import datetime
-from typing import Any, Dict, Union
+from typing import Any, BinaryIO, Dict, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import yaml
 
-__all__ = ["setup_logging", "update_yaml_config", "read_in_data", "running_on_aws", "read_in_yaml"]
+__all__ = [
+    "setup_logging",
+    "update_yaml_config",
+    "read_in_data",
+    "running_on_aws",
+    "read_in_yaml",
+    "frame_fingerprint",
+    "resolve_aws_path",
+    "price_cache_filename",
+    "add_coin_to_filename",
+]
+
+
+def running_on_aws() -> bool:
+    return os.environ.get("AWS_EXECUTION_ENV") is not None
+
+
+# set GO_TRADER_LOG_MODE to override. production is the default on lambda, verbose everywhere else
+LOG_MODE_ENV_VAR = "GO_TRADER_LOG_MODE"
+LOG_MODES = ("production", "verbose")
+_configured_log_mode: Optional[str] = None
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One json object per record. Runs on the queue listener's thread in production mode"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = {
+            "time": datetime.utcfromtimestamp(record.created).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "level": record.levelname,
+            "func": record.funcName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:  # formatted before it was queued
+            event["exception"] = record.exc_text
+        return json.dumps(event, default=str)
+
+
+# args the listener can format later, the caller can't change them in the meantime
+_IMMUTABLE_LOG_ARG_TYPES = (str, int, float, bool, bytes, datetime, type(None))
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # the stock QueueHandler formats every message on the calling thread before queueing it. Here a copy of the
+    # record is queued, and only a message whose args are all immutable is left for the listener to format
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        args = record.args.values() if isinstance(record.args, dict) else record.args or ()
+        if not all(isinstance(arg, _IMMUTABLE_LOG_ARG_TYPES) for arg in args):
+            record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            # no tracebacks and frames on the listener's thread
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+@atexit.register
+def _stop_log_listener() -> None:
+    # flush what's still queued before the process exits
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+def get_log_mode() -> str:
+    log_mode = os.environ.get(LOG_MODE_ENV_VAR, "production" if running_on_aws() else "verbose").lower()
+    if log_mode not in LOG_MODES:
+        raise ValueError(f"Incorrect {LOG_MODE_ENV_VAR} {log_mode}. Should be one of {', '.join(LOG_MODES)}")
+    return log_mode
 
 
 def setup_logging() -> logging.Logger:
+    """
+    Configure the root logger once per process, every module calls this on import.
+
+    production: info and above as json events. Records go through a queue and are formatted and written by a
+        background thread, the calling thread only builds the record
+    verbose: text on the calling thread, with our debug logs (the dataframes, every config key)
+    """
+    global _configured_log_mode, _log_listener
+    log_mode = get_log_mode()
+    # every module logs through this one logger, the func name tells them apart
+    go_trader_logger = logging.getLogger(__name__)
+    if log_mode == _configured_log_mode:
+        return go_trader_logger
 
     root = logging.getLogger()
-    if root.handlers:
-        for handler in root.handlers:
-            root.removeHandler(handler)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    _stop_log_listener()
 
-    logging.basicConfig(format="%(asctime)s: : %(funcName)s  %(message)s", level=logging.INFO)
+    if log_mode == "production":
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(JsonLogFormatter())
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        _log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        _log_listener.start()
+        root.addHandler(_DeferredQueueHandler(log_queue))
+        root.setLevel(logging.INFO)
+        go_trader_logger.setLevel(logging.INFO)
+        logging.captureWarnings(True)  # pandas warnings become json events too
+    else:
+        logging.captureWarnings(False)
+        logging.basicConfig(format="%(asctime)s: : %(funcName)s  %(message)s", level=logging.INFO)
+        # only our own debug logs, not every library's
+        go_trader_logger.setLevel(logging.DEBUG)
+    _configured_log_mode = log_mode
 
-    return logging.getLogger(__name__)
+    return go_trader_logger
 
 
 logger = setup_logging()
 
+# bump when the layout of the price cache changes, older caches are then ignored
+PRICE_CACHE_VERSION = 2
+# bytes before the cached offset that must be unchanged for the csv to count as appended to
+PRICE_CACHE_TAIL_CHECK_BYTES = 4096
 
-def update_yaml_config(file_name: str, data: Dict[str, Any], running_on_aws: bool) -> None:
+
+def add_coin_to_filename(coin: str, filename: str) -> str:
+    """
+    Adds the coin to the filename
+    :param coin:
+    """
+    filename_split = filename.split("/")
+    final_filename = filename_split[0] + "/" + coin + "_" + filename_split[1]
+    logger.info("final_filename = %s", final_filename)
+
+    return final_filename
+
+
+def resolve_aws_path(file_name: str, running_on_aws: bool) -> str:
+    """On lambda every file lives directly under /tmp/"""
     if running_on_aws:
         s = file_name.split("/")
         file_name = "/tmp/" + s[-1]
+    return file_name
+
+
+def update_yaml_config(file_name: str, data: Dict[str, Any], running_on_aws: bool) -> None:
+    file_name = resolve_aws_path(file_name, running_on_aws)
     with open(file_name, "w") as yaml_file:
-        logger.info(f"Updating {file_name} with {data}")
+        logger.info("Updating %s with %s", file_name, data)
         yaml_file.write(yaml.dump(data, default_flow_style=False))
 
 
 def read_in_yaml(input_file: str, running_on_aws: bool) -> Union[Dict[str, Any], ValueError]:
-    if running_on_aws:
-        s = input_file.split("/")
-        input_file = "/tmp/" + s[-1]
+    input_file = resolve_aws_path(input_file, running_on_aws)
 
-    logger.info(f"Reading in {input_file}")
+    logger.info("Reading in %s", input_file)
     with open(input_file, "r") as stream:
         try:
             constants = yaml.safe_load(stream)
@@ -47,14 +177,134 @@ def read_in_yaml(input_file: str, running_on_aws: bool) -> Union[Dict[str, Any],
             logger.error(exc)
             raise ValueError(f" Incorrect YAML file {input_file}")
 
-    for k, v in constants.items():
-        logger.info(f"Key = {k} Value = {v}")
-    logger.info("----------")
+    if logger.isEnabledFor(logging.DEBUG):
+        for k, v in constants.items():
+            logger.debug("Key = %s Value = %s", k, v)
+        logger.debug("----------")
     return constants
 
 
-def running_on_aws() -> bool:
-    return os.environ.get("AWS_EXECUTION_ENV") is not None
+def price_cache_filename(csv_filename: str) -> str:
+    # no "csv" or "yml" in the name, the go app uploads every /tmp file with those in it to S3
+    return os.path.splitext(csv_filename)[0] + ".price_cache.npz"
+
+
+def _csv_fingerprint(csv_file: BinaryIO, offset: int) -> Tuple[str, bool]:
+    """
+    Hash of the header and of the last bytes before offset. If both still match the csv has only been appended to.
+    Also whether the bytes before offset end on a full line, rows can only be appended after one
+    """
+    csv_file.seek(0)
+    header = csv_file.readline()
+    block_start = max(0, offset - PRICE_CACHE_TAIL_CHECK_BYTES)
+    csv_file.seek(block_start)
+    block = csv_file.read(offset - block_start)
+    return hashlib.sha1(header + b"\0" + block).hexdigest(), block.endswith(b"\n")
+
+
+def _parse_appended_rows(csv_file: BinaryIO, offset: int) -> pd.DataFrame:
+    """Parse only the rows written after offset, with the csv's header"""
+    csv_file.seek(0)
+    header = csv_file.readline()
+    csv_file.seek(offset)
+    return pd.read_csv(io.BytesIO(header + csv_file.read()), index_col=0, parse_dates=True)
+
+
+def _load_price_cache(cache_filename: str) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """The cached frame and what we knew about the csv when it was written"""
+    with np.load(cache_filename, allow_pickle=False) as cache:
+        version, csv_size, csv_mtime_ns, ends_on_full_line = cache["meta"].tolist()
+        csv_info = {
+            "version": version,
+            "csv_size": csv_size,
+            "csv_mtime_ns": csv_mtime_ns,
+            "ends_on_full_line": bool(ends_on_full_line),
+            "fingerprint": str(cache["fingerprint"]),
+        }
+        index_name, *columns = cache["names"].tolist()
+        index = pd.DatetimeIndex(cache["index"].view("datetime64[ns]"), name=index_name or None)
+        # columns are stored in one 2d block per dtype, layout has the (block, column in block) of each column
+        layout = cache["layout"].tolist()
+        blocks = [cache[f"block_{i}"] for i in range(max(block for block, _ in layout) + 1)]
+    if len(blocks) == 1:
+        return pd.DataFrame(blocks[0], index=index, columns=columns), csv_info
+    df = pd.DataFrame({col: blocks[block][:, pos] for col, (block, pos) in zip(columns, layout)}, index=index)
+    return df, csv_info
+
+
+def _read_price_cache(csv_filename: str, csv_stat: os.stat_result) -> Optional[pd.DataFrame]:
+    """
+    The cached frame for the csv, or None if there is no usable cache.
+    If rows were appended to the csv since the cache was written, only those rows are parsed and the cache is updated
+    """
+    cache_filename = price_cache_filename(csv_filename)
+    if not os.path.exists(cache_filename):
+        return None
+    try:
+        df, csv_info = _load_price_cache(cache_filename)
+        if csv_info["version"] != PRICE_CACHE_VERSION or csv_info["csv_size"] > csv_stat.st_size:
+            return None
+        if csv_info["csv_size"] == csv_stat.st_size:
+            # same size but a new mtime means it was rewritten in place
+            return df if csv_info["csv_mtime_ns"] == csv_stat.st_mtime_ns else None
+
+        with open(csv_filename, "rb") as csv_file:
+            fingerprint, _ = _csv_fingerprint(csv_file, csv_info["csv_size"])
+            if not csv_info["ends_on_full_line"] or fingerprint != csv_info["fingerprint"]:
+                logger.info("%s was rewritten, reading in all of it", csv_filename)
+                return None
+            appended_df = _parse_appended_rows(csv_file, csv_info["csv_size"])
+    except Exception as e:  # a corrupt or half written cache, fall back to the csv
+        logger.warning("Ignoring price cache %s: %s", cache_filename, e)
+        return None
+
+    if appended_df.empty:  # only blank lines were appended
+        _write_price_cache(csv_filename, csv_stat, df)
+        return df
+    if list(appended_df.columns) != list(df.columns) or not isinstance(appended_df.index, pd.DatetimeIndex):
+        logger.info("Rows appended to %s don't match the cached columns, reading in all of it", csv_filename)
+        return None
+    logger.info("Parsed %s rows appended to %s after %s", len(appended_df), csv_filename, df.index.max())
+    # duplicate dates are kept, same as reading in the whole csv
+    df = pd.concat([df, appended_df])
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    _write_price_cache(csv_filename, csv_stat, df)
+    return df
+
+
+def _write_price_cache(csv_filename: str, csv_stat: os.stat_result, df: pd.DataFrame) -> None:
+    """Store the parsed, sorted frame as one 2d array per dtype. Only for all numeric frames with a plain date index"""
+    if not isinstance(df.index, pd.DatetimeIndex) or df.index.tz is not None:
+        return
+    if not all(pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes):
+        return
+    cache_filename = price_cache_filename(csv_filename)
+    tmp_filename = f"{cache_filename}.{os.getpid()}.tmp"
+    dtypes = list(dict.fromkeys(str(dtype) for dtype in df.dtypes))
+    column_dtypes = [str(dtype) for dtype in df.dtypes]
+    layout = [(dtypes.index(dtype), column_dtypes[:i].count(dtype)) for i, dtype in enumerate(column_dtypes)]
+    block_positions = [[pos for pos, col_dtype in enumerate(column_dtypes) if col_dtype == dtype] for dtype in dtypes]
+    try:
+        with open(csv_filename, "rb") as csv_file:
+            fingerprint, ends_on_full_line = _csv_fingerprint(csv_file, csv_stat.st_size)
+        with open(tmp_filename, "wb") as f:
+            np.savez(
+                f,
+                meta=np.array(
+                    [PRICE_CACHE_VERSION, csv_stat.st_size, csv_stat.st_mtime_ns, ends_on_full_line], dtype=np.int64
+                ),
+                fingerprint=np.array(fingerprint),
+                names=np.array([df.index.name or ""] + [str(col) for col in df.columns]),
+                index=df.index.asi8,
+                layout=np.array(layout, dtype=np.int64).reshape(-1, 2),
+                **{f"block_{i}": df.iloc[:, positions].to_numpy() for i, positions in enumerate(block_positions)},
+            )
+        os.replace(tmp_filename, cache_filename)  # readers never see a half written cache
+    except OSError as e:
+        logger.warning("Unable to write price cache %s: %s", cache_filename, e)
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
 
 
 def read_in_data(
@@ -62,20 +312,39 @@ def read_in_data(
     running_on_aws: bool,
     date_col: str = "date",
     missing_dates: bool = False,
+    use_cache: bool = True,
 ) -> pd.DataFrame:
-    if running_on_aws:
-        input_file
-        s = input_file.split("/")
-        input_file = "/tmp/" + s[-1]
-    logger.info(f"Input file {input_file}")
-    df = pd.read_csv(input_file, index_col=0, parse_dates=True)  # dates are index
-    df = df.sort_index()  # ensure monotonic
+    """
+    Read a historical prices csv, dates are the index and sorted.
+    With use_cache the parsed frame is kept in a .npz next to the csv. When the go app appends candles only the new
+    rows are parsed. Any other change to the csv reads in the whole file again
+    """
+    input_file = resolve_aws_path(input_file, running_on_aws)
+    logger.info("Input file %s", input_file)
+    df = None
+    if use_cache:
+        csv_stat = os.stat(input_file)
+        df = _read_price_cache(input_file, csv_stat)
+        if df is not None:
+            logger.info("Read %s from the price cache", input_file)
+    if df is None:
+        df = pd.read_csv(input_file, index_col=0, parse_dates=True)  # dates are index
+        df = df.sort_index()  # ensure monotonic
+        if use_cache:
+            _write_price_cache(input_file, csv_stat, df)
     if missing_dates:  # for SPY
         idx = pd.date_range(df.index.min(), datetime.utcnow().date())
         df.index = pd.DatetimeIndex(df.index)
         df = df.reindex(idx, method="ffill")
         df.index = df.index.rename(date_col)
-    logger.info(df.head())
-    logger.info(df.tail())
-    logger.info("---")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s\n%s\n---", df.head(), df.tail())
     return df
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """Hash the index, column names and values of a DataFrame. Equal frames give equal fingerprints"""
+    hasher = hashlib.sha1()
+    hasher.update(",".join(str(col) for col in df.columns).encode())
+    hasher.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return hasher.hexdigest()
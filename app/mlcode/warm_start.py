@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+try:  # need modules for pytest to work
+    from app.mlcode.utils import setup_logging
+except ModuleNotFoundError:  # Go is unable to run python modules -m
+    from utils import setup_logging
+
+__all__ = [
+    "WARM_START_VERSION",
+    "load_checkpoint",
+    "model_params_hash",
+    "save_checkpoint",
+    "warm_start_filename",
+]
+
+logger = setup_logging()
+
+WARM_START_VERSION = 1
+
+
+def model_params_hash(params: Dict[str, Any]) -> str:
+    """Hash of everything that shapes a model's weights: its class, chunk lengths, hyperparameters and covariates"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def warm_start_filename(directory: str, model_name: str) -> str:
+    # no "csv" or "yml" in the name, the go app uploads every /tmp file with those in it to S3
+    return os.path.join(directory, f"{model_name}.warm_start.pt")
+
+
+def save_checkpoint(filename: str, model: Any, params_hash: str, last_date: pd.Timestamp, fine_tunes: int) -> None:
+    """
+    Keep a trained model's weights for the next run to start from.
+
+    Args:
+        last_date (pd.Timestamp): last date of the series it was trained on
+        fine_tunes (int): warm starts in a row since the model was last trained from scratch
+    """
+    import torch
+
+    checkpoint = {
+        "version": WARM_START_VERSION,
+        "params_hash": params_hash,
+        "last_date": last_date.isoformat(),
+        "fine_tunes": fine_tunes,
+        "train_sample": model.train_sample,
+        "output_dim": model.output_dim,
+        "total_epochs": model.total_epochs,
+        "state_dict": model.model.state_dict(),
+    }
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        torch.save(checkpoint, tmp_filename)
+        os.replace(tmp_filename, filename)  # readers never see a half written checkpoint
+    except OSError as e:
+        logger.warning("Unable to write warm start checkpoint %s: %s", filename, e)
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def load_checkpoint(filename: str, params_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    The checkpoint, or None if there isn't a usable one. It has the weights training_pool.fit_model can start from.
+    Only point it at a directory this app writes, checkpoints are unpickled
+    """
+    import torch
+
+    if not os.path.exists(filename):
+        return None
+    try:
+        checkpoint = torch.load(filename)  # type: ignore
+    except Exception as e:  # a corrupt or half written checkpoint, train from scratch
+        logger.warning("Ignoring warm start checkpoint %s: %s", filename, e)
+        return None
+    if checkpoint.get("version") != WARM_START_VERSION or checkpoint.get("params_hash") != params_hash:
+        logger.info("Warm start checkpoint %s was trained with other hyperparameters", filename)
+        return None
+    return checkpoint
@@ -2,6 +2,7 @@ package main
 
 import (
 	"context"
+	"errors"
 	"fmt"
 	"io/ioutil"
 	"log"
@@ -108,14 +109,19 @@ func HandleRequest(ctx context.Context, req structs.CloudWatchEvent) (string, er
 		log.Printf("Running only golang code locally")
 	} else if runningOnAws {
 		log.Printf("Calling our Python program with coin = %v", coinToPredict)
-		RunPythonMlProgram(constantsMap, coinToPredict)
+		// the python program cuts training short to finish before the lambda times out
+		deadline, ok := ctx.Deadline()
+		if !ok {
+			deadline = start.Add(15 * time.Minute)
+		}
+		RunPythonMlProgram(constantsMap, coinToPredict, deadline)
 	}
 	// Read in the constants  that have been updated from our python ML program. Determine what to do based
 	log.Println("Determining actions to take")
 	// only updated the tmp./ folder
-	actionsToTakeConstants := utils.ReadYamlFile(constantsMap["actions_to_take_filename"], runningOnAws, coinToPredict)
-	// read in nested yaml?
-	actionToTake := actionsToTakeConstants["action_to_take"]
+	// the python program writes the trading state, won/lost amounts and actions to take into one file
+	stateConstants := utils.ReadNestedYamlFile(constantsMap["state_filename"], runningOnAws, coinToPredict)
+	actionToTake := stateConstants["actions_to_take"]["action_to_take"]
 	log.Println(actionToTake, "actionToTake")
 
 	log.Println("Logging into FTX to get account info")
@@ -222,7 +228,7 @@ func IterateAndUploadTmpFilesYmlCsv(path string, constantsMap map[string]string,
 
 	for _, f := range files {
 
-		if strings.Contains(f.Name(), "yml") || strings.Contains(f.Name(), "csv") {
+		if strings.Contains(f.Name(), "yml") || strings.Contains(f.Name(), "csv") || strings.HasSuffix(f.Name(), "_all_predictions_log.jsonl") {
 			if !runningOnAws {
 				log.Println("Not uploading to S3, running locally")
 			} else {
@@ -279,7 +285,7 @@ func DownloadUpdateData(csvFilename string, inputRecords []*models.HistoricalPri
 
 }
 
-func RunPythonMlProgram(constantsMap map[string]string, coinToPredict string) {
+func RunPythonMlProgram(constantsMap map[string]string, coinToPredict string, deadline time.Time) {
 	pwd, err := os.Getwd()
 	if err != nil {
 		log.Println(err)
@@ -287,7 +293,20 @@ func RunPythonMlProgram(constantsMap map[string]string, coinToPredict string) {
 	}
 	log.Println("Current working directory = ", pwd)
 
-	cmd := exec.Command("python3", filepath.Join(pwd, constantsMap["python_script_path"]), fmt.Sprintf("--coin_to_predict=%v", coinToPredict))
+	// on the always on container a warm worker (main.py --serve) skips the python startup cost
+	if socketPath := os.Getenv("PYTHON_WORKER_SOCKET"); socketPath != "" {
+		_, workerErr := utils.PredictWithWorker(socketPath, coinToPredict, deadline)
+		if workerErr == nil {
+			return
+		}
+		// a worker that got the request may still be writing the state and predictions, don't run a second writer
+		if !errors.Is(workerErr, utils.ErrWorkerUnavailable) {
+			panic(workerErr)
+		}
+		log.Println("Python worker unavailable, running the python script instead", workerErr)
+	}
+
+	cmd := exec.Command("python3", filepath.Join(pwd, constantsMap["python_script_path"]), fmt.Sprintf("--coin_to_predict=%v", coinToPredict), fmt.Sprintf("--deadline=%v", deadline.Unix()))
 	stdout, err := cmd.StdoutPipe()
 	if err != nil {
 		panic(err)
@@ -314,14 +333,35 @@ func RunPythonMlProgram(constantsMap map[string]string, coinToPredict string) {
 
 func DownloadConfigFiles(constantsMap map[string]string, runningOnAws bool, awsSession *session.Session, coinToPredict string) {
 	// only download the configs for the coin we are predicting
+	//ml_config.yml
+	awsUtils.DownloadFromS3(constantsMap["s3_bucket"], constantsMap["ml_config_filename"], runningOnAws, awsSession)
+
+	// predictions_csv
+	splitStringsPredictions := strings.Split(constantsMap["all_predictions_csv_filename"], "/")
+	AllPredictionsFilename := splitStringsPredictions[0] + "/" + coinToPredict + "_" + splitStringsPredictions[1]
+	awsUtils.DownloadFromS3(constantsMap["s3_bucket"], AllPredictionsFilename, runningOnAws, awsSession)
+	// the rows appended since the csv was last compacted, see prediction_log_filename in prediction_store.py
+	predictionsLogFilename := strings.TrimSuffix(AllPredictionsFilename, ".csv") + "_log.jsonl"
+	if awsUtils.ExistsInS3(constantsMap["s3_bucket"], predictionsLogFilename, awsSession) {
+		awsUtils.DownloadFromS3(constantsMap["s3_bucket"], predictionsLogFilename, runningOnAws, awsSession)
+	}
+
+	// state.yml has the trading state, won/lost amounts and actions to take. Until the python program
+	// has written it for this coin, download the three files it replaces
+	splitStringsState := strings.Split(constantsMap["state_filename"], "/")
+	stateFilename := splitStringsState[0] + "/" + coinToPredict + "_" + splitStringsState[1]
+	if awsUtils.ExistsInS3(constantsMap["s3_bucket"], stateFilename, awsSession) {
+		awsUtils.DownloadFromS3(constantsMap["s3_bucket"], stateFilename, runningOnAws, awsSession)
+		return
+	}
+	log.Println("No state file yet, downloading the legacy state files for ", coinToPredict)
+
 	splitStringsActionsToTake := strings.Split(constantsMap["actions_to_take_filename"], "/")
 	actionsToTakeFilename := splitStringsActionsToTake[0] + "/" + coinToPredict + "_" + splitStringsActionsToTake[1]
 	log.Println("actionsToTakeFilename = ", actionsToTakeFilename)
 
 	awsUtils.DownloadFromS3(constantsMap["s3_bucket"], actionsToTakeFilename, runningOnAws, awsSession)
 
-	//ml_config.yml
-	awsUtils.DownloadFromS3(constantsMap["s3_bucket"], constantsMap["ml_config_filename"], runningOnAws, awsSession)
 	//trading_state_config.yml
 	splitStringsTradingState := strings.Split(constantsMap["trading_state_config_filename"], "/")
 	tradingStateConfigFilename := splitStringsTradingState[0] + "/" + coinToPredict + "_" + splitStringsTradingState[1]
@@ -332,11 +372,6 @@ func DownloadConfigFiles(constantsMap map[string]string, runningOnAws bool, awsS
 	WonLostConfigFilename := splitStringsWonLost[0] + "/" + coinToPredict + "_" + splitStringsWonLost[1]
 
 	awsUtils.DownloadFromS3(constantsMap["s3_bucket"], WonLostConfigFilename, runningOnAws, awsSession)
-
-	// predictions_csv
-	splitStringsPredictions := strings.Split(constantsMap["all_predictions_csv_filename"], "/")
-	AllPredictionsFilename := splitStringsPredictions[0] + "/" + coinToPredict + "_" + splitStringsPredictions[1]
-	awsUtils.DownloadFromS3(constantsMap["s3_bucket"], AllPredictionsFilename, runningOnAws, awsSession)
 }
 
 func CreateFtxClientAndMarket(coinToPredict string) (*goftx.Client, string) {
@@ -251,6 +251,8 @@ func TestDownloadConfigFiles(t *testing.T) {
 	var allPredictionsCsvFilename = "tmp/all_predictions.csv"
 	var tradingStateConfigFIlename = "tmp/test_trading_state_config.yml"
 	var wonAndLostAmountFilename = "tmp/test_won_and_lost_amount.yml"
+	// not uploaded to the fake bucket, so the legacy state files are downloaded
+	var stateFilename = "tmp/test_state.yml"
 	// filesnames with the tmp removed. This is what we will see as we iterate through the downloaded directory
 	var tmpBtcActionsToTakeFilename = "btc_test_actions_to_take.yml"
 	var tmpBtcTradingStateConfigFIlename = "btc_test_trading_state_config.yml"
@@ -268,7 +270,7 @@ func TestDownloadConfigFiles(t *testing.T) {
 	AppFs.MkdirAll("/tmp/", os.ModePerm)
 
 	constantsMap := map[string]string{"s3_bucket": bucketName, "actions_to_take_filename": actionsToTakeFilename, "ml_config_filename": mlConfigFilename, "trading_state_config_filename": tradingStateConfigFIlename, "won_and_lost_amount_filename": wonAndLostAmountFilename,
-		"all_predictions_csv_filename": allPredictionsCsvFilename,
+		"all_predictions_csv_filename": allPredictionsCsvFilename, "state_filename": stateFilename,
 	}
 
 	// fake s3 uploads
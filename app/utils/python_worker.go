@@ -0,0 +1,64 @@
+package utils
+
+import (
+	"bufio"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"log"
+	"net"
+	"time"
+)
+
+// WorkerReply is the json line the python prediction worker sends back for every request
+type WorkerReply struct {
+	Status          string  `json:"status"`
+	Error           string  `json:"error"`
+	Coin            string  `json:"coin"`
+	PricePrediction float64 `json:"price_prediction"`
+	Seconds         float64 `json:"seconds"`
+}
+
+// ErrWorkerUnavailable is returned when no request reached the worker, running main.py directly instead is safe.
+// Any other error means the worker may still be predicting and writing the state files.
+var ErrWorkerUnavailable = errors.New("python worker unavailable")
+
+// PredictWithWorker asks the python worker listening on socketPath (main.py --serve) to run a prediction.
+// The worker writes the same yaml state files as running main.py directly. Once the request is sent the reply is
+// waited for up to the deadline.
+func PredictWithWorker(socketPath string, coinToPredict string, deadline time.Time) (WorkerReply, error) {
+	var reply WorkerReply
+
+	conn, err := net.DialTimeout("unix", socketPath, 5*time.Second)
+	if err != nil {
+		return reply, fmt.Errorf("%w: %v", ErrWorkerUnavailable, err)
+	}
+	defer conn.Close()
+	err = conn.SetDeadline(deadline)
+	if err != nil {
+		return reply, fmt.Errorf("%w: %v", ErrWorkerUnavailable, err)
+	}
+
+	request, err := json.Marshal(map[string]interface{}{"command": "predict", "coin_to_predict": coinToPredict, "deadline": deadline.Unix()})
+	if err != nil {
+		return reply, err
+	}
+	_, err = conn.Write(append(request, '\n'))
+	if err != nil {
+		return reply, err
+	}
+
+	line, err := bufio.NewReader(conn).ReadBytes('\n')
+	if err != nil {
+		return reply, err
+	}
+	err = json.Unmarshal(line, &reply)
+	if err != nil {
+		return reply, err
+	}
+	if reply.Status != "ok" {
+		return reply, fmt.Errorf("python worker failed to predict %v: %v", coinToPredict, reply.Error)
+	}
+	log.Printf("Python worker predicted %v for %v in %v seconds", reply.PricePrediction, reply.Coin, reply.Seconds)
+	return reply, nil
+}
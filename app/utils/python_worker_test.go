@@ -0,0 +1,38 @@
+package utils
+
+import (
+	"errors"
+	"net"
+	"path/filepath"
+	"testing"
+	"time"
+)
+
+func TestPredictWithWorkerUnavailable(t *testing.T) {
+	_, err := PredictWithWorker(filepath.Join(t.TempDir(), "missing.sock"), "btc", time.Now().Add(time.Second))
+	if !errors.Is(err, ErrWorkerUnavailable) {
+		t.Errorf("expected ErrWorkerUnavailable without a worker, got %v", err)
+	}
+}
+
+func TestPredictWithWorkerTimeoutIsNotUnavailable(t *testing.T) {
+	socketPath := filepath.Join(t.TempDir(), "worker.sock")
+	listener, err := net.Listen("unix", socketPath)
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer listener.Close()
+	// a worker that takes the request and is still predicting at the deadline
+	go func() {
+		conn, err := listener.Accept()
+		if err == nil {
+			time.Sleep(time.Second)
+			conn.Close()
+		}
+	}()
+
+	_, err = PredictWithWorker(socketPath, "btc", time.Now().Add(100*time.Millisecond))
+	if err == nil || errors.Is(err, ErrWorkerUnavailable) {
+		t.Errorf("expected a timeout once the request was sent, got %v", err)
+	}
+}
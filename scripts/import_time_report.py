@@ -0,0 +1,76 @@
+import logging
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import click
+
+logging.basicConfig(format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p", level=logging.INFO)
+
+# these should only be imported by the stage that needs them, never by the entry point
+HEAVY_PACKAGES = ["darts", "torch", "finta", "sklearn", "matplotlib"]
+
+
+def measure_import_times(module: str) -> List[Tuple[str, int, int]]:
+    """
+    Import the module in a fresh interpreter with python -X importtime.
+    Returns (imported package, self microseconds, cumulative microseconds) for every import
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise ValueError(f"Unable to import {module}: {result.stderr[-2000:]}")
+
+    import_times = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_time, cumulative, package = line.replace("import time:", "", 1).split("|")
+        import_times.append((package.strip(), int(self_time), int(cumulative)))
+    return import_times
+
+
+def summarize_import_times(import_times: List[Tuple[str, int, int]]) -> Dict[str, int]:
+    """Microseconds spent importing each root package (pandas, numpy, app ...), slowest first. Sums to the total"""
+    summary: Dict[str, int] = defaultdict(int)
+    for package, self_time, _ in import_times:
+        summary[package.split(".")[0]] += self_time
+    return dict(sorted(summary.items(), key=lambda item: item[1], reverse=True))
+
+
+@click.command()
+@click.option("--module", default="app.mlcode.main", help="The module to import, run from the repo root")
+@click.option("--budget_ms", default=2000, help="Fail if importing the module takes longer than this")
+@click.option("--repeat", default=3, help="Take the fastest of this many imports, the first one compiles .pyc files")
+@click.option("--top_n", default=15, help="How many of the slowest top level imports to report")
+def main(module: str, budget_ms: int, repeat: int, top_n: int) -> None:
+    runs = [measure_import_times(module) for _ in range(repeat)]
+    fastest_run = min(runs, key=lambda run: sum(self_time for _, self_time, _ in run))
+    summary = summarize_import_times(fastest_run)
+    total_ms = sum(summary.values()) / 1000
+
+    logging.info(f"Import time report for {module}, fastest of {repeat}")
+    for package, package_time in list(summary.items())[:top_n]:
+        logging.info(f"{package_time / 1000:10.1f} ms  {package}")
+    logging.info(f"Total = {total_ms:.1f} ms. Budget = {budget_ms} ms")
+
+    imported_packages = {package.split(".")[0] for package, _, _ in fastest_run}
+    heavy_imports = sorted(imported_packages.intersection(HEAVY_PACKAGES))
+    failed = False
+    if heavy_imports:
+        logging.error(f"{module} imports {heavy_imports}. Import them inside the stage that needs them")
+        failed = True
+    if total_ms > budget_ms:
+        logging.error(f"{module} took {total_ms:.1f} ms to import, over the {budget_ms} ms budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
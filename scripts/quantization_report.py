@@ -0,0 +1,172 @@
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+import numpy as np
+import pandas as pd
+
+from app.mlcode.coin_registry import LazyPriceData
+from app.mlcode.inference_export import ExportedModel, export_model, exported_model_filename, quantization_skip_reason
+from app.mlcode.predict_price_movements import CoinPricePredictor
+from app.mlcode.prediction_store import prediction_log_filename
+from app.mlcode.utils import add_coin_to_filename, read_in_yaml
+
+logging.basicConfig(format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p", level=logging.INFO)
+
+
+def time_prediction(
+    exported: ExportedModel, target: np.ndarray, covariates: np.ndarray, n: int, repeat: int
+) -> Tuple[float, float]:
+    """Median milliseconds of one prediction over repeat runs, and the prediction"""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        prediction = float(exported.predict(target, covariates, n)[-1, 0])
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds) * 1000, prediction
+
+
+def export(directory: str, model: Any, quantize: bool) -> ExportedModel:
+    exported = export_model(exported_model_filename(directory, model.model_name, quantize), model, "report", quantize)
+    if exported is None:
+        raise ValueError(f"Unable to export {model.model_name}, see the log")
+    return exported
+
+
+def stacking_prediction(
+    predictor: CoinPricePredictor, predictions: Dict[str, float], all_predictions_filename: str, directory: str
+) -> float:
+    # on a fresh copy of the all predictions csv and its log, the coin's own ones are left as they are
+    filename = os.path.join(directory, os.path.basename(all_predictions_filename))
+    for source, destination in [
+        (all_predictions_filename, filename),
+        (prediction_log_filename(all_predictions_filename), prediction_log_filename(filename)),
+    ]:
+        if os.path.exists(source):
+            shutil.copy(source, destination)
+        elif os.path.exists(destination):
+            os.remove(destination)
+    # the store was opened on the coin's own files, point it at the copies and read them again
+    predictor.all_predictions_filename = filename
+    predictor.prediction_store = predictor._prediction_store()
+    predictor._predictions_df = None
+    predictor._generate_base_predictions_df(predictions)
+    return predictor._make_stacking_prediction_and_save()
+
+
+def file_sizes(filenames: List[str]) -> Dict[str, Optional[int]]:
+    return {filename: os.path.getsize(filename) if os.path.exists(filename) else None for filename in filenames}
+
+
+def compare_coin(
+    coin: str,
+    constants: Dict[str, Any],
+    ml_constants: Dict[str, Any],
+    price_data: LazyPriceData,
+    directory: str,
+    repeat: int,
+) -> pd.DataFrame:
+    """
+    Train the coin's models once, then predict with the float models and with the int8 ones.
+    One row per model, and a stacking_prediction row with the time of all the models together
+    """
+    all_predictions_filename = add_coin_to_filename(coin, constants["all_predictions_csv_filename"])
+    # the go app uploads these, the report mustn't add rows to them
+    store_filenames = [all_predictions_filename, prediction_log_filename(all_predictions_filename)]
+    store_sizes = file_sizes(store_filenames)
+    predictor = CoinPricePredictor(
+        coin,
+        constants,
+        ml_constants,
+        price_data.get_input_df(coin),
+        all_predictions_filename=all_predictions_filename,
+        additional_dfs=price_data.get_additional_dfs(coin),
+    )
+    train_close_series, ts_stacked_series = predictor.build_series()
+    predictor._create_models()
+    predictor._train_models(train_close_series, ts_stacked_series)
+    target, covariates = train_close_series.values(copy=False), ts_stacked_series.values(copy=False)
+    n = ml_constants["prediction_params"]["prediction_n_days"]
+
+    rows: List[Dict[str, Any]] = []
+    float_predictions, int8_predictions = {}, {}
+    for lookback_window_models in predictor.models:
+        for model in lookback_window_models:
+            float_ms, float_predictions[model.model_name] = time_prediction(
+                export(directory, model, False), target, covariates, n, repeat
+            )
+            reason = quantization_skip_reason(model)
+            if reason is None:
+                int8_ms, int8_predictions[model.model_name] = time_prediction(
+                    export(directory, model, True), target, covariates, n, repeat
+                )
+            else:  # predicts as it is in the int8 mode too
+                int8_ms, int8_predictions[model.model_name] = float_ms, float_predictions[model.model_name]
+            rows.append(
+                {
+                    "model": model.model_name,
+                    "float_ms": float_ms,
+                    "int8_ms": int8_ms,
+                    "float_prediction": float_predictions[model.model_name],
+                    "int8_prediction": int8_predictions[model.model_name],
+                    "skipped": reason or "",
+                }
+            )
+
+    rows.append(
+        {
+            "model": constants["stacking_prediction_col"],
+            "float_ms": sum(row["float_ms"] for row in rows),
+            "int8_ms": sum(row["int8_ms"] for row in rows),
+            "float_prediction": stacking_prediction(predictor, float_predictions, all_predictions_filename, directory),
+            "int8_prediction": stacking_prediction(predictor, int8_predictions, all_predictions_filename, directory),
+            "skipped": "",
+        }
+    )
+    if file_sizes(store_filenames) != store_sizes:
+        raise RuntimeError(f"The report changed {coin}'s predictions, {store_sizes} -> {file_sizes(store_filenames)}")
+    report = pd.DataFrame(rows)
+    report.insert(0, "coin", coin)
+    report["speedup"] = report["float_ms"] / report["int8_ms"]
+    report["drift_pct"] = 100 * (report["int8_prediction"] - report["float_prediction"]) / report["float_prediction"]
+    return report
+
+
+@click.command()
+@click.option("--coins", default="btc", help="Comma separated coins to compare, e.g. btc,eth,sol")
+@click.option("--repeat", default=20, help="Time the median of this many predictions of each model")
+@click.option("--output", default=None, help="Also write the report to this csv")
+def main(coins: str, repeat: int, output: Optional[str]) -> None:
+    """
+    Latency and prediction drift of the int8 quantized models (quantize_inference) against the float ones, for
+    each coin, next to the change in the stacking prediction. Run from the repo root with the configs and csvs in
+    tmp/. Trains the models, nothing in tmp/ is changed
+    """
+    constants = read_in_yaml("tmp/constants.yml", False)
+    ml_constants = read_in_yaml(constants["ml_config_filename"], False)
+    # no warm start checkpoints or exported models left behind, both models are exported here
+    ml_constants["prediction_params"].update(
+        {"warm_start": False, "inference_backend": "darts", "quantize_inference": False}
+    )
+    price_data = LazyPriceData(constants, False)
+
+    with tempfile.TemporaryDirectory() as directory:
+        report = pd.concat(
+            [
+                compare_coin(coin.strip(), constants, ml_constants, price_data, directory, repeat)
+                for coin in coins.split(",")
+            ],
+            ignore_index=True,
+        )
+    logging.info(f"Int8 against float inference\n{report.to_string(index=False)}")
+    if output:
+        report.to_csv(output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
 from datetime import datetime, timedelta
-from typing import Any, Dict
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import pytest
 from freezegun import freeze_time
 
 from app.mlcode.utils import read_in_yaml
 
+if TYPE_CHECKING:  # darts is only imported by the tests that train
+    from darts import TimeSeries
+    from darts.models import NBEATSModel
+
+    from app.mlcode.predict_price_movements import CoinPricePredictor
+
 # csv for predictions
 
 
@@ -294,3 +301,79 @@ def example_eth_df() -> pd.DataFrame:
         }
     )
     return df.set_index("date")
+
+
+# darts series and models
+
+
+@pytest.fixture
+def make_darts_series() -> Callable[..., Tuple["TimeSeries", "TimeSeries"]]:
+    """A random walk close series and two random covariates over n_days"""
+
+    def _make_darts_series(n_days: int = 60, seed: int = 0) -> Tuple["TimeSeries", "TimeSeries"]:
+        from darts import TimeSeries
+
+        index = pd.date_range("2022-01-01", periods=n_days, name="date")
+        rng = np.random.default_rng(seed)
+        series = TimeSeries.from_times_and_values(index, 100 + np.cumsum(rng.normal(0, 1, n_days)), columns=["close"])
+        covariates = TimeSeries.from_times_and_values(index, rng.random((n_days, 2)), columns=["rsi", "macd"])
+        return series, covariates
+
+    return _make_darts_series
+
+
+@pytest.fixture
+def make_nbeats_model() -> Callable[..., "NBEATSModel"]:
+    """A small untrained NBEATS, quick enough to fit in a test"""
+
+    def _make_nbeats_model(model_name: str, input_chunk_length: int = 5, output_chunk_length: int = 2) -> "NBEATSModel":
+        from darts.models import NBEATSModel
+
+        return NBEATSModel(
+            input_chunk_length=input_chunk_length,
+            output_chunk_length=output_chunk_length,
+            num_blocks=1,
+            layer_widths=8,
+            random_state=432,
+            model_name=model_name,
+            force_reset=True,
+            log_tensorboard=False,
+            work_dir="/tmp",
+            save_checkpoints=False,
+        )
+
+    return _make_nbeats_model
+
+
+@pytest.fixture
+def make_predictor(
+    example_btc_df: pd.DataFrame, example_eth_df: pd.DataFrame, constants: Dict[str, Any], ml_config: Dict[str, Any]
+) -> Callable[..., Tuple["CoinPricePredictor", "TimeSeries", "TimeSeries"]]:
+    """
+    A predictor with eth as its covariate, its close series and covariates built and its models created, ready to
+    train. btc's example prices unless input_df, keyword arguments go to CoinPricePredictor
+    """
+
+    def _make_predictor(
+        coin_to_predict: str = "btc",
+        input_df: Optional[pd.DataFrame] = None,
+        ml_constants: Optional[Dict[str, Any]] = None,
+        all_predictions_filename: str = "unused.csv",
+        **kwargs: Any,
+    ) -> Tuple["CoinPricePredictor", "TimeSeries", "TimeSeries"]:
+        from app.mlcode.predict_price_movements import CoinPricePredictor
+
+        predictor = CoinPricePredictor(
+            coin_to_predict,
+            constants,
+            ml_config if ml_constants is None else ml_constants,
+            (example_btc_df if input_df is None else input_df).copy(),
+            all_predictions_filename=all_predictions_filename,
+            additional_dfs=[example_eth_df.copy()],
+            **kwargs,
+        )
+        train_close_series, ts_stacked_series = predictor.build_series()
+        predictor._create_models()
+        return predictor, train_close_series, ts_stacked_series
+
+    return _make_predictor
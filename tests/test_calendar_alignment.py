@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.mlcode.calendar_alignment import align_to_daily_calendar
+
+
+def _prices(dates: pd.DatetimeIndex) -> pd.DataFrame:
+    return pd.DataFrame(
+        {"close": np.arange(len(dates), dtype=float), "volume": np.arange(len(dates)) * 10},
+        index=pd.DatetimeIndex(dates, name="date"),
+    )
+
+
+def test_align_to_daily_calendar_fills_weekends_and_reports_them() -> None:
+    crypto_df = _prices(pd.date_range("2022-01-01", "2022-01-16"))  # Saturday to Sunday
+    tbt_df = _prices(pd.bdate_range("2022-01-03", "2022-01-14"))  # weekdays only
+
+    (aligned_crypto_df, aligned_tbt_df), report = align_to_daily_calendar([crypto_df, tbt_df], ["btc", "tbt"])
+
+    pd.testing.assert_frame_equal(aligned_crypto_df, crypto_df)
+    assert aligned_tbt_df.index.equals(crypto_df.index)
+    assert not aligned_tbt_df.isna().any().any()
+    # weekends carry Friday forward, the first weekend is back filled from Monday
+    assert aligned_tbt_df.loc["2022-01-08", "close"] == tbt_df.loc["2022-01-07", "close"]
+    assert aligned_tbt_df.loc["2022-01-01", "close"] == tbt_df.loc["2022-01-03", "close"]
+    assert aligned_tbt_df.loc["2022-01-16", "close"] == tbt_df.loc["2022-01-14", "close"]
+
+    assert report["btc"] == {"filled_days": 0, "gaps": []}
+    assert report["tbt"]["filled_days"] == 6
+    assert report["tbt"]["gaps"] == [
+        ("2022-01-01", "2022-01-02"),
+        ("2022-01-08", "2022-01-09"),
+        ("2022-01-15", "2022-01-16"),
+    ]
+
+
+def test_align_to_daily_calendar_needs_daily_dates() -> None:
+    hourly_df = _prices(pd.date_range("2022-01-01", periods=5, freq="H"))
+    with pytest.raises(ValueError, match="daily DatetimeIndex"):
+        align_to_daily_calendar([hourly_df], ["btc"])
@@ -7,10 +7,17 @@ import pandas as pd
 
 from app.mlcode.determine_trading_state import DetermineTradingState
 from app.mlcode.predict_price_movements import CoinPricePredictor
+from app.mlcode.prediction_store import PredictionStore, prediction_log_filename
 
 os.environ["ON_LOCAL"] = "True"
 
 
+def _saved_predictions(all_predictions_csv: str) -> pd.DataFrame:
+    predictions_df = PredictionStore(all_predictions_csv, "date", False).read().reset_index()
+    assert len(predictions_df) == len(pd.read_csv(all_predictions_csv)) + 1  # today's row went to the log
+    return predictions_df
+
+
 def test_no_btc_action(
     example_btc_df: pd.DataFrame,
     example_eth_df: pd.DataFrame,
@@ -55,7 +62,7 @@ def test_no_btc_action(
     # assert our predictions have been saved
     # assert the the cols and LEN are the same. Vals wil be different
 
-    original_predictions_df = pd.read_csv(btc_all_predictions_csv)
+    original_predictions_df = _saved_predictions(btc_all_predictions_csv)
 
     assert set(btc_updated_predictions_df.columns) == set(original_predictions_df.columns)
     assert np.max([len(col) for col in btc_updated_predictions_df.columns]) == np.max(
@@ -64,6 +71,7 @@ def test_no_btc_action(
     # post-test clean up. revert the updated .csv to the original. kinda jank
     original_df = pd.read_csv("tests/configs/btc_all_predictions_original.csv")
     original_df.to_csv(btc_all_predictions_csv, index=False)
+    os.remove(prediction_log_filename(btc_all_predictions_csv))
 
 
 def test_no_sol_action(
@@ -109,7 +117,7 @@ def test_no_sol_action(
 
     assert sol_trading_state_config == trading_state_class.trading_state_constants
 
-    original_predictions_df = pd.read_csv(sol_all_predictions_csv)
+    original_predictions_df = _saved_predictions(sol_all_predictions_csv)
 
     assert set(sol_updated_predictions_df.columns) == set(original_predictions_df.columns)
     assert np.max([len(col) for col in sol_updated_predictions_df.columns]) == np.max(
@@ -118,6 +126,7 @@ def test_no_sol_action(
     # post-test clean up. revert the updated .csv to the original. kinda jank
     original_df = pd.read_csv("tests/configs/sol_all_predictions_original.csv")
     original_df.to_csv(sol_all_predictions_csv, index=False)
+    os.remove(prediction_log_filename(sol_all_predictions_csv))
 
 
 def test_no_eth_action(
@@ -163,7 +172,7 @@ def test_no_eth_action(
 
     assert eth_trading_state_config == trading_state_class.trading_state_constants
     # assert predictions writing
-    original_predictions_df = pd.read_csv(eth_all_predictions_csv)
+    original_predictions_df = _saved_predictions(eth_all_predictions_csv)
 
     assert set(eth_updated_predictions_df.columns) == set(original_predictions_df.columns)
     assert np.max([len(col) for col in eth_updated_predictions_df.columns]) == np.max(
@@ -172,6 +181,7 @@ def test_no_eth_action(
     # post-test clean up. revert the updated .csv to the original. kinda jank
     original_df = pd.read_csv("tests/configs/eth_all_predictions_original.csv")
     original_df.to_csv(eth_all_predictions_csv, index=False)
+    os.remove(prediction_log_filename(eth_all_predictions_csv))
 
 
 def test_buy_btc_action(
@@ -228,7 +238,7 @@ def test_buy_btc_action(
     # assert our predictions have been saved
     # assert the the cols and LEN are the same. Vals wil be different
 
-    updated_predictions_df = pd.read_csv(btc_all_predictions_csv)
+    updated_predictions_df = _saved_predictions(btc_all_predictions_csv)
 
     assert set(btc_updated_predictions_df.columns) == set(updated_predictions_df.columns)
     assert np.max([len(col) for col in btc_updated_predictions_df.columns]) == np.max(
@@ -238,6 +248,7 @@ def test_buy_btc_action(
     original_df = pd.read_csv("tests/configs/btc_all_predictions_original.csv")
 
     original_df.to_csv(btc_all_predictions_csv, index=False)
+    os.remove(prediction_log_filename(btc_all_predictions_csv))
 
 
 # # def test_short_btc_action(
@@ -345,7 +356,7 @@ def test_buy_to_none_via_prediction_btc(
     # assert our predictions have been saved
     # assert the the cols and LEN are the same. Vals wil be different
 
-    updated_predictions_df = pd.read_csv(btc_all_predictions_csv)
+    updated_predictions_df = _saved_predictions(btc_all_predictions_csv)
 
     assert set(btc_updated_predictions_df.columns) == set(updated_predictions_df.columns)
     assert np.max([len(col) for col in btc_updated_predictions_df.columns]) == np.max(
@@ -355,6 +366,7 @@ def test_buy_to_none_via_prediction_btc(
     original_df = pd.read_csv("tests/configs/btc_all_predictions_original.csv")
     # overwrite the updated with the original for future tests
     original_df.to_csv(btc_all_predictions_csv, index=False)
+    os.remove(prediction_log_filename(btc_all_predictions_csv))
 
 
 # # TODO: uncomment once FTX.US supports short tokens
@@ -0,0 +1,88 @@
+import json
+import os
+import time
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.mlcode.feature_store import FeatureStore, open_feature_store
+
+
+def _features(n_rows: int) -> pd.DataFrame:
+    return pd.DataFrame({"rsi": np.arange(n_rows, dtype=float)}, index=pd.date_range("2022-01-01", periods=n_rows))
+
+
+def test_feature_store_keeps_entries_between_runs(tmp_path: str) -> None:
+    FeatureStore(str(tmp_path))["indicators_abc_window_5"] = _features(10)
+
+    next_run = FeatureStore(str(tmp_path))
+    assert "indicators_abc_window_5" in next_run
+    assert "indicators_xyz_window_5" not in next_run
+    pd.testing.assert_frame_equal(next_run["indicators_abc_window_5"], _features(10))
+    assert list(next_run) == ["indicators_abc_window_5"]
+
+    del next_run["indicators_abc_window_5"]
+    assert len(FeatureStore(str(tmp_path))) == 0
+    with pytest.raises(KeyError):
+        next_run["indicators_abc_window_5"]
+
+
+def test_feature_store_evicts_least_recently_used(tmp_path: str) -> None:
+    store = FeatureStore(str(tmp_path), max_size_mb=0.04)  # room for two of the ~17kb entries
+    store["first"] = _features(1000)
+    time.sleep(0.01)
+    store["second"] = _features(1000)
+    time.sleep(0.01)
+    store["first"]  # used again, second is now the oldest
+    time.sleep(0.01)
+    store["third"] = _features(1000)
+
+    assert list(store) == ["first", "third"]
+    assert store.evictions == 1
+    assert 0 < store.size_bytes() <= store.max_size_bytes
+
+
+def test_feature_store_drops_unreadable_entries(tmp_path: str) -> None:
+    with open(os.path.join(tmp_path, "half_written.features.pkl"), "wb") as f:
+        f.write(b"not a pickle")
+    store = FeatureStore(str(tmp_path))
+    with pytest.raises(KeyError):
+        store["half_written"]
+    assert "half_written" not in store
+
+    with pytest.raises(ValueError, match="keys can only have"):
+        store["../constants.yml"] = _features(1)
+
+
+def test_open_feature_store_falls_back_to_memory(tmp_path: str) -> None:
+    assert open_feature_store({}, False) == {}
+    store = open_feature_store({"feature_store_dir": os.path.join(tmp_path, "features")}, False)
+    assert isinstance(store, FeatureStore)
+    assert os.path.isdir(store.directory)
+
+
+def test_run_metrics_have_the_feature_store_evictions(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    from app.mlcode import main
+
+    store = FeatureStore(os.path.join(tmp_path, "features"), max_size_mb=0.04)
+    for key in ["earlier_coin_1", "earlier_coin_2", "earlier_coin_3"]:  # one eviction before this coin's run
+        store[key] = _features(1000)
+        time.sleep(0.01)
+
+    def _predict_and_update_state(coin_to_predict: str, *args: Any) -> float:
+        for key in ["first", "second"]:  # evict the earlier coin's entries
+            store[key] = _features(1000)
+            time.sleep(0.01)
+        return 1000.0
+
+    monkeypatch.setattr(main, "_predict_and_update_state", _predict_and_update_state)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("tmp")
+    main.run_coin_prediction("btc", {"run_metrics_filename": "tmp/run_metrics.jsonl"}, {}, None, False, store)
+
+    with open("tmp/btc_run_metrics.jsonl") as f:
+        feature_cache = json.loads(f.readline())["feature_cache"]
+    assert store.evictions == 3 and feature_cache["evictions"] == 2
+    assert feature_cache["size_mb"] == round(store.size_bytes() / 1024**2, 2)
@@ -0,0 +1,45 @@
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, Tuple
+
+import pandas as pd
+
+from app.mlcode.global_models import GlobalModels
+from app.mlcode.instrumentation import RunMetrics
+from app.mlcode.predict_price_movements import CoinPricePredictor
+
+if TYPE_CHECKING:
+    from darts import TimeSeries
+
+os.environ["ON_LOCAL"] = "True"
+
+
+def test_global_models_predict_each_coin_in_its_prices(
+    example_btc_df: pd.DataFrame,
+    constants: Dict[Any, Any],
+    ml_config: Dict[Any, Any],
+    make_predictor: Callable[..., Tuple[CoinPricePredictor, "TimeSeries", "TimeSeries"]],
+) -> None:
+    # sol trades at a hundredth of btc
+    sol_df = example_btc_df.copy()
+    sol_df[["open", "high", "low", "close"]] /= 100
+    predictors: Dict[str, CoinPricePredictor] = {}
+    coin_series: Dict[str, Tuple["TimeSeries", "TimeSeries"]] = {}
+    for coin, df in [("btc", example_btc_df), ("sol", sol_df)]:
+        predictor, train_close_series, ts_stacked_series = make_predictor(coin, input_df=df)
+        predictors[coin], coin_series[coin] = predictor, (train_close_series, ts_stacked_series)
+
+    global_models = GlobalModels(constants, ml_config, n_additional_dfs=1)
+    run_metrics = RunMetrics("global")
+    global_models.train(list(coin_series.values()), run_metrics)
+    # one nbeats and one tcn per lookback, not per coin
+    assert len(global_models.model_names) == 2 * len(ml_config["prediction_params"]["lookback_window"])
+    assert run_metrics.extra["global_models"]["coins"] == 2
+
+    predictions = {
+        coin: predictors[coin]._predict_with_global_models(global_models, train_close_series, ts_stacked_series)
+        for coin, (train_close_series, ts_stacked_series) in coin_series.items()
+    }
+    assert list(predictions["btc"]) == list(predictions["sol"]) == global_models.model_names
+    # the same series in another currency, each coin is scaled on its own so the models can't tell them apart
+    for model_name in global_models.model_names:
+        assert abs(predictions["btc"][model_name] / predictions["sol"][model_name] - 100) < 1e-3
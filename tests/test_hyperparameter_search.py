@@ -0,0 +1,91 @@
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.mlcode.hyperparameter_search import (
+    expand_search_space,
+    rank_trials,
+    score_folds,
+    trial_config,
+    walk_forward_cutoffs,
+)
+
+
+def test_search_space_expands_to_every_combination(ml_config: Dict[Any, Any]) -> None:
+    search_space = {
+        "prediction_params": {"lookback_window": [[2], [2, 3]]},
+        "hyperparameters_nbeats": {"layer_widths": [8, 16]},
+        "hyperparameters_random_forest": {"n_estimators": [5]},
+    }
+    trials = expand_search_space(ml_config, search_space)
+    assert len(trials) == 4
+    assert trials[0] == {
+        "prediction_params": {"lookback_window": [2]},
+        "hyperparameters_nbeats": {"layer_widths": 8},
+        "hyperparameters_random_forest": {"n_estimators": 5},
+    }
+    assert len(expand_search_space(ml_config, search_space, max_trials=3)) == 3
+
+    config = trial_config(ml_config, trials[-1])
+    assert config["prediction_params"]["lookback_window"] == [2, 3]
+    assert config["prediction_params"]["training_backend"] == "threads"  # the trials are the processes
+    assert config["prediction_params"]["streaming_indicators"] is False
+    assert ml_config["prediction_params"]["lookback_window"] == [2]  # the base config is left alone
+
+    with pytest.raises(ValueError):
+        expand_search_space(ml_config, {"hyperparameters_nbeats": {"layer_width": [8]}})  # typo
+    with pytest.raises(ValueError):
+        expand_search_space(ml_config, {"constants": {"close_col": ["close"]}})
+
+
+def test_walk_forward_scores_stack_on_known_folds_only() -> None:
+    dates = pd.date_range("2022-01-01", periods=60)
+    cutoffs = walk_forward_cutoffs(dates, prediction_n_days=7, folds=6, step_days=7)
+    assert cutoffs[-1] == dates[-8] and cutoffs[0] == dates[-43]
+    with pytest.raises(ValueError):
+        walk_forward_cutoffs(dates, prediction_n_days=7, folds=10, step_days=7)
+
+    actual = np.array([100.0, 110.0, 120.0, 130.0, 140.0, 150.0])
+    folds = [
+        {
+            "cutoff": str(cutoff),
+            "target_date": str(cutoff + pd.Timedelta(days=7)),
+            "actual": close,
+            # one model always 10% high, the other always 10% low
+            "predictions": {"high": close * 1.1, "low": close * 0.9},
+        }
+        for cutoff, close in zip(cutoffs, actual)
+    ]
+    scores = score_folds(folds, n_estimators=5)
+    assert scores["mean_mape"] == pytest.approx(0.0)
+    assert scores["best_model_mape"] == pytest.approx(10.0)
+    # the 4th fold is the first with 3 earlier folds whose close is known by its cutoff
+    assert scores["stacking_folds"] == 3
+
+
+def test_a_failed_trial_is_ranked_last() -> None:
+    def _row(trial: int, coin: str, mape: float, error: Optional[str] = None) -> Dict[str, Any]:
+        scores = {"mean_mape": mape, "best_model_mape": mape, "stacking_mape": np.nan, "stacking_folds": 0}
+        return {
+            "trial": trial,
+            "coin": coin,
+            "hyperparameters_nbeats.layer_widths": 8 * (trial + 1),
+            **scores,
+            "error": error,
+        }
+
+    results = pd.DataFrame(
+        [
+            _row(0, "btc", 1.0),
+            _row(0, "eth", np.nan, "ValueError: too short"),
+            _row(1, "btc", 3.0),
+            _row(1, "eth", 5.0),
+        ]
+    )
+    table = rank_trials(results)
+    assert list(table["trial"]) == [1, 0]
+    assert table["score"].iloc[0] == 4.0 and np.isnan(table["score"].iloc[1])  # not scored on btc alone
+    assert list(table["failed"]) == ["", "eth"]
+    assert table["btc_score"].iloc[1] == 1.0
@@ -0,0 +1,17 @@
+import subprocess
+import sys
+
+from scripts.import_time_report import HEAVY_PACKAGES
+
+
+def test_entry_point_skips_heavy_imports() -> None:
+    """main.py should start reading configs and csvs without paying for darts, torch, finta or sklearn.
+    The import time itself is left to make import_time_report, it depends on the machine"""
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, app.mlcode.main; print(' '.join(sys.modules))"],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    imported_packages = {module.split(".")[0] for module in result.stdout.split()}
+    assert imported_packages.isdisjoint(HEAVY_PACKAGES)
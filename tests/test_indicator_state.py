@@ -0,0 +1,173 @@
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from app.mlcode.indicator_state import StreamingIndicators, indicator_state_filename
+from app.mlcode.indicators import compute_indicators, stack_assets
+
+os.environ["ON_LOCAL"] = "True"
+
+
+def _prices(n_days: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 1000 + np.cumsum(rng.normal(0, 10, n_days))
+    return pd.DataFrame(
+        {"close": close, "high": close + rng.random(n_days) * 5, "low": close - rng.random(n_days) * 5},
+        index=pd.date_range("2020-01-01", periods=n_days, name="date"),
+    )
+
+
+def _batch(dfs: List[pd.DataFrame]) -> List[Dict[str, np.ndarray]]:
+    indicators = compute_indicators(*[stack_assets([df[col] for df in dfs]) for col in dfs[0].columns], 5, 1.25)
+    return [{name: values[i, -len(df) :] for name, values in indicators.items()} for i, df in enumerate(dfs)]
+
+
+def _assert_same(streamed: List[Dict[str, np.ndarray]], expected: List[Dict[str, np.ndarray]]) -> None:
+    for streamed_indicators, expected_indicators in zip(streamed, expected):
+        assert list(streamed_indicators) == list(expected_indicators)
+        for name in expected_indicators:
+            np.testing.assert_allclose(
+                streamed_indicators[name], expected_indicators[name], rtol=1e-9, atol=1e-9, err_msg=name
+            )
+
+
+def test_streaming_indicators_only_compute_appended_rows(tmp_path: str) -> None:
+    btc_df, tbt_df = _prices(400, seed=1), _prices(300, seed=2)
+    state_filenames = [os.path.join(tmp_path, "btc.indicator_state.npz"), os.path.join(tmp_path, "tbt.npz")]
+
+    first = StreamingIndicators(5, 1.25)
+    first_dfs = [btc_df.iloc[:390], tbt_df.iloc[:299]]
+    _assert_same(first.build(first_dfs, state_filenames), _batch(first_dfs))
+    assert first.report == {
+        "btc.indicator_state.npz": {"new_rows": 390, "rebuilt": True},
+        "tbt.npz": {"new_rows": 299, "rebuilt": True},
+    }
+
+    second = StreamingIndicators(5, 1.25)
+    streamed = second.build([btc_df, tbt_df], state_filenames)
+    assert second.report == {
+        "btc.indicator_state.npz": {"new_rows": 10, "rebuilt": False},
+        "tbt.npz": {"new_rows": 1, "rebuilt": False},
+    }
+    _assert_same(streamed, _batch([btc_df, tbt_df]))
+
+    # the window moved forward a day, the EMAs start a day later so it's a rebuild
+    third = StreamingIndicators(5, 1.25)
+    streamed = third.build([btc_df.iloc[1:], tbt_df], state_filenames)
+    assert third.report == {
+        "btc.indicator_state.npz": {"new_rows": 399, "rebuilt": True},
+        "tbt.npz": {"new_rows": 0, "rebuilt": False},
+    }
+    _assert_same(streamed, _batch([btc_df.iloc[1:], tbt_df]))
+
+
+def test_streaming_indicators_rebuild_when_rows_change(tmp_path: str) -> None:
+    df = _prices(200, seed=3)
+    state_filenames = [os.path.join(tmp_path, "eth.indicator_state.npz")]
+    StreamingIndicators(5, 1.25).build([df.iloc[:150]], state_filenames)
+
+    rewritten_df = df.copy()
+    rewritten_df.iloc[100, 0] += 1  # a candle was corrected
+    streaming_indicators = StreamingIndicators(5, 1.25)
+    _assert_same(streaming_indicators.build([rewritten_df], state_filenames), _batch([rewritten_df]))
+    assert streaming_indicators.report["eth.indicator_state.npz"]["rebuilt"]
+
+    other_params = StreamingIndicators(10, 1.25)
+    other_params.build([rewritten_df], state_filenames)
+    assert other_params.report["eth.indicator_state.npz"] == {"new_rows": 200, "rebuilt": True}
+
+    with open(state_filenames[0], "wb") as f:
+        f.write(b"half written")
+    corrupt = StreamingIndicators(10, 1.25)
+    corrupt.build([rewritten_df], state_filenames)
+    assert corrupt.report["eth.indicator_state.npz"]["rebuilt"]
+
+
+def test_indicator_state_filename_sits_next_to_the_csv(tmp_path: str) -> None:
+    # no csv in the name, the go app would upload it
+    start = pd.Timestamp("2022-01-02")
+    assert (
+        indicator_state_filename("/tmp/historical_btc.csv", start) == "/tmp/historical_btc.20220102.indicator_state.npz"
+    )
+
+    # another coin's start is kept, yesterday's start of a moving window goes once it's old
+    df = _prices(50, seed=4)
+    csv_filename = os.path.join(tmp_path, "historical_btc.csv")
+    other_start, stale_start = [indicator_state_filename(csv_filename, df.index[i]) for i in (5, 1)]
+    StreamingIndicators(5, 1.25).build([df.iloc[5:], df.iloc[1:]], [other_start, stale_start])
+    os.utime(stale_start, (0, 0))
+    current = indicator_state_filename(csv_filename, df.index[2])
+    StreamingIndicators(5, 1.25).build([df.iloc[2:]], [current])
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(name) for name in [current, other_start])
+
+
+def test_consecutive_daily_runs_carry_on_from_the_snapshot(
+    tmp_path: str, constants: Dict[str, Any], ml_config: Dict[str, Any]
+) -> None:
+    from app.mlcode.predict_price_movements import CoinPricePredictor
+
+    ml_config["prediction_params"]["streaming_indicators"] = True
+    # four years of candles, more than the three year filter, so the sliced first row moves every day
+    csv_keys = ["bitcoin_csv_filename", "etherum_csv_filename", "tbt_csv_filename"]
+    constants = {**constants, **{key: os.path.join(tmp_path, f"{key}.csv") for key in csv_keys}}
+    dfs = []
+    for seed in range(3):
+        df = _prices(4 * 365 + 2, seed=seed)
+        dfs.append(df.assign(open=df["close"], volume=1000.0))
+
+    def _daily_run(n_days: int) -> CoinPricePredictor:
+        day_dfs = [df.iloc[:n_days].copy() for df in dfs]
+        predictor = CoinPricePredictor(
+            "btc",
+            constants,
+            ml_config,
+            day_dfs[0],
+            all_predictions_filename=os.path.join(tmp_path, "btc_all_predictions.csv"),
+            additional_dfs=day_dfs[1:],
+        )
+        predictor._slice_and_build_indicators()
+        return predictor
+
+    yesterday, today = _daily_run(4 * 365 + 1), _daily_run(4 * 365 + 2)
+    assert today.df.index.min() > yesterday.df.index.min()
+    assert {report["rebuilt"] for report in yesterday.run_metrics.extra["streaming_indicators"].values()} == {True}
+    assert list(today.run_metrics.extra["streaming_indicators"].values()) == [{"new_rows": 1, "rebuilt": False}] * 3
+    assert len(os.listdir(tmp_path)) == 3  # one snapshot per csv, not one a day
+
+
+def test_coins_sharing_price_data_reuse_the_streamed_indicators(
+    tmp_path: str, constants: Dict[str, Any], ml_config: Dict[str, Any]
+) -> None:
+    from app.mlcode.coin_registry import LazyPriceData
+    from app.mlcode.predict_price_movements import CoinPricePredictor
+
+    ml_config["prediction_params"]["streaming_indicators"] = True
+    csv_keys = ["bitcoin_csv_filename", "etherum_csv_filename", "tbt_csv_filename"]
+    constants = {**constants, **{key: os.path.join(tmp_path, f"{key}.csv") for key in csv_keys}}
+    for seed, csv_key in enumerate(csv_keys):
+        df = _prices(500, seed=seed)
+        df.assign(open=df["close"], volume=1000.0).to_csv(constants[csv_key])
+    price_data = LazyPriceData(constants, running_on_aws=False)
+    feature_cache: Dict[str, Any] = {}
+
+    def _run(coin: str) -> CoinPricePredictor:
+        predictor = CoinPricePredictor(
+            coin,
+            constants,
+            ml_config,
+            price_data.get_input_df(coin),
+            all_predictions_filename=os.path.join(tmp_path, f"{coin}_all_predictions.csv"),
+            additional_dfs=price_data.get_additional_dfs(coin),
+            feature_cache=feature_cache,
+        )
+        predictor._slice_and_build_indicators()
+        return predictor
+
+    columns = {csv_key: list(price_data.get(csv_key).columns) for csv_key in csv_keys}
+    btc, eth = _run("btc"), _run("eth")
+    assert btc.run_metrics.extra["feature_cache"] == {"hits": 0, "misses": 3}
+    assert eth.run_metrics.extra["feature_cache"] == {"hits": 3, "misses": 0}
+    assert {csv_key: list(price_data.get(csv_key).columns) for csv_key in csv_keys} == columns
+    assert constants["rolling_mean_col"] in eth.df.columns
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+from finta import TA
+
+from app.mlcode.indicators import compute_indicators, ewm_mean, stack_assets
+
+
+def _prices(n_days: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 1000 + np.cumsum(rng.normal(0, 10, n_days))
+    return pd.DataFrame(
+        {
+            "open": close + rng.normal(0, 1, n_days),
+            "high": close + rng.random(n_days) * 5,
+            "low": close - rng.random(n_days) * 5,
+            "close": close,
+        },
+        index=pd.date_range("2015-01-01", periods=n_days, name="date"),
+    )
+
+
+def test_compute_indicators_matches_finta_for_every_asset() -> None:
+    # different lengths, like a coin and its weekday only covariate
+    dfs = [_prices(2000, seed=1), _prices(1400, seed=2), _prices(60, seed=3)]
+    window, no_of_std = 20, 1.5
+
+    indicators = compute_indicators(
+        stack_assets([df["close"] for df in dfs]),
+        stack_assets([df["high"] for df in dfs]),
+        stack_assets([df["low"] for df in dfs]),
+        window=window,
+        no_of_std=no_of_std,
+    )
+
+    for i, df in enumerate(dfs):
+        rolling_mean = df["close"].rolling(window).mean()
+        rolling_std = df["close"].rolling(window).std()
+        macd_df = TA.MACD(df)
+        expected = {
+            "rolling_mean": rolling_mean,
+            "bollinger_high": rolling_mean + rolling_std * no_of_std,
+            "bollinger_low": rolling_mean - rolling_std * no_of_std,
+            "stc": TA.STC(df),
+            "stoch": TA.STOCH(df),
+            "rsi": TA.RSI(df, period=window),
+            "macd": macd_df["MACD"],
+            "macd_signal": macd_df["SIGNAL"],
+        }
+        assert list(indicators) == list(expected)
+        for name, expected_series in expected.items():
+            np.testing.assert_allclose(
+                indicators[name][i, -len(df) :], expected_series.to_numpy(), rtol=1e-8, atol=1e-8, err_msg=name
+            )
+
+
+def test_ewm_mean_matches_pandas_with_missing_values_and_long_histories() -> None:
+    values = np.array([np.nan, 1.0, 2.0, np.nan, 4.0, 5.0, np.nan, np.nan, 8.0])
+    np.testing.assert_allclose(ewm_mean(values, span=3), pd.Series(values).ewm(span=3).mean().to_numpy())
+
+    # long enough that the weights are rescaled block by block
+    long_values = _prices(20000, seed=4)["close"]
+    np.testing.assert_allclose(
+        ewm_mean(long_values.to_numpy(), alpha=0.5), long_values.ewm(alpha=0.5).mean().to_numpy(), rtol=1e-10
+    )
+
+
+def test_ewm_mean_needs_span_or_alpha() -> None:
+    with pytest.raises(ValueError, match="one of span or alpha"):
+        ewm_mean(np.ones(3))
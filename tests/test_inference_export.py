@@ -0,0 +1,106 @@
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, Tuple
+
+import numpy as np
+import pytest
+
+from app.mlcode.inference_export import (
+    export_model,
+    exported_model_filename,
+    load_exported_model,
+    quantization_skip_reason,
+)
+from app.mlcode.predict_price_movements import CoinPricePredictor
+
+if TYPE_CHECKING:
+    from darts import TimeSeries
+    from darts.models import NBEATSModel
+
+os.environ["ON_LOCAL"] = "True"
+
+
+def _models(make_nbeats_model: Callable[..., "NBEATSModel"]) -> list:
+    from darts.models import TCNModel
+
+    return [
+        make_nbeats_model("export_test_nbeats", input_chunk_length=6, output_chunk_length=3),
+        TCNModel(
+            input_chunk_length=6,
+            output_chunk_length=3,
+            kernel_size=3,
+            num_filters=2,
+            dropout=0.1,
+            random_state=432,
+            model_name="export_test_tcn",
+            force_reset=True,
+            work_dir="/tmp",
+        ),
+    ]
+
+
+def test_exported_models_predict_what_darts_predicts(
+    tmp_path: str,
+    make_darts_series: Callable[..., Tuple["TimeSeries", "TimeSeries"]],
+    make_nbeats_model: Callable[..., "NBEATSModel"],
+) -> None:
+    series, covariates = make_darts_series()
+    for model in _models(make_nbeats_model):
+        model.fit(series=series, past_covariates=[covariates], epochs=2)
+        filename = exported_model_filename(str(tmp_path), model.model_name)
+        assert filename.endswith(".torchscript.pt")  # no csv or yml, the go app would upload it
+        export_model(filename, model, params_hash="abc")
+
+        exported = load_exported_model(filename, params_hash="abc")
+        assert exported is not None
+        assert load_exported_model(filename, params_hash="other") is None
+
+        expected = model.predict(n=3, series=series, past_covariates=[covariates]).values()
+        predicted = exported.predict(series.values(), covariates.values(), n=3)
+        np.testing.assert_allclose(predicted, expected, rtol=1e-6)
+
+        with pytest.raises(ValueError):
+            exported.predict(series.values(), covariates.values(), n=4)
+
+
+def test_predictor_predicts_through_the_exported_models(
+    tmp_path: str,
+    ml_config: Dict[Any, Any],
+    make_predictor: Callable[..., Tuple[CoinPricePredictor, "TimeSeries", "TimeSeries"]],
+) -> None:
+    ml_config["prediction_params"]["inference_backend"] = "torchscript"
+    ml_config["prediction_params"]["exported_models_dir"] = str(tmp_path)
+    predictor, train_close_series, ts_stacked_series = make_predictor()
+    predictor._train_models(train_close_series, ts_stacked_series)
+    model_names = [model.model_name for lookback_window_models in predictor.models for model in lookback_window_models]
+    assert sorted(predictor.exported_models) == sorted(model_names)
+
+    exported_predictions = predictor._make_base_predictions_dict(train_close_series, ts_stacked_series)
+    predictor.exported_models = {}
+    darts_predictions = predictor._make_base_predictions_dict(train_close_series, ts_stacked_series)
+    assert list(exported_predictions) == list(darts_predictions)
+    for model_name, prediction in darts_predictions.items():
+        assert exported_predictions[model_name] == pytest.approx(prediction, rel=1e-6)
+
+
+def test_only_nbeats_is_quantized(
+    tmp_path: str,
+    make_darts_series: Callable[..., Tuple["TimeSeries", "TimeSeries"]],
+    make_nbeats_model: Callable[..., "NBEATSModel"],
+) -> None:
+    series, covariates = make_darts_series()
+    nbeats, tcn = _models(make_nbeats_model)
+    for model in [nbeats, tcn]:
+        model.fit(series=series, past_covariates=[covariates], epochs=2)
+
+    assert quantization_skip_reason(nbeats) is None
+    filename = exported_model_filename(str(tmp_path), nbeats.model_name, quantized=True)
+    assert filename.endswith(".int8.torchscript.pt")
+    quantized = export_model(filename, nbeats, params_hash="abc", quantize=True)
+    assert quantized is not None and quantized.meta["quantized"]
+    expected = nbeats.predict(n=3, series=series, past_covariates=[covariates]).values()
+    # int8 weights drift a little, well under 1% of the ~100 price
+    np.testing.assert_allclose(quantized.predict(series.values(), covariates.values(), n=3), expected, atol=1.0)
+
+    assert "convolutions" in quantization_skip_reason(tcn)
+    with pytest.raises(ValueError):
+        export_model(exported_model_filename(str(tmp_path), tcn.model_name, quantized=True), tcn, "abc", quantize=True)
@@ -0,0 +1,35 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.mlcode.inference_pool import get_inference_pool, predict_concurrently
+
+
+def test_models_predict_at_once_in_their_order() -> None:
+    models = [SimpleNamespace(model_name=f"model_{i}", prediction=float(i)) for i in range(4)]
+
+    # one after another, the first model would wait at the barrier until it times out and breaks
+    all_predicting = threading.Barrier(len(models), timeout=10)
+    others_done = threading.Semaphore(0)
+
+    def _predict(model: SimpleNamespace) -> float:
+        all_predicting.wait()
+        if model.model_name == "model_0":  # the first finishes last
+            for _ in models[1:]:
+                assert others_done.acquire(timeout=10)
+        else:
+            others_done.release()
+        return model.prediction
+
+    predictions = predict_concurrently(get_inference_pool(4), models, _predict)
+    assert predictions == {"model_0": 0.0, "model_1": 1.0, "model_2": 2.0, "model_3": 3.0}
+    assert get_inference_pool(4) is get_inference_pool(4)
+
+
+def test_a_failed_prediction_raises() -> None:
+    def _predict(model: SimpleNamespace) -> float:
+        raise ValueError(f"{model.model_name} failed")
+
+    with pytest.raises(ValueError, match="broken failed"):
+        predict_concurrently(get_inference_pool(2), [SimpleNamespace(model_name="broken")], _predict)
@@ -0,0 +1,29 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from app.mlcode.instrumentation import RunMetrics
+
+
+def test_run_metrics_writes_one_json_line_per_run(tmp_path: Path) -> None:
+    metrics_filename = str(tmp_path / "btc_run_metrics.jsonl")
+
+    for _ in range(2):
+        run_metrics = RunMetrics("btc")
+        with run_metrics.stage("slice_df"):
+            sum(range(10_000))
+        with run_metrics.model_stage("nbeats_btc_lookback_2", "fit"):
+            pass
+        with pytest.raises(ValueError):
+            with run_metrics.stage("train_models"):
+                raise ValueError("failed stages are still recorded")
+        run_metrics.write(metrics_filename, running_on_aws=False)
+
+    with open(metrics_filename) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 2
+    assert records[0]["coin"] == "btc"
+    assert set(records[0]["stages"]) == {"slice_df", "train_models"}
+    assert set(records[0]["stages"]["slice_df"]) == {"wall_seconds", "cpu_seconds", "peak_rss_mb"}
+    assert records[0]["models"]["nbeats_btc_lookback_2"]["fit"]["wall_seconds"] >= 0
@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+from typing import List
+
+LOG_SCRIPT = """
+from app.mlcode.utils import setup_logging
+logger = setup_logging()
+logger.info("price prediction = %s", 123.4)
+prices = [1.0]
+logger.info("prices = %s", prices)
+prices.append(2.0)  # logged before this
+logger.debug("every config key")
+try:
+    1 / 0
+except ZeroDivisionError:
+    logger.exception("failed")
+"""
+
+
+def _log_lines(log_mode: str) -> List[str]:
+    result = subprocess.run(
+        [sys.executable, "-c", LOG_SCRIPT],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "GO_TRADER_LOG_MODE": log_mode},
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stderr.strip().splitlines()
+
+
+def test_production_logging_writes_json_events() -> None:
+    events = [json.loads(line) for line in _log_lines("production")]
+    assert [event["message"] for event in events] == ["price prediction = 123.4", "prices = [1.0]", "failed"]
+    assert events[0]["level"] == "INFO"
+    assert events[0]["func"] == "<module>"
+    assert "ZeroDivisionError" in events[2]["exception"]
+
+
+def test_verbose_logging_includes_debug_logs() -> None:
+    log_text = "\n".join(_log_lines("verbose"))
+    assert "price prediction = 123.4" in log_text
+    assert "every config key" in log_text
@@ -0,0 +1,45 @@
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, Tuple
+
+from app.mlcode.predict_price_movements import CoinPricePredictor
+
+if TYPE_CHECKING:
+    from darts import TimeSeries
+
+os.environ["ON_LOCAL"] = "True"
+
+MakePredictor = Callable[..., Tuple[CoinPricePredictor, "TimeSeries", "TimeSeries"]]
+
+
+def _trained_predictor(make_predictor: MakePredictor, ml_config: Dict[Any, Any], cache: dict) -> CoinPricePredictor:
+    predictor, train_close_series, ts_stacked_series = make_predictor(ml_constants=ml_config, feature_cache=cache)
+    predictor._train_models(train_close_series, ts_stacked_series)
+    predictor._make_base_predictions_dict(train_close_series, ts_stacked_series)
+    return predictor
+
+
+def test_rerun_on_the_same_inputs_reuses_the_trained_models(
+    ml_config: Dict[Any, Any], make_predictor: MakePredictor
+) -> None:
+    cache: dict = {}
+    first = _trained_predictor(make_predictor, ml_config, cache)
+    assert set(first.run_metrics.extra["model_cache"].values()) == {"miss"}
+    assert "fit" in first.run_metrics.models[first.models[0][0].model_name]
+
+    rerun = _trained_predictor(make_predictor, ml_config, cache)
+    assert set(rerun.run_metrics.extra["model_cache"].values()) == {"hit"}
+    assert all("fit" not in metrics for metrics in rerun.run_metrics.models.values())
+    assert rerun.all_predictions_dict == first.all_predictions_dict
+
+    # other hyperparameters are another model
+    ml_config = {**ml_config, "hyperparameters_tcn": {**ml_config["hyperparameters_tcn"], "num_filters": 3}}
+    retrained = _trained_predictor(make_predictor, ml_config, cache)
+    assert sorted(retrained.run_metrics.extra["model_cache"].values()) == ["hit", "miss"]
+
+
+def test_each_model_trains_for_its_own_epochs(ml_config: Dict[Any, Any], make_predictor: MakePredictor) -> None:
+    ml_config["hyperparameters_tcn"]["epochs"] = 2
+    predictor = _trained_predictor(make_predictor, ml_config, {})
+    nbeats, tcn = predictor.models[0]
+    assert predictor.run_metrics.extra["scheduler"]["epochs"] == {nbeats.model_name: 1, tcn.model_name: 2}
+    assert (nbeats.total_epochs, tcn.total_epochs) == (1, 2)
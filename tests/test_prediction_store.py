@@ -0,0 +1,98 @@
+import json
+import os
+
+import pandas as pd
+
+import pytest
+
+from app.mlcode import prediction_store
+from app.mlcode.prediction_store import PredictionStore, _read_csv_tail, prediction_log_filename
+
+
+def _row(date: str, **predictions: float) -> dict:
+    return {"date": date, "date_prediction_for": date, **predictions, "stacking_prediction": 1.0}
+
+
+def test_rows_are_appended_and_compacted(tmp_path: str) -> None:
+    csv_filename = os.path.join(tmp_path, "btc_all_predictions.csv")
+    pd.DataFrame([_row("2022-01-01", nbeats=10.0, retired=5.0)]).to_csv(csv_filename, index=False)
+    store = PredictionStore(csv_filename, "date", False, compact_rows=3)
+    store.read()
+    store.append(_row("2022-01-02", nbeats=11.0))
+    store.append(_row("2022-01-03", nbeats=12.0, new=7.0))
+    assert len(pd.read_csv(csv_filename)) == 1  # only appended to the log
+
+    predictions_df = PredictionStore(csv_filename, "date", False).read()
+    assert list(predictions_df.index.strftime("%Y-%m-%d")) == ["2022-01-01", "2022-01-02", "2022-01-03"]
+    assert list(predictions_df["nbeats"]) == [10.0, 11.0, 12.0]
+    assert list(predictions_df["retired"]) == [5.0, 0.0, 0.0]
+    assert list(predictions_df["new"]) == [0.0, 0.0, 7.0]
+
+    store.append(_row("2022-01-04", nbeats=13.0))  # the third row compacts
+    with open(prediction_log_filename(csv_filename)) as f:
+        assert [json.loads(line)["compacted_rows"] for line in f] == [4]  # only the header is left
+    compacted_df = pd.read_csv(csv_filename, index_col=0, parse_dates=True)
+    assert list(compacted_df["nbeats"]) == [10.0, 11.0, 12.0, 13.0]
+    pd.testing.assert_frame_equal(compacted_df, PredictionStore(csv_filename, "date", False).read(), check_freq=False)
+
+
+def test_a_log_already_compacted_is_ignored(tmp_path: str) -> None:
+    csv_filename = os.path.join(tmp_path, "btc_all_predictions.csv")
+    log_filename = prediction_log_filename(csv_filename)
+    pd.DataFrame([_row("2022-01-01", nbeats=10.0), _row("2022-01-02", nbeats=11.0)]).to_csv(csv_filename, index=False)
+    # started on the first row, the csv has been compacted since. S3 still had the log
+    with open(log_filename, "w") as f:
+        f.write(json.dumps({"version": 1, "compacted_rows": 1}) + "\n")
+        f.write(json.dumps(_row("2022-01-02", nbeats=11.0)) + "\n")
+
+    store = PredictionStore(csv_filename, "date", False)
+    assert len(store.read()) == 2
+    store.append(_row("2022-01-03", nbeats=12.0))  # starts a new log
+    with open(log_filename) as f:
+        assert json.loads(f.readline())["compacted_rows"] == 2
+    assert list(PredictionStore(csv_filename, "date", False).read()["nbeats"]) == [10.0, 11.0, 12.0]
+
+
+def test_only_the_tail_is_read(tmp_path: str) -> None:
+    csv_filename = os.path.join(tmp_path, "btc_all_predictions.csv")
+    rows = [_row(f"2022-01-0{day}", nbeats=float(day)) for day in range(1, 6)]
+    pd.DataFrame(rows).to_csv(csv_filename, index=False)
+    store = PredictionStore(csv_filename, "date", False, compact_rows=2)
+    assert list(store.read(tail_rows=2)["nbeats"]) == [4.0, 5.0]
+    assert list(store.read(tail_rows=10)["nbeats"]) == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+    store.read(tail_rows=2)
+    store.append(_row("2022-01-06", nbeats=6.0))
+    with open(prediction_log_filename(csv_filename)) as f:
+        assert json.loads(f.readline())["compacted_rows"] == 5  # every csv row, not just the tail's
+    assert list(PredictionStore(csv_filename, "date", False).read(tail_rows=3)["nbeats"]) == [4.0, 5.0, 6.0]
+
+    store.append(_row("2022-01-07", nbeats=7.0))  # compacts every row
+    assert list(pd.read_csv(csv_filename)["nbeats"]) == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+
+
+def test_the_tail_is_read_from_the_end(tmp_path: str) -> None:
+    csv_filename = os.path.join(tmp_path, "btc_all_predictions.csv")
+    rows = [_row(f"2022-01-{day:02d}", nbeats=float(day)) for day in range(1, 21)]
+    pd.DataFrame(rows).to_csv(csv_filename, index=False)
+    # blocks shorter than a row
+    assert list(_read_csv_tail(csv_filename, 3, block_size=7)["nbeats"]) == [18.0, 19.0, 20.0]
+    assert len(_read_csv_tail(csv_filename, 50, block_size=7)) == 20
+
+
+def test_the_log_header_has_the_row_count(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    csv_filename = os.path.join(tmp_path, "btc_all_predictions.csv")
+    pd.DataFrame([_row("2022-01-01", nbeats=1.0)]).to_csv(csv_filename, index=False)
+    store = PredictionStore(csv_filename, "date", False, compact_rows=2)
+    store.read(tail_rows=1)  # no log yet, the rows are counted
+    store.append(_row("2022-01-02", nbeats=2.0))
+    store.append(_row("2022-01-03", nbeats=3.0))  # compacts
+
+    def _count_csv_rows(filename: str) -> int:
+        raise AssertionError("the header has the row count")
+
+    monkeypatch.setattr(prediction_store, "_count_csv_rows", _count_csv_rows)
+    store = PredictionStore(csv_filename, "date", False, compact_rows=2)
+    assert list(store.read(tail_rows=2)["nbeats"]) == [2.0, 3.0]
+    store.append(_row("2022-01-04", nbeats=4.0))
+    assert list(PredictionStore(csv_filename, "date", False).read(tail_rows=2)["nbeats"]) == [3.0, 4.0]
@@ -0,0 +1,55 @@
+from pathlib import Path
+
+from app.mlcode.coin_registry import LazyPriceData
+from app.mlcode.prediction_worker import PredictionWorker
+from app.mlcode.training_schedule import epoch_seconds_key
+
+
+def test_worker_replies_without_raising() -> None:
+    worker = PredictionWorker("tmp/constants.yml")
+    assert worker.handle({"command": "ping"}) == {"status": "ok", "command": "ping"}
+
+    reply = worker.handle({"command": "predict", "coin_to_predict": "doge"})
+    assert reply["status"] == "error"
+    assert "Incorrect coin to predict doge" in reply["error"]
+
+    assert worker.handle({"command": "train"})["status"] == "error"
+    assert worker.handle(["ping"]) == {"status": "error", "error": "A request is a json object, not list"}
+
+    worker.ml_constants["prediction_params"]["global_models"] = True
+    reply = worker.handle({"command": "predict", "coin_to_predict": "btc"})
+    assert "doesn't run global_models" in reply["error"]
+
+
+def test_lazy_price_data_drops_changed_csvs(tmp_path: Path) -> None:
+    csv_filename = str(tmp_path / "bitcoin.csv")
+    with open(csv_filename, "w") as f:
+        f.write("date,open,high,low,close,volume\n2022-01-01,1,2,0.5,1.5,10\n2022-01-02,1.5,2,1,1.8,12\n")
+    price_data = LazyPriceData({"date_col": "date", "bitcoin_csv_filename": csv_filename}, running_on_aws=False)
+
+    assert len(price_data.get("bitcoin_csv_filename")) == 2
+    assert price_data.refresh_stale() == []
+
+    # the Go app appends the newest candle
+    with open(csv_filename, "a") as f:
+        f.write("2022-01-03,1.8,2.2,1.7,2.1,9\n")
+
+    assert price_data.refresh_stale() == ["bitcoin_csv_filename"]
+    assert price_data.loaded_keys == []
+    assert len(price_data.get("bitcoin_csv_filename")) == 3
+
+
+def test_worker_keeps_the_epoch_times_when_a_csv_changes(tmp_path: Path) -> None:
+    csv_filename = str(tmp_path / "bitcoin.csv")
+    with open(csv_filename, "w") as f:
+        f.write("date,open,high,low,close,volume\n2022-01-01,1,2,0.5,1.5,10\n")
+    worker = PredictionWorker("tmp/constants.yml")
+    worker.refresh()
+    worker.price_data = LazyPriceData({"date_col": "date", "bitcoin_csv_filename": csv_filename}, running_on_aws=False)
+    worker.price_data.get("bitcoin_csv_filename")
+    worker.feature_cache = {epoch_seconds_key("nbeats_btc"): 0.5, "indicators_abc": "built from the old csv"}
+
+    with open(csv_filename, "a") as f:
+        f.write("2022-01-02,1.5,2,1,1.8,12\n")
+    worker.refresh()
+    assert worker.feature_cache == {epoch_seconds_key("nbeats_btc"): 0.5}
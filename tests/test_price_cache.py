@@ -0,0 +1,81 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from app.mlcode.utils import price_cache_filename, read_in_data
+
+PRICES_CSV = """date,open,high,low,close,volume
+2022-01-03,1.8,2.2,1.7,2.1,9
+2022-01-01,1.0,2.0,0.5,1.5,10
+2022-01-02,1.5,2.0,1.0,1.8,12
+"""
+
+
+@pytest.fixture
+def prices_csv(tmp_path: Path) -> str:
+    csv_filename = str(tmp_path / "historic_crypto_prices - btc.csv")
+    with open(csv_filename, "w") as f:
+        f.write(PRICES_CSV)
+    return csv_filename
+
+
+def test_read_in_data_uses_the_price_cache(prices_csv: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    from_csv = read_in_data(prices_csv, False, use_cache=False)
+    assert not os.path.exists(price_cache_filename(prices_csv))
+
+    assert read_in_data(prices_csv, False).equals(from_csv)  # writes the cache
+    assert os.path.exists(price_cache_filename(prices_csv))
+
+    def fail_read_csv(*args, **kwargs):  # type: ignore
+        raise AssertionError("should be read from the price cache")
+
+    monkeypatch.setattr(pd, "read_csv", fail_read_csv)
+    from_cache = read_in_data(prices_csv, False)
+    pd.testing.assert_frame_equal(from_cache, from_csv)
+    assert list(from_cache.dtypes) == ["float64", "float64", "float64", "float64", "int64"]
+
+
+def test_price_cache_is_invalidated_when_the_csv_changes(prices_csv: str) -> None:
+    assert len(read_in_data(prices_csv, False)) == 3
+
+    with open(prices_csv, "a") as f:
+        f.write("2022-01-04,2.1,2.5,2.0,2.4,11\n")
+
+    df = read_in_data(prices_csv, False)
+    assert len(df) == 4
+    assert df.index.max() == pd.Timestamp("2022-01-04")
+    pd.testing.assert_frame_equal(read_in_data(prices_csv, False), df)
+
+
+def test_appended_rows_are_parsed_on_their_own(prices_csv: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    read_in_data(prices_csv, False)
+    with open(prices_csv, "a") as f:  # like WriteNewCsvData in the go app
+        f.write("2022-01-04,2.1,2.5,2.0,2.4,11\n2021-12-31,0.9,1.0,0.8,0.95,8\n")
+
+    read_csv = pd.read_csv
+    parsed_rows = []
+
+    def counting_read_csv(filepath_or_buffer, *args, **kwargs):  # type: ignore
+        df = read_csv(filepath_or_buffer, *args, **kwargs)
+        parsed_rows.append(len(df))
+        return df
+
+    monkeypatch.setattr(pd, "read_csv", counting_read_csv)
+    incremental_df = read_in_data(prices_csv, False)
+    assert parsed_rows == [2]
+
+    pd.testing.assert_frame_equal(incremental_df, read_in_data(prices_csv, False, use_cache=False))
+    assert incremental_df.index.is_monotonic_increasing
+
+
+def test_rewritten_csv_is_read_in_again(prices_csv: str) -> None:
+    read_in_data(prices_csv, False)
+    # same rows plus one more, but an earlier row changed, so this isn't an append
+    with open(prices_csv, "w") as f:
+        f.write(PRICES_CSV.replace("1.8,2.2,1.7,2.1,9", "1.8,2.2,1.7,2.7,9") + "2022-01-04,2.1,2.5,2.0,2.4,11\n")
+
+    df = read_in_data(prices_csv, False)
+    pd.testing.assert_frame_equal(df, read_in_data(prices_csv, False, use_cache=False))
+    assert df.loc["2022-01-03", "close"] == 2.7
@@ -0,0 +1,48 @@
+import os
+from typing import Any, Dict
+
+import pandas as pd
+
+from app.mlcode.predict_price_movements import CoinPricePredictor
+from app.mlcode.prediction_store import prediction_log_filename
+from scripts.quantization_report import file_sizes, stacking_prediction
+
+os.environ["ON_LOCAL"] = "True"
+
+NBEATS = "nbeats_btc_lookback_2_window_2_std_1.5_num_add_dfs_1"
+TCN = "tcn_btc_lookback_2_window_2_std_1.5_num_add_dfs_1"
+
+
+def test_stacking_prediction_leaves_the_coins_predictions_alone(
+    tmp_path: str, example_btc_df: pd.DataFrame, constants: Dict[str, Any], ml_config: Dict[str, Any]
+) -> None:
+    all_predictions_filename = os.path.join(tmp_path, "btc_all_predictions.csv")
+    pd.DataFrame(
+        {
+            "date": ["2022-03-28", "2022-03-29"],
+            NBEATS: [995.0, 981.0],
+            TCN: [900.0, 1200.0],
+            "date_prediction_for": ["2022-03-29", "2022-03-30"],
+            "stacking_prediction": [990.0, 985.0],
+        }
+    ).to_csv(all_predictions_filename, index=False)
+    input_df = example_btc_df.set_axis(pd.to_datetime(example_btc_df.index))  # today is a date, not a Timestamp
+    predictor = CoinPricePredictor(
+        "btc", constants, ml_config, input_df, all_predictions_filename=all_predictions_filename
+    )
+    # a row in the log too, the go app uploads both
+    predictor.prediction_store.read()
+    predictor.prediction_store.append({"date": "2022-03-30", "date_prediction_for": "2022-03-31", NBEATS: 990.0})
+    store_filenames = [all_predictions_filename, prediction_log_filename(all_predictions_filename)]
+    store_sizes = file_sizes(store_filenames)
+
+    report_dir = os.path.join(tmp_path, "report")
+    os.makedirs(report_dir)
+    for predictions in [{NBEATS: 990.0, TCN: 1000.0}, {NBEATS: 991.0, TCN: 1000.0}]:
+        stacking_prediction(predictor, predictions, all_predictions_filename, report_dir)
+
+    assert file_sizes(store_filenames) == store_sizes
+    # each run starts over from a fresh copy, so the copy has one new row
+    copied_df = predictor._prediction_store().read()
+    assert len(copied_df) == 4
+    assert copied_df[NBEATS].iloc[-1] == 991.0
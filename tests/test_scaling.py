@@ -0,0 +1,54 @@
+from typing import Optional, cast
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.mlcode.scaling import MinMaxColumns, unique_component_names
+
+
+def _frame(seed: int, columns: list) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        rng.normal(100, 20, (60, len(columns))), columns=columns, index=pd.date_range("2022-01-01", periods=60)
+    )
+    df.iloc[:4, 0] = np.nan  # indicators start with NaNs
+    df[columns[-1]] = 5.0  # a constant column
+    return df
+
+
+def test_min_max_columns_match_stacked_darts_scalers() -> None:
+    from darts import TimeSeries
+    from darts.dataprocessing.transformers import Scaler
+
+    cols = ["rsi", "macd", "close"]
+    dfs = [_frame(1, cols), _frame(2, cols[:2]), _frame(3, cols)]
+
+    # what the predictor did before, a Scaler and a stack per column
+    stacked: Optional[TimeSeries] = None
+    for df in dfs:
+        for col in df.columns:
+            scaled = cast(TimeSeries, Scaler().fit_transform(TimeSeries.from_series(df[col], freq="24H")))
+            stacked = scaled if stacked is None else stacked.stack(scaled)
+    assert stacked is not None
+
+    scalers = [MinMaxColumns(list(df.columns)) for df in dfs]
+    values = np.hstack([scaler.fit_transform(df.to_numpy()) for scaler, df in zip(scalers, dfs)])
+    names = unique_component_names([scaler.columns for scaler in scalers])
+    one_shot = TimeSeries.from_times_and_values(dfs[0].index, values, freq="24H", columns=names)
+
+    assert list(one_shot.components) == list(stacked.components)
+    np.testing.assert_array_equal(one_shot.values(), stacked.values())
+
+    joined = MinMaxColumns.concatenate(scalers, names)
+    np.testing.assert_allclose(joined.inverse_transform(values), np.hstack([df.to_numpy() for df in dfs]))
+    np.testing.assert_allclose(joined.inverse_transform_column("rsi_1", values[:, 3]), dfs[1]["rsi"])
+    assert (joined.inverse_transform_column("close_1", values[:, -1]) == 5.0).all()
+
+
+def test_min_max_columns_reject_the_wrong_shape() -> None:
+    scaler = MinMaxColumns(["rsi", "macd"])
+    with pytest.raises(ValueError, match="Expected a"):
+        scaler.fit(np.zeros((3, 3)))
+    with pytest.raises(ValueError, match="not one of the scaled columns"):
+        scaler.fit(np.ones((3, 2))).inverse_transform_column("close", np.zeros(3))
@@ -0,0 +1,54 @@
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+
+from app.mlcode.state_store import CoinStateStore
+
+STATE_CONSTANTS = {
+    "trading_state_config_filename": "tmp/trading_state_config.yml",
+    "won_and_lost_amount_filename": "tmp/won_and_lost_config.yml",
+    "actions_to_take_filename": "tmp/actions_to_take.yml",
+    "state_filename": "tmp/state.yml",
+}
+
+
+@pytest.fixture
+def state_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """A working directory with btc's legacy state files in tmp/"""
+    (tmp_path / "tmp").mkdir()
+    for filename in ["btc_trading_state_config.yml", "btc_won_and_lost_config.yml", "btc_actions_to_take.yml"]:
+        shutil.copy(f"tmp/{filename}", tmp_path / "tmp" / filename)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_state_store_reads_the_legacy_files_until_it_is_written(state_dir: Path) -> None:
+    state_store = CoinStateStore("btc", STATE_CONSTANTS, running_on_aws=False)
+    state: Dict[str, Dict[str, Any]] = state_store.read()
+    assert state["trading_state"]["mode"] == "buy"
+    assert state["won_and_lost"]["n_buy_won"] == 2.0
+    assert state["actions_to_take"]["action_to_take"] == "buy_to_continue_buy"
+
+    state["actions_to_take"]["action_to_take"] = "buy_to_none"
+    state_store.write(state)
+
+    assert CoinStateStore("btc", STATE_CONSTANTS, running_on_aws=False).read() == state
+    # one state file and no temp files left behind
+    assert sorted(os.listdir(state_dir / "tmp")) == [
+        "btc_actions_to_take.yml",
+        "btc_state.yml",
+        "btc_trading_state_config.yml",
+        "btc_won_and_lost_config.yml",
+    ]
+
+
+def test_state_store_refuses_a_partial_state(state_dir: Path) -> None:
+    state_store = CoinStateStore("btc", STATE_CONSTANTS, running_on_aws=False)
+    state = state_store.read()
+    del state["won_and_lost"]
+    with pytest.raises(ValueError, match="missing"):
+        state_store.write(state)
+    assert not os.path.exists(state_dir / "tmp" / "btc_state.yml")
@@ -0,0 +1,64 @@
+from typing import TYPE_CHECKING, Callable, Tuple
+
+import numpy as np
+
+from app.mlcode.training_pool import (
+    fit_model,
+    get_training_pool,
+    load_trained_weights,
+    split_cores,
+    split_validation,
+)
+
+if TYPE_CHECKING:
+    from darts import TimeSeries
+    from darts.models import NBEATSModel
+
+
+def test_split_cores_between_workers() -> None:
+    assert split_cores(6, n_cores=12) == (6, 2)
+    assert split_cores(6, n_cores=4) == (4, 1)
+    assert split_cores(6, n_workers=2, n_cores=16) == (2, 8)
+    assert split_cores(2, n_workers=8, n_cores=16) == (2, 8)  # never more workers than models
+    assert split_cores(6, n_cores=1) == (1, 1)
+
+
+def test_model_trained_in_a_worker_predicts_like_one_trained_here(
+    make_darts_series: Callable[..., Tuple["TimeSeries", "TimeSeries"]],
+    make_nbeats_model: Callable[..., "NBEATSModel"],
+) -> None:
+    from darts import TimeSeries
+
+    series, covariates = make_darts_series(n_days=80)
+
+    here = make_nbeats_model("pool_test")
+    here.fit(series=series, past_covariates=[covariates], epochs=2)
+
+    in_worker = make_nbeats_model("pool_test")
+    trained = get_training_pool(1, 1).submit(in_worker, series, [covariates], epochs=2).result()
+    load_trained_weights(in_worker, series, [covariates], trained)
+
+    assert in_worker.total_epochs == 2
+    assert trained["metrics"]["wall_seconds"] > 0
+    predicted_in_worker, predicted_here = in_worker.predict(n=2), here.predict(n=2)
+    assert isinstance(predicted_in_worker, TimeSeries) and isinstance(predicted_here, TimeSeries)
+    np.testing.assert_allclose(predicted_in_worker.values(), predicted_here.values(), rtol=1e-6)
+
+
+def test_early_stopping_fine_tunes_the_best_epoch_on_the_tail(
+    make_darts_series: Callable[..., Tuple["TimeSeries", "TimeSeries"]],
+    make_nbeats_model: Callable[..., "NBEATSModel"],
+) -> None:
+    series, covariates = make_darts_series(n_days=80, seed=1)
+
+    train_series, val_series = split_validation(series, 5, 2, validation_windows=10)
+    assert len(train_series) == 69 and len(val_series) == 16
+    assert train_series.end_time() < val_series.time_index[5]  # the first validation target
+
+    model = make_nbeats_model("early_stopping_test")
+    fit = fit_model(model, series, [covariates], epochs=50, validation_windows=10, patience=2, tail_epochs=1)
+    assert fit["epochs"] < 50 and fit["epochs"] - fit["best_epoch"] == 2
+    # the best epoch's weights, then one epoch on the held out windows only, not a second training run
+    assert fit["tail_epochs"] == 1
+    assert model.training_series is not None and model.training_series.end_time() == series.end_time()
+    assert len(model.training_series) == len(val_series)
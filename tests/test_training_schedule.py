@@ -0,0 +1,84 @@
+import os
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.mlcode.predict_price_movements import CoinPricePredictor
+from app.mlcode.training_schedule import epoch_seconds_key, historical_errors, plan_within_budget
+
+if TYPE_CHECKING:
+    from darts import TimeSeries
+
+os.environ["ON_LOCAL"] = "True"
+
+NBEATS = "nbeats_btc_lookback_2_window_2_std_1.5_num_add_dfs_1"
+TCN = "tcn_btc_lookback_2_window_2_std_1.5_num_add_dfs_1"
+
+
+def test_plan_within_budget_skips_what_doesnt_fit() -> None:
+    assert plan_within_budget([60, 60, 60], slots=1, budget_seconds=100) == [True, False, False]
+    assert plan_within_budget([60, 60, 60], slots=2, budget_seconds=100) == [True, True, False]
+    # a cheaper job after a skipped one still runs
+    assert plan_within_budget([60, 60, 30], slots=1, budget_seconds=100) == [True, False, True]
+    # unknown cost runs, the best model always runs
+    assert plan_within_budget([500, None], slots=1, budget_seconds=10) == [True, True]
+
+
+def test_historical_errors_ignore_padded_predictions() -> None:
+    index = pd.date_range("2022-03-28", periods=3, name="date")
+    predictions_df = pd.DataFrame(
+        {
+            "date_prediction_for": [day + pd.Timedelta(days=1) for day in index],
+            "good": [990.0, 985.0, 0.0],
+            "bad": [0.0, 0.0, 1100.0],
+            "new": [0.0, 0.0, 0.0],
+        },
+        index=index,
+    )
+    close = pd.Series([958.0, 996.0, 982.0, 982.0], index=pd.date_range("2022-03-28", periods=4))
+    errors = historical_errors(predictions_df, close, ["good", "bad", "new", "missing"], "date_prediction_for")
+    assert errors == {"good": 4.5, "bad": 118.0}
+
+
+def test_deadline_skips_the_least_useful_model(
+    tmp_path: str,
+    ml_config: Dict[Any, Any],
+    make_predictor: Callable[..., Tuple[CoinPricePredictor, "TimeSeries", "TimeSeries"]],
+) -> None:
+    all_predictions_filename = os.path.join(tmp_path, "btc_all_predictions.csv")
+    pd.DataFrame(
+        {
+            "date": ["2022-03-28", "2022-03-29"],
+            NBEATS: [995.0, 981.0],
+            TCN: [900.0, 1200.0],
+            "date_prediction_for": ["2022-03-29", "2022-03-30"],
+            "stacking_prediction": [990.0, 985.0],
+        }
+    ).to_csv(all_predictions_filename, index=False)
+    ml_config["prediction_params"]["deadline_reserve_seconds"] = 0
+    # last run, each model took a minute per training window
+    cache = {epoch_seconds_key(NBEATS): 60.0, epoch_seconds_key(TCN): 60.0}
+
+    predictor, train_close_series, ts_stacked_series = make_predictor(
+        all_predictions_filename=all_predictions_filename, feature_cache=cache, deadline=time.time() + 30
+    )
+    predictor._train_models(train_close_series, ts_stacked_series)
+
+    scheduler = predictor.run_metrics.extra["scheduler"]
+    assert scheduler["order"] == [NBEATS, TCN]  # nbeats was closer to the close
+    assert scheduler["skipped"] == [TCN]
+    assert scheduler["epochs"] == {NBEATS: 1}
+
+    predictions_dict = predictor._make_base_predictions_dict(train_close_series, ts_stacked_series)
+    assert list(predictions_dict) == [NBEATS]
+    assert predictor._stale_predictions() == {TCN: 1200.0}
+
+    # the stale prediction is only today's stacking input, the saved row has no tcn prediction
+    predictor.stale_predictions = predictor._stale_predictions()
+    predictor._generate_base_predictions_df({**predictions_dict, TCN: np.nan})
+    prediction = predictor._make_stacking_prediction_and_save()
+    assert np.isfinite(prediction)
+    saved_df = predictor._prediction_store().read()
+    assert list(saved_df[TCN].iloc[:2]) == [900.0, 1200.0] and np.isnan(saved_df[TCN].iloc[-1])
@@ -0,0 +1,59 @@
+import os
+from typing import TYPE_CHECKING, Callable, Tuple
+
+import numpy as np
+
+from app.mlcode.training_pool import fit_model
+from app.mlcode.warm_start import load_checkpoint, model_params_hash, save_checkpoint, warm_start_filename
+
+if TYPE_CHECKING:
+    from darts import TimeSeries
+    from darts.models import NBEATSModel
+
+
+def test_warm_start_carries_on_from_the_saved_weights(
+    tmp_path: str,
+    make_darts_series: Callable[..., Tuple["TimeSeries", "TimeSeries"]],
+    make_nbeats_model: Callable[..., "NBEATSModel"],
+) -> None:
+    series, covariates = make_darts_series()
+    params_hash = model_params_hash({"model": "NBEATSModel", "layer_widths": 8})
+    filename = warm_start_filename(str(tmp_path), "nbeats_btc_lookback_5")
+    assert filename.endswith("nbeats_btc_lookback_5.warm_start.pt")  # no csv or yml, the go app would upload it
+
+    yesterday = make_nbeats_model("warm_start_test")
+    yesterday.fit(series=series, past_covariates=[covariates], epochs=2)
+    save_checkpoint(filename, yesterday, params_hash, series.end_time(), fine_tunes=0)
+
+    checkpoint = load_checkpoint(filename, params_hash)
+    assert checkpoint is not None and checkpoint["last_date"] == series.end_time().isoformat()
+    assert yesterday.model is not None
+    for name, weights in yesterday.model.state_dict().items():
+        np.testing.assert_array_equal(checkpoint["state_dict"][name].numpy(), weights.numpy())
+
+    # fine tuning on the newest rows only
+    today = make_nbeats_model("warm_start_test")
+    fit_model(today, series[-10:], [covariates[-10:]], epochs=1, initial_weights=checkpoint)
+    assert today.total_epochs == 3
+    today.predict(n=2, series=series, past_covariates=[covariates])
+
+
+def test_warm_start_needs_the_same_hyperparameters(
+    tmp_path: str,
+    make_darts_series: Callable[..., Tuple["TimeSeries", "TimeSeries"]],
+    make_nbeats_model: Callable[..., "NBEATSModel"],
+) -> None:
+    series, covariates = make_darts_series()
+    filename = warm_start_filename(str(tmp_path), "tcn_btc_lookback_5")
+    assert load_checkpoint(filename, "abc") is None  # no checkpoint yet
+
+    model = make_nbeats_model("warm_start_test")
+    model.fit(series=series, past_covariates=[covariates], epochs=1)
+    save_checkpoint(filename, model, model_params_hash({"layer_widths": 8}), series.end_time(), fine_tunes=3)
+    assert load_checkpoint(filename, model_params_hash({"layer_widths": 16})) is None
+    assert load_checkpoint(filename, model_params_hash({"layer_widths": 8}))["fine_tunes"] == 3
+
+    with open(filename, "wb") as f:
+        f.write(b"half written")
+    assert load_checkpoint(filename, model_params_hash({"layer_widths": 8})) is None
+    assert os.listdir(tmp_path) == [os.path.basename(filename)]